@@ -14,3 +14,13 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'limit_counter.settings')
 
 application = get_asgi_application()
+
+# element streams are served outside of Django, see services.streams
+from services.streams import StreamApplication  # noqa: E402
+
+application = StreamApplication(application)
+
+# the readiness endpoint answers 503 until this worker is warm
+from services.warmup import start_warm_up  # noqa: E402
+
+start_warm_up()
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 
 import os
 
+from corsheaders.defaults import default_headers
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -42,14 +44,14 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
 	'django.middleware.security.SecurityMiddleware',
+	'corsheaders.middleware.CorsMiddleware',
+	'services.admission.AdmissionMiddleware',
 	'django.contrib.sessions.middleware.SessionMiddleware',
 	'django.middleware.common.CommonMiddleware',
 	'django.middleware.csrf.CsrfViewMiddleware',
 	'django.contrib.auth.middleware.AuthenticationMiddleware',
 	'django.contrib.messages.middleware.MessageMiddleware',
 	'django.middleware.clickjacking.XFrameOptionsMiddleware',
-	'corsheaders.middleware.CorsMiddleware',
-	'django.middleware.common.CommonMiddleware',
 ]
 
 ROOT_URLCONF = 'limit_counter.urls'
@@ -119,7 +121,83 @@ USE_TZ = True
 STATIC_URL = '/static/'
 
 AEROSPIKE_NS = 'limit_counter'
+# how many of the hottest records are kept per counter
+TOP_K_SIZE = 100
+# records the top of every set is spread over, by record id
+TOP_K_SHARDS = 8
+# set-wide maintenance scans, records_per_second = 0 disables the throttle
+SCAN_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+SCAN_BATCH_SIZE = 64
+SCAN_RECORDS_PER_SECOND = 0
+# number of buckets a windowed counter is split into, more buckets slide more smoothly
+WINDOW_BUCKETS = 10
+# seconds element statistics are served from the cache before they are recomputed
+STATS_CACHE_TTL = 10
+# seconds an uncommitted reservation holds its quota by default and at most
+RESERVATION_TTL = 60
+RESERVATION_MAX_TTL = 3600
+# record ids a bulk delete by uids accepts, larger deletes go through a filter
+BULK_DELETE_MAX_UIDS = 1000
+# aggregate limits spread their usage over stripes, one increment takes at most that many round trips
+AGGREGATE_MAX_STRIPES = 64
+
+# clusters platforms and elements can be placed on besides the default one, name -> client
+# config (hosts, policies...) merged over the default client config
+AEROSPIKE_CLUSTERS = {
+	'default': {},
+}
+# seconds an Idempotency-Key of an increment is remembered and how many are kept per record
+IDEMPOTENCY_TTL = 24 * 60 * 60
+IDEMPOTENCY_MAX_KEYS = 100
+
+# load shedding applied before any work is done for a request, per process. Limits are
+# {'concurrency': requests in flight, 'rate': requests per second, 'burst': bucket size} and
+# 0 disables a limit. 'global' covers every request, 'platform' is the default of every platform,
+# 'platforms' overrides it per slug and 'routes' limits url names. The admission/ endpoint
+# overrides these at runtime, the overrides are stored in Aerospike and shared by every worker.
+ADMISSION_CONTROL = {
+	'enabled': True,
+	'global': {'concurrency': 0},
+	'platform': {'concurrency': 0, 'rate': 0, 'burst': 0},
+	'platforms': {},
+	'routes': {},
+}
+# seconds before runtime overrides made by other processes are picked up
+ADMISSION_REFRESH_INTERVAL = 5
+
+# element streams (server-sent events) open per process and seconds between keepalive comments
+STREAM_MAX_SUBSCRIBERS = 1000
+STREAM_KEEPALIVE_INTERVAL = 15
+
+# counter totals and counters cached per process for reads accepting some staleness, at most
+# READ_CACHE_SIZE of each, and the largest staleness (milliseconds) a counter or request may accept
+READ_CACHE_SIZE = 100000
+READ_CACHE_MAX_STALENESS = 5000
+
+# concurrent requests sent to every namespace on start, to open the client connections up front
+WARM_UP_CONNECTIONS = 8
+# seconds before a failed warm up is retried, doubled after every failure up to the max
+WARM_UP_RETRY_DELAY = 1
+WARM_UP_MAX_RETRY_DELAY = 30
+
+# seconds a moving element waits for in flight writes before its records are copied
+PLACEMENT_FREEZE_GRACE = 1
+
+# optional log of every counter change, backend is None (disabled), 'file' or 'aerospike'
+EVENT_SINK = {
+	'backend': None,
+	'capacity': 100000,
+	'batch_size': 1000,
+	'flush_interval': 1.0,
+	# file backend, every process writes to path with its pid before the extension and rotates
+	# and gzips its file once it reaches max_bytes
+	'path': os.path.join(BASE_DIR, 'events', 'events.ndjson'),
+	'max_bytes': 64 * 1024 * 1024,
+}
 CORS_ORIGIN_ALLOW_ALL = True
+CORS_ALLOW_HEADERS = list(default_headers) + ['idempotency-key']
+# serve counter actions through services.fastpath instead of the full middleware/DRF stack
+FAST_PATH_ENABLED = True
 
 
 def skip_get_requests(record):
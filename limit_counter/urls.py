@@ -16,7 +16,12 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from services.views import admission, metrics, readiness
+
 urlpatterns = [
 	path('admin/', admin.site.urls),
+	path('metrics/', metrics, name='metrics'),
+	path('admission/', admission, name='admission'),
+	path('ready/', readiness, name='ready'),
 	path('v1/', include('services.urls')),
 ]
@@ -14,3 +14,13 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'limit_counter.settings')
 
 application = get_wsgi_application()
+
+# counter actions skip the middleware chain and DRF, see services.fastpath
+from services.fastpath import FastPathApplication  # noqa: E402
+
+application = FastPathApplication(application)
+
+# the readiness endpoint answers 503 until this worker is warm
+from services.warmup import start_warm_up  # noqa: E402
+
+start_warm_up()
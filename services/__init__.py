@@ -1,9 +1,17 @@
+import os
+
 import aerospike
 from aerospike import exception
 
+default_app_config = 'services.apps.ServicesConfig'
+
+UDF_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'udf')
+
 config = {
 	'hosts': [("aerospike", 3000)],
 	'policies': {'key': aerospike.POLICY_KEY_SEND},
+	# stream UDFs are reduced on the client as well
+	'lua': {'user_path': UDF_DIR},
 }
 
 try:
@@ -0,0 +1,229 @@
+import collections
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from aerospike import exception
+
+from services import read_cache
+
+from services.aerospike_utils import (AGGREGATE_SET, get_touch_ttl, give_back_aggregate, has_idempotency_key,
+									  increment_counters, read_bins, refund_aggregate, take_aggregate, update_top)
+from services.events import record_event
+from services.models import Counter
+from services.placement import get_placement, get_platform_placement
+from services.streams import publish_values
+
+HTTP_440_FULL = 440
+HTTP_441_NOT_EXIST = 441
+HTTP_442_ALREADY_EXIST = 442
+MOVING_MESSAGE = {'detail': 'element is being moved to another placement, retry later'}
+IDEMPOTENCY_KEY_LENGTH = 64
+NOT_AN_OBJECT_MESSAGE = {'detail': 'request body must be an object'}
+# expired reservations are dropped inside the record UDF, where their aggregate share could not be given back
+AGGREGATED_RESERVATION_MESSAGE = {'counter': 'counters with aggregate limits cannot be reserved'}
+
+
+# raised where a response cannot be returned, e.g. from perform_create or serializer validation
+class ElementMoving(APIException):
+	status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+	default_detail = MOVING_MESSAGE['detail']
+	default_code = 'moving'
+
+
+# Counter actions return (payload, status) pairs, so that the DRF views and the
+# lean WSGI fast path (services.fastpath) share the same behaviour.
+
+def get_counter(platform, element, slug):
+	return Counter.objects.select_related('element__platform').prefetch_related('aggregates').get(
+		element__platform__slug=platform, element__slug=element, slug=slug)
+
+
+def get_positive_value(data):
+	value = int(data['value'])
+	if value < 0:
+		raise ValueError()
+	return value
+
+
+def check_idempotency_key(idempotency_key):
+	if idempotency_key is not None and not 0 < len(idempotency_key) <= IDEMPOTENCY_KEY_LENGTH:
+		return {'Idempotency-Key': f"must be 1 to {IDEMPOTENCY_KEY_LENGTH} characters long"}
+	return None
+
+
+def get_increment_error(result):
+	if result['status'] == status.HTTP_422_UNPROCESSABLE_ENTITY:
+		return {'Idempotency-Key': 'was already used for a different increment'}
+	return None
+
+
+def take_aggregates(platform, uid, values):
+	aggregates = {}
+	amounts = collections.Counter()
+	for counter, value in values.items():
+		for aggregate in counter.aggregates.all():
+			aggregates[aggregate.id] = aggregate
+			amounts[aggregate.id] += value
+	placement = get_platform_placement(platform, AGGREGATE_SET)
+	taken = []
+	for aggregate_id, amount in amounts.items():
+		stripes = take_aggregate(placement, aggregates[aggregate_id], uid, amount)
+		if stripes is None:
+			give_back_aggregates(placement, taken)
+			return placement, None, aggregates[aggregate_id]
+		taken.append((aggregates[aggregate_id], stripes))
+	return placement, taken, None
+
+
+def give_back_aggregates(placement, taken):
+	for aggregate, stripes in taken:
+		give_back_aggregate(placement, aggregate, stripes)
+
+
+def get_aggregate_error(aggregate):
+	return {'aggregate': f"max value of {aggregate.slug} would be exceeded"}
+
+
+# Aggregate limits are taken before the record is incremented and given back when the
+# increment fails, raises or is replayed, so their usage never counts a change that did not
+# happen. Returns the increment result, or None and the aggregate that is full.
+# Known replays skip the aggregates, so a retry gets its replay even once an aggregate is full.
+def increment_with_aggregates(platform, placement, uid, values, ttl, idempotency_key):
+	if not any(counter.aggregates.all() for counter in values) or (
+			idempotency_key is not None and has_idempotency_key(placement, uid, idempotency_key)):
+		return increment_counters(placement, uid, values, ttl, idempotency_key), None
+	aggregate_placement, taken, full = take_aggregates(platform, uid, values)
+	if full is not None:
+		return None, full
+	try:
+		result = increment_counters(placement, uid, values, ttl, idempotency_key)
+	except Exception:
+		give_back_aggregates(aggregate_placement, taken)
+		raise
+	if result['status'] != status.HTTP_200_OK or result.get('replayed'):
+		give_back_aggregates(aggregate_placement, taken)
+	return result, None
+
+
+def get_aggregated_counters(element):
+	return [counter for counter in element.counters.prefetch_related('aggregates') if counter.aggregates.all()]
+
+
+# Deleted records give the usage of their counters back to the aggregates, records expiring
+# through their TTL or deleted by a filter do not, their usage is dropped by the aggregate reset.
+def give_back_record(platform, uid, totals):
+	placement = get_platform_placement(platform, AGGREGATE_SET)
+	for counter, total in totals.items():
+		for aggregate in counter.aggregates.all():
+			refund_aggregate(placement, aggregate, uid, total)
+
+
+# Reads accepting some staleness, through max_staleness or the counter default, are served
+# from the worker cache while the cached total is fresh enough. Those do not refresh the TTL.
+def read_counter(platform, element, uid, counter, max_staleness=None):
+	try:
+		max_staleness = read_cache.get_max_staleness(max_staleness)
+	except (TypeError, ValueError):
+		message = f"must be between 0 and {settings.READ_CACHE_MAX_STALENESS} milliseconds"
+		return {'max_staleness': message}, status.HTTP_400_BAD_REQUEST
+	value = read_cache.get(platform, element, uid, counter, max_staleness)
+	if value is not None:
+		return value, status.HTTP_200_OK
+
+	try:
+		counter = get_counter(platform, element, counter)
+		placement = get_placement(counter.element)
+		bins = read_bins(placement, uid, [str(counter.id)], get_touch_ttl(counter.element))
+	except (exception.AerospikeError, Counter.DoesNotExist):
+		return None, HTTP_441_NOT_EXIST
+	value = counter.get_total(bins[str(counter.id)])
+	if read_cache.get_bound(counter, max_staleness):
+		read_cache.put(platform, element, placement, uid, counter, value)
+	return value, status.HTTP_200_OK
+
+
+# A retry carrying the same idempotency key replays the stored result without counting again.
+def increment_counter(platform, element, uid, counter, data, idempotency_key=None):
+	try:
+		value = get_positive_value(data)
+	except (KeyError, TypeError, ValueError):
+		return {'value': 'must be a positive integer'}, status.HTTP_400_BAD_REQUEST
+	error = check_idempotency_key(idempotency_key)
+	if error:
+		return error, status.HTTP_400_BAD_REQUEST
+
+	try:
+		counter = get_counter(platform, element, counter)
+	except Counter.DoesNotExist:
+		return None, HTTP_441_NOT_EXIST
+	if counter.element.moving:
+		return MOVING_MESSAGE, status.HTTP_503_SERVICE_UNAVAILABLE
+
+	placement = get_placement(counter.element)
+	ttl = get_touch_ttl(counter.element)
+	result, full = increment_with_aggregates(
+		counter.element.platform, placement, uid, {counter: value}, ttl, idempotency_key)
+	if full is not None:
+		return get_aggregate_error(full), HTTP_440_FULL
+	if result['status'] != status.HTTP_200_OK:
+		return get_increment_error(result), result['status']
+	counter_value = result['values'][str(counter.id)]
+	if result.get('replayed'):
+		return counter_value, status.HTTP_200_OK
+	update_top(placement, counter.id, uid, counter_value)
+	record_event(platform, element, uid, counter.slug, value)
+	publish_values(placement, uid, {counter: counter_value})
+	read_cache.write_through(placement, uid, counter, counter_value)
+	return counter_value, status.HTTP_200_OK
+
+
+def increment_record(platform, element, uid, data, idempotency_key=None):
+	values = {}
+	errors = {}
+	data = data if isinstance(data, dict) else {}
+	for slug, value in data.items():
+		try:
+			values[slug] = int(value)
+			if values[slug] < 0:
+				raise ValueError()
+		except (TypeError, ValueError):
+			errors[slug] = 'must be a positive integer'
+	if errors or not values:
+		errors = errors or {'counters': 'at least one counter is required'}
+		return errors, status.HTTP_400_BAD_REQUEST
+	error = check_idempotency_key(idempotency_key)
+	if error:
+		return error, status.HTTP_400_BAD_REQUEST
+
+	counters = Counter.objects.select_related('element__platform').prefetch_related('aggregates').filter(
+		element__platform__slug=platform, element__slug=element, slug__in=values.keys())
+	if len(counters) != len(values):
+		return None, HTTP_441_NOT_EXIST
+	if counters[0].element.moving:
+		return MOVING_MESSAGE, status.HTTP_503_SERVICE_UNAVAILABLE
+
+	values = {counter: values[counter.slug] for counter in counters}
+	placement = get_placement(counters[0].element)
+	ttl = get_touch_ttl(counters[0].element)
+	result, full = increment_with_aggregates(
+		counters[0].element.platform, placement, uid, values, ttl, idempotency_key)
+	if full is not None:
+		return get_aggregate_error(full), HTTP_440_FULL
+	if result['status'] in (HTTP_441_NOT_EXIST, status.HTTP_422_UNPROCESSABLE_ENTITY):
+		return get_increment_error(result), result['status']
+	if result['status'] == HTTP_440_FULL:
+		slug = next(counter.slug for counter in counters if str(counter.id) == result['bin'])
+		return {slug: 'max value would be exceeded'}, HTTP_440_FULL
+
+	response = collections.OrderedDict(id=uid)
+	for counter in counters:
+		counter_value = result['values'][str(counter.id)]
+		if not result.get('replayed'):
+			update_top(placement, counter.id, uid, counter_value)
+			record_event(platform, element, uid, counter.slug, values[counter])
+			read_cache.write_through(placement, uid, counter, counter_value)
+		response[counter.slug] = counter_value
+	if not result.get('replayed'):
+		publish_values(placement, uid, {counter: response[counter.slug] for counter in counters})
+	return response, status.HTTP_200_OK
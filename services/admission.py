@@ -0,0 +1,273 @@
+import copy
+import json
+import logging
+import math
+import threading
+import time
+
+import aerospike
+from aerospike import exception
+from django.conf import settings
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+from rest_framework import status
+
+from services import aerospike_db
+
+logger = logging.getLogger('django')
+
+CONFIG_SET = 'config'
+ADMISSION_KEY = 'admission'
+LIMIT_FIELDS = ('concurrency', 'rate', 'burst')
+# routes operators need while the service is overloaded are never limited
+EXEMPT_ROUTES = ('metrics', 'admission', 'ready')
+# platform slugs come from the url before anything is looked up, so their number is capped
+MAX_PLATFORM_LIMITERS = 1000
+OTHER_PLATFORMS = '*'
+
+
+class Rejected(Exception):
+	def __init__(self, status_code, detail, retry_after):
+		super().__init__(detail)
+		self.status_code = status_code
+		self.detail = detail
+		self.retry_after = retry_after
+
+	def get_headers(self):
+		return [('Retry-After', str(self.retry_after))]
+
+
+# A concurrency limit (requests in flight) and a token bucket (rate per second, burst size).
+# A limit of 0 is disabled.
+class Limiter:
+	def __init__(self, limits):
+		self.lock = threading.Lock()
+		self.in_flight = 0
+		self.rate = 0
+		self.tokens = 0
+		self.last_check = time.monotonic()
+		self.metrics = {'admitted': 0, 'overloaded': 0, 'throttled': 0}
+		self.configure(limits)
+
+	def configure(self, limits):
+		with self.lock:
+			burst = limits.get('burst', 0) or limits.get('rate', 0)
+			# a bucket that was not limited yet starts full
+			self.tokens = min(self.tokens, burst) if self.rate else burst
+			self.concurrency = limits.get('concurrency', 0)
+			self.rate = limits.get('rate', 0)
+			self.burst = burst
+
+	def acquire(self):
+		with self.lock:
+			if self.concurrency and self.in_flight >= self.concurrency:
+				self.metrics['overloaded'] += 1
+				raise Rejected(status.HTTP_503_SERVICE_UNAVAILABLE, 'too many requests in flight', 1)
+			if self.rate:
+				now = time.monotonic()
+				self.tokens = min(self.burst, self.tokens + (now - self.last_check) * self.rate)
+				self.last_check = now
+				if self.tokens < 1:
+					self.metrics['throttled'] += 1
+					retry_after = math.ceil((1 - self.tokens) / self.rate)
+					raise Rejected(status.HTTP_429_TOO_MANY_REQUESTS, 'request budget exhausted', retry_after)
+				self.tokens -= 1
+			self.in_flight += 1
+			self.metrics['admitted'] += 1
+
+	def release(self):
+		with self.lock:
+			self.in_flight -= 1
+
+	def get_metrics(self):
+		with self.lock:
+			return dict(self.metrics, in_flight=self.in_flight)
+
+
+def get_overrides_key():
+	return settings.AEROSPIKE_NS, CONFIG_SET, ADMISSION_KEY
+
+
+# overrides live in Aerospike so that every worker of every host reads the same ones
+def get_overrides():
+	try:
+		_, _, bins = aerospike_db.get(get_overrides_key())
+	except exception.RecordNotFound:
+		return {}
+	return json.loads(bins['overrides'])
+
+
+def store_overrides(overrides):
+	aerospike_db.put(get_overrides_key(), {'overrides': json.dumps(overrides)},
+					 meta={'ttl': aerospike.TTL_NEVER_EXPIRE})
+
+
+def merge_config(config, overrides):
+	merged = copy.deepcopy(config)
+	for key, value in overrides.items():
+		if isinstance(value, dict) and isinstance(merged.get(key), dict):
+			merged[key] = merge_config(merged[key], value)
+		else:
+			merged[key] = value
+	return merged
+
+
+def validate_overrides(overrides):
+	if not isinstance(overrides, dict):
+		raise ValueError('must be an object')
+	for key, value in overrides.items():
+		if key == 'enabled':
+			if not isinstance(value, bool):
+				raise ValueError('enabled must be a boolean')
+		elif key in ('global', 'platform'):
+			validate_limits(key, value)
+		elif key in ('platforms', 'routes'):
+			if not isinstance(value, dict):
+				raise ValueError(f"{key} must be an object")
+			for name, limits in value.items():
+				validate_limits(f"{key}.{name}", limits)
+		else:
+			raise ValueError(f"unknown key {key}")
+
+
+def validate_limits(name, limits):
+	if not isinstance(limits, dict):
+		raise ValueError(f"{name} must be an object")
+	for field, value in limits.items():
+		if field not in LIMIT_FIELDS or not isinstance(value, (int, float)) or value < 0:
+			raise ValueError(f"{name} limits are {', '.join(LIMIT_FIELDS)} and must not be negative")
+
+
+# Every process keeps its own limiters. Their limits come from settings.ADMISSION_CONTROL
+# merged with the overrides stored in Aerospike, which a background thread reloads every few
+# seconds so they can be changed at runtime without requests ever waiting on Aerospike.
+# While Aerospike cannot be read the last ones are kept.
+class AdmissionController:
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.start_lock = threading.Lock()
+		self.thread = None
+		self.config = None
+		self.overrides = {}
+		self.global_limiter = Limiter({})
+		self.platforms = {}
+		self.routes = {}
+
+	def get_config(self):
+		if self.thread is None:
+			self.start()
+		return self.config
+
+	def start(self):
+		# started by the first request rather than on import, so forked workers get a thread of their own
+		with self.start_lock:
+			if self.thread is None:
+				self.load(self.overrides)
+				self.thread = threading.Thread(target=self.run, name='admission-refresh', daemon=True)
+				self.thread.start()
+
+	def run(self):
+		while True:
+			self.refresh()
+			time.sleep(settings.ADMISSION_REFRESH_INTERVAL)
+
+	def refresh(self):
+		try:
+			overrides = get_overrides()
+		except exception.AerospikeError:
+			logger.exception("failed to read the admission overrides")
+			return
+		self.load(overrides)
+
+	def load(self, overrides):
+		with self.lock:
+			self.overrides = overrides
+			self.config = merge_config(settings.ADMISSION_CONTROL, overrides)
+			self.global_limiter.configure(self.config['global'])
+			for slug, limiter in self.platforms.items():
+				limiter.configure(self.get_platform_limits(slug))
+			for name, limiter in self.routes.items():
+				limiter.configure(self.config['routes'].get(name, {}))
+
+	def set_overrides(self, overrides):
+		validate_overrides(overrides)
+		store_overrides(overrides)
+		self.load(overrides)
+
+	def get_platform_limits(self, slug):
+		return dict(self.config['platform'], **self.config['platforms'].get(slug, {}))
+
+	def get_limiter(self, limiters, name, limits):
+		limiter = limiters.get(name)
+		if limiter is None:
+			with self.lock:
+				if name not in limiters:
+					limiters[name] = Limiter(limits)
+				limiter = limiters[name]
+		return limiter
+
+	def get_limiters(self, platform, route):
+		config = self.get_config()
+		limiters = [self.global_limiter]
+		if platform is not None:
+			if platform not in self.platforms and len(self.platforms) >= MAX_PLATFORM_LIMITERS:
+				platform = OTHER_PLATFORMS
+			limiters.append(self.get_limiter(self.platforms, platform, self.get_platform_limits(platform)))
+		if route in config['routes']:
+			limiters.append(self.get_limiter(self.routes, route, config['routes'][route]))
+		return limiters
+
+	def admit(self, platform, route):
+		if not self.get_config()['enabled'] or route in EXEMPT_ROUTES:
+			return []
+		acquired = []
+		try:
+			for limiter in self.get_limiters(platform, route):
+				limiter.acquire()
+				acquired.append(limiter)
+		except Rejected:
+			self.release(acquired)
+			raise
+		return acquired
+
+	def release(self, limiters):
+		for limiter in limiters:
+			limiter.release()
+
+	def get_metrics(self):
+		return {
+			'global': self.global_limiter.get_metrics(),
+			'platforms': {slug: limiter.get_metrics() for slug, limiter in list(self.platforms.items())},
+			'routes': {name: limiter.get_metrics() for name, limiter in list(self.routes.items())},
+		}
+
+
+controller = AdmissionController()
+
+
+def get_route(path):
+	try:
+		match = resolve(path)
+	except Resolver404:
+		return None, None
+	return match.kwargs.get('platform'), match.url_name
+
+
+# Sheds load before the view runs, so rejected requests cost no ORM or Aerospike work.
+class AdmissionMiddleware:
+	def __init__(self, get_response):
+		self.get_response = get_response
+
+	def __call__(self, request):
+		platform, route = get_route(request.path_info)
+		try:
+			acquired = controller.admit(platform, route)
+		except Rejected as e:
+			response = JsonResponse({'detail': e.detail}, status=e.status_code)
+			for header, value in e.get_headers():
+				response[header] = value
+			return response
+		try:
+			return self.get_response(request)
+		finally:
+			controller.release(acquired)
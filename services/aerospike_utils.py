@@ -1,35 +1,440 @@
 import collections
+import concurrent.futures
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
 
-from services import aerospike_db
+import aerospike
+from aerospike import exception
+from aerospike_helpers.operations import map_operations, operations
+from django.conf import settings
+
+from services import aerospike_db, UDF_DIR
 from services.models import Counter
 
+TOP_SET = 'top'
+AGGREGATE_SET = 'aggregates'
+PARTITIONS = 4096
+UDF_MODULE = 'limit_counter'
+STATS_MODULE = 'limit_counter_stats'
+STATS_BUCKETS = 10
+
+logger = logging.getLogger('django')
+
+
+def register_udfs(client=aerospike_db):
+	for file_name in sorted(os.listdir(UDF_DIR)):
+		if file_name.endswith('.lua'):
+			client.udf_put(os.path.join(UDF_DIR, file_name))
+
+
+# Records are written with the element ttl when they are created. Later writes either
+# restart it (when the element refreshes ttl on touch) or leave the expiration as is.
+def get_touch_ttl(element):
+	return element.record_ttl if element.refresh_ttl_on_touch else aerospike.TTL_DONT_UPDATE
+
+
+def get_remaining_ttl(meta):
+	if meta['ttl'] >= 0xFFFFFFFF:
+		return aerospike.TTL_NEVER_EXPIRE
+	return meta['ttl']
+
+
+# Functions taking a placement work on the element set it points to, see services.placement.
+def read_bins(placement, record_id, bin_names, ttl=aerospike.TTL_DONT_UPDATE):
+	key = placement.key(record_id)
+	if ttl == aerospike.TTL_DONT_UPDATE:
+		_, _, bins = placement.client.select(key, bin_names)
+	else:
+		ops = [operations.read(bin_name) for bin_name in bin_names] + [operations.touch(ttl)]
+		_, _, bins = placement.client.operate(key, ops)
+	return bins
+
+
+def get_windows(counters):
+	return {str(counter.id): counter.get_window() for counter in counters if counter.get_window()}
+
+
+def increment_counters(placement, record_id, values, ttl=aerospike.TTL_DONT_UPDATE, idempotency_key=None):
+	deltas = {str(counter.id): value for counter, value in values.items()}
+	limits = {str(counter.id): counter.max_value for counter in values}
+	now = int(time.time())
+	idempotency = None
+	if idempotency_key is not None:
+		idempotency = [idempotency_key, now + settings.IDEMPOTENCY_TTL, settings.IDEMPOTENCY_MAX_KEYS]
+	args = [deltas, limits, ttl, get_windows(values), now, idempotency]
+	return placement.client.apply(placement.key(record_id), UDF_MODULE, 'increment_many', args)
+
+
+# whether an increment with this key was made and would be replayed
+def has_idempotency_key(placement, record_id, idempotency_key):
+	try:
+		_, _, bins = placement.client.select(placement.key(record_id), ['idem'])
+	except exception.RecordNotFound:
+		return False
+	entry = (bins.get('idem') or {}).get(idempotency_key)
+	return entry is not None and entry[0] > int(time.time())
+
+
+def refund_counter(placement, record_id, counter, value, ttl=aerospike.TTL_DONT_UPDATE):
+	args = [str(counter.id), value, ttl, counter.get_window(), int(time.time())]
+	return placement.client.apply(placement.key(record_id), UDF_MODULE, 'refund', args)
+
+
+def get_reservations_bin(counter_id):
+	return f"r{counter_id}"
+
+
+def reserve_counter(placement, record_id, counter, value, expires_at, ttl=aerospike.TTL_DONT_UPDATE):
+	reservation_id = uuid.uuid4().hex[:16]
+	args = [str(counter.id), value, counter.max_value, ttl, counter.get_window(), int(time.time()),
+			reservation_id, expires_at]
+	result = placement.client.apply(placement.key(record_id), UDF_MODULE, 'reserve', args)
+	result['id'] = reservation_id
+	return result
+
+
+def commit_reservation(placement, record_id, counter, reservation_id, value=None,
+					   ttl=aerospike.TTL_DONT_UPDATE):
+	args = [str(counter.id), reservation_id, value, counter.max_value, ttl, counter.get_window(),
+			int(time.time())]
+	return placement.client.apply(placement.key(record_id), UDF_MODULE, 'commit', args)
+
+
+def release_reservation(placement, record_id, counter, reservation_id, ttl=aerospike.TTL_DONT_UPDATE):
+	args = [str(counter.id), reservation_id, ttl, int(time.time())]
+	return placement.client.apply(placement.key(record_id), UDF_MODULE, 'release', args)
+
+
+def reset_counters(placement, counters):
+	initial = {str(counter.id): counter.get_initial_value() for counter in counters}
+	job_id = placement.client.scan_apply(
+		placement.namespace, placement.set_name, UDF_MODULE, 'reset', [initial])
+	for counter in counters:
+		remove_top(placement, counter.id)
+	return job_id
+
+
+def get_stripe_key(placement, aggregate, stripe):
+	return placement.key(f"{aggregate.id}:{stripe}")
+
+
+# Takes value from the stripes of an aggregate, starting at the stripe of the record so that
+# increments of different records spread over the stripes, and moving on while a stripe is
+# full. Returns the amount taken per stripe, or None when the aggregate is full.
+def take_aggregate(placement, aggregate, record_id, value):
+	limits = aggregate.get_stripe_limits()
+	taken = {}
+	remaining = value
+	for i in range(aggregate.stripes):
+		if remaining <= 0:
+			break
+		stripe = (record_id + i) % aggregate.stripes
+		key = get_stripe_key(placement, aggregate, stripe)
+		amount = placement.client.apply(key, UDF_MODULE, 'take', [remaining, limits[stripe]])
+		if amount:
+			taken[stripe] = amount
+			remaining -= amount
+	if remaining > 0:
+		give_back_aggregate(placement, aggregate, taken)
+		return None
+	return taken
+
+
+def give_back_aggregate(placement, aggregate, taken):
+	for stripe, amount in taken.items():
+		placement.client.apply(get_stripe_key(placement, aggregate, stripe), UDF_MODULE, 'give_back', [amount])
+
+
+def refund_aggregate(placement, aggregate, record_id, value):
+	for i in range(aggregate.stripes):
+		if value <= 0:
+			return
+		key = get_stripe_key(placement, aggregate, (record_id + i) % aggregate.stripes)
+		value -= placement.client.apply(key, UDF_MODULE, 'give_back', [value])
+
+
+def get_aggregate_value(placement, aggregate):
+	keys = [get_stripe_key(placement, aggregate, stripe) for stripe in range(aggregate.stripes)]
+	return sum(bins.get('value', 0) for _, _, bins in placement.client.get_many(keys) if bins)
+
+
+def move_aggregate(source, target, aggregate):
+	for stripe in range(aggregate.stripes):
+		try:
+			_, _, bins = source.client.get(get_stripe_key(source, aggregate, stripe))
+		except exception.RecordNotFound:
+			continue
+		target.client.put(get_stripe_key(target, aggregate, stripe), bins, meta={'ttl': aerospike.TTL_NEVER_EXPIRE})
+		source.client.remove(get_stripe_key(source, aggregate, stripe))
+
+
+def remove_aggregate(placement, aggregate):
+	for stripe in range(aggregate.stripes):
+		try:
+			placement.client.remove(get_stripe_key(placement, aggregate, stripe))
+		except exception.RecordNotFound:
+			pass
+
+
+FILTER_OPERATORS = ('eq', 'lt', 'lte', 'gt', 'gte')
+
+
+def delete_matching_records(placement, counter, op, value):
+	args = [str(counter.id), op, value, counter.get_window(), int(time.time())]
+	return placement.client.scan_apply(
+		placement.namespace, placement.set_name, UDF_MODULE, 'delete_matching', args)
+
+
+# Removes a record and returns counter -> total of the given counters, None when it did not exist.
+# The totals are read in the same step, so the usage they hold can be given back to aggregate limits.
+def remove_record(placement, record_id, counters=()):
+	key = placement.key(record_id)
+	if not counters:
+		try:
+			placement.client.remove(key)
+		except exception.RecordNotFound:
+			return None
+		return {}
+	bins = placement.client.apply(key, UDF_MODULE, 'remove_returning', [[str(counter.id) for counter in counters]])
+	if bins is None:
+		return None
+	return {counter: counter.get_total(bins[str(counter.id)]) for counter in counters if bins.get(str(counter.id))}
+
+
+# on_removed is called with the record id and the totals of counters for every removed record
+def remove_records(placement, record_ids, *, counters=(), on_removed=None, workers=None):
+	def remove(record_id):
+		totals = remove_record(placement, record_id, counters)
+		if totals is None:
+			return False
+		if on_removed is not None:
+			on_removed(record_id, totals)
+		return True
+
+	with concurrent.futures.ThreadPoolExecutor(max_workers=workers or settings.SCAN_WORKERS) as executor:
+		return sum(executor.map(remove, record_ids))
 
-def update_set_name(new_set):
+
+def get_element_stats(placement, counters):
+	query = placement.client.query(placement.namespace, placement.set_name)
+	limits = {str(counter.id): counter.max_value for counter in counters}
+	query.apply(STATS_MODULE, 'element_stats', [limits, get_windows(counters), int(time.time())])
+	results = query.results()
+	stats = results[0] if results else {'records': 0, 'counters': {}}
+
+	response = collections.OrderedDict(records=stats['records'], counters=collections.OrderedDict())
+	for counter in counters:
+		counter_stats = stats['counters'].get(str(counter.id), {})
+		total = counter_stats.get('total', 0)
+		response['counters'][counter.slug] = collections.OrderedDict(
+			max_value=counter.max_value,
+			total=total,
+			average=total / stats['records'] if stats['records'] else 0,
+			full=counter_stats.get('full', 0),
+			histogram=counter_stats.get('histogram', [0] * STATS_BUCKETS),
+		)
+	return response
+
+
+def get_job_info(placement, job_id):
+	return placement.client.job_info(job_id, aerospike.JOB_SCAN)
+
+
+def get_partition_id(digest):
+	return (digest[0] | digest[1] << 8) & (PARTITIONS - 1)
+
+
+class Throttle:
+	def __init__(self, rate):
+		self.rate = rate
+		self.allowance = rate
+		self.last_check = time.monotonic()
+		self.lock = threading.Lock()
+
+	def wait(self):
+		with self.lock:
+			now = time.monotonic()
+			self.allowance = min(self.rate, self.allowance + (now - self.last_check) * self.rate)
+			self.last_check = now
+			self.allowance -= 1
+			delay = -self.allowance / self.rate if self.allowance < 0 else 0
+		if delay:
+			time.sleep(delay)
+
+
+# Calls `callback(record)` for every record of the set on a pool of worker threads.
+# Records are grouped into batches per partition and every partition is always
+# handled by the same worker. The scan stops early when the callback returns False.
+def scan_set(placement, callback, *, workers=None, batch_size=None, records_per_second=None):
+	workers = workers or settings.SCAN_WORKERS
+	batch_size = batch_size or settings.SCAN_BATCH_SIZE
+	if records_per_second is None:
+		records_per_second = settings.SCAN_RECORDS_PER_SECOND
+	throttle = Throttle(records_per_second) if records_per_second else None
+
+	queues = [queue.Queue(maxsize=2) for _ in range(workers)]
+	batches = collections.defaultdict(list)
+	lock = threading.Lock()
+	stop = threading.Event()
+	errors = []
+
+	def work(batch_queue):
+		while True:
+			batch = batch_queue.get()
+			if batch is None:
+				return
+			if stop.is_set():
+				continue
+			try:
+				for record in batch:
+					if callback(record) is False:
+						stop.set()
+						break
+			except Exception as e:
+				errors.append(e)
+				stop.set()
+
+	def dispatch(partition_id):
+		batch = batches.pop(partition_id)
+		queues[partition_id % workers].put(batch)
+
+	def collect(record):
+		if stop.is_set():
+			return False
+		if throttle is not None:
+			throttle.wait()
+		partition_id = get_partition_id(record[0][3])
+		with lock:
+			batches[partition_id].append(record)
+			if len(batches[partition_id]) >= batch_size:
+				dispatch(partition_id)
+
+	threads = [threading.Thread(target=work, args=(q,), daemon=True) for q in queues]
+	for thread in threads:
+		thread.start()
+	try:
+		scan = placement.client.scan(placement.namespace, placement.set_name)
+		scan.foreach(collect, options={'concurrent': True})
+	finally:
+		with lock:
+			for partition_id in list(batches):
+				dispatch(partition_id)
+		for batch_queue in queues:
+			batch_queue.put(None)
+		for thread in threads:
+			thread.join()
+	if errors:
+		raise errors[0]
+
+
+# Streams the records of a set through a bounded buffer, so memory does not grow with the set.
+def iter_records(placement, buffer_size=1000):
+	records = queue.Queue(maxsize=buffer_size)
+	cancelled = threading.Event()
+	done = object()
+
+	def collect(record):
+		if cancelled.is_set():
+			return False
+		records.put(record)
+
+	def produce():
+		try:
+			placement.client.scan(placement.namespace, placement.set_name).foreach(collect)
+		except Exception as e:
+			records.put(e)
+		finally:
+			records.put(done)
+
+	producer = threading.Thread(target=produce, daemon=True)
+	producer.start()
+	try:
+		while True:
+			record = records.get()
+			if record is done:
+				return
+			if isinstance(record, Exception):
+				raise record
+			yield record
+	finally:
+		cancelled.set()
+		while producer.is_alive():
+			try:
+				records.get(timeout=0.1)
+			except queue.Empty:
+				pass
+
+
+def write_records(placement, records, *, ttl=0, workers=None, batch_size=None):
+	workers = workers or settings.SCAN_WORKERS
+	batch_size = batch_size or settings.SCAN_BATCH_SIZE
+
+	def write_batch(batch):
+		for record_id, bins in batch:
+			placement.client.put(placement.key(record_id), bins, meta={'ttl': ttl})
+		return len(batch)
+
+	written = 0
+	records = iter(records)
+	with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+		pending = set()
+		for batch in iter(lambda: list(itertools.islice(records, batch_size)), []):
+			if len(pending) >= workers * 2:
+				finished, pending = concurrent.futures.wait(
+					pending, return_when=concurrent.futures.FIRST_COMPLETED)
+				written += sum(future.result() for future in finished)
+			pending.add(executor.submit(write_batch, batch))
+		written += sum(future.result() for future in pending)
+	return written
+
+
+# used to rename an element set as well as to move it to another namespace or cluster
+def copy_record_to(placement):
 	def wrapper(record):
-		key, _, bins = record
-		namespace, set_name, record_id, _ = key
-		aerospike_db.put((namespace, new_set, record_id), bins)
+		key, meta, bins = record
+		_, _, record_id, _ = key
+		placement.client.put(placement.key(record_id), bins, meta={'ttl': get_remaining_ttl(meta)})
 
 	return wrapper
 
 
-def add_counter_to_record(counter_id):
+def add_counter_to_record(placement, counter):
 	def wrapper(record):
 		key, _, _ = record
-		aerospike_db.put(key, {str(counter_id): 0})
+		bins = {str(counter.id): counter.get_initial_value()}
+		placement.client.put(key, bins, meta={'ttl': aerospike.TTL_DONT_UPDATE})
 
 	return wrapper
 
 
-def delete_counter_from_record(counter_id):
+def delete_counter_from_record(placement, counter_id):
 	def wrapper(record):
 		key, _, _ = record
-		aerospike_db.remove_bin(key, [str(counter_id)])
+		bin_names = [str(counter_id), get_reservations_bin(counter_id)]
+		placement.client.remove_bin(key, bin_names, meta={'ttl': aerospike.TTL_DONT_UPDATE})
 
 	return wrapper
 
 
-def check_counter_overflow(counter_id=None, new_max_value=None):
+def apply_counter_changes(placement, added, removed_ids):
+	bins = {str(counter.id): counter.get_initial_value() for counter in added}
+	for counter_id in removed_ids:
+		bins[str(counter_id)] = aerospike.null()
+		bins[get_reservations_bin(counter_id)] = aerospike.null()
+
+	def wrapper(record):
+		key, _, _ = record
+		placement.client.put(key, bins, meta={'ttl': aerospike.TTL_DONT_UPDATE})
+
+	return wrapper
+
+
+def check_counter_overflow(counter=None, new_max_value=None):
 	overflow = False
 
 	def wrapper(record=None, *, get_overflow=False):
@@ -37,18 +442,95 @@ def check_counter_overflow(counter_id=None, new_max_value=None):
 		if get_overflow:
 			return overflow
 		key, _, bins = record
-		if bins[str(counter_id)] > new_max_value:
+		if counter.get_total(bins[str(counter.id)]) > new_max_value:
 			overflow = True
+			return False
 
 	return wrapper
 
 
 def convert_results(results):
+	counters = {}
 	for (key, _, bins) in results:
 		record = collections.OrderedDict(id=bins['id'])
 		for (counter_id, counter_value) in bins.items():
-			if counter_id == 'id':
+			if not counter_id.isdigit():
 				continue
-			counter = Counter.objects.get(id=int(counter_id))
-			record[counter.slug] = f"{counter_value}/{counter.max_value}"
+			if counter_id not in counters:
+				counters[counter_id] = Counter.objects.get(id=int(counter_id))
+			counter = counters[counter_id]
+			record[counter.slug] = f"{counter.get_total(counter_value)}/{counter.max_value}"
 		yield record
+
+
+# what the record listing serves, also timed by the benchmark_maintenance command
+def list_records(placement):
+	results = placement.client.scan(placement.namespace, placement.set_name).results()
+	return sorted(convert_results(results), key=lambda e: e['id'])
+
+
+# The hottest records of a set are spread over TOP_K_SHARDS records by record id, so the updates
+# of busy counters do not all queue on one record. Each shard keeps its own top k.
+def get_top_key(placement, shard):
+	return placement.namespace, TOP_SET, f"{placement.set_name}:{shard}"
+
+
+def get_top_keys(placement):
+	return [get_top_key(placement, shard) for shard in range(settings.TOP_K_SHARDS)]
+
+
+# best effort, the increment it follows was already applied and must not fail because of it
+def update_top(placement, counter_id, record_id, value):
+	bin_name = str(counter_id)
+	size = settings.TOP_K_SIZE
+	try:
+		placement.client.operate(get_top_key(placement, record_id % settings.TOP_K_SHARDS), [
+			map_operations.map_put(bin_name, record_id, value),
+			map_operations.map_remove_by_rank_range(
+				bin_name, -size, size, aerospike.MAP_RETURN_NONE, inverted=True),
+		])
+	except exception.AerospikeError:
+		logger.warning("could not update the top of %s", placement.set_name, exc_info=True)
+
+
+def get_top(placement, counter_id, size):
+	top = []
+	for key in get_top_keys(placement):
+		try:
+			shard = placement.client.map_get_by_rank_range(
+				key, str(counter_id), -size, size, aerospike.MAP_RETURN_KEY_VALUE)
+		except exception.RecordNotFound:
+			continue
+		top.extend((shard or {}).items())
+	top = sorted(top, key=lambda entry: entry[1], reverse=True)[:size]
+
+	# deleted or expired records are dropped from the map lazily, when they are read
+	keys = [placement.key(record_id) for record_id, _ in top]
+	exists = placement.client.exists_many(keys)
+	missing = [record_id for (record_id, _), (_, meta) in zip(top, exists) if meta is None]
+	for record_id in missing:
+		placement.client.map_remove_by_key_list(
+			get_top_key(placement, record_id % settings.TOP_K_SHARDS), str(counter_id), [record_id],
+			aerospike.MAP_RETURN_NONE)
+	return [(record_id, value) for record_id, value in top if record_id not in missing]
+
+
+def move_top(source, target):
+	for source_key, target_key in zip(get_top_keys(source), get_top_keys(target)):
+		try:
+			_, _, bins = source.client.get(source_key)
+		except exception.RecordNotFound:
+			continue
+		target.client.put(target_key, bins)
+		source.client.remove(source_key)
+
+
+def remove_top(placement, counter_id=None):
+	for key in get_top_keys(placement):
+		try:
+			if counter_id is None:
+				placement.client.remove(key)
+			else:
+				placement.client.remove_bin(key, [str(counter_id)])
+		except exception.RecordNotFound:
+			pass
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class ServicesConfig(AppConfig):
     name = 'services'
+
+    def ready(self):
+        from services.aerospike_utils import register_udfs
+        register_udfs()
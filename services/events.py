@@ -0,0 +1,156 @@
+import atexit
+import collections
+import gzip
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+from django.conf import settings
+
+from services import aerospike_db
+
+logger = logging.getLogger('django')
+
+EVENT_SET = 'events'
+
+
+# Every process appends to a file of its own, path with the pid before the extension, so
+# workers never interleave lines or rotate a file another worker is writing to.
+class FileBackend:
+	def __init__(self, path, max_bytes, **kwargs):
+		self.path = path
+		self.max_bytes = max_bytes
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+
+	def get_active_path(self):
+		root, extension = os.path.splitext(self.path)
+		return f"{root}.{os.getpid()}{extension}"
+
+	def write(self, events):
+		path = self.get_active_path()
+		with open(path, 'a') as f:
+			f.writelines(json.dumps(event, separators=(',', ':')) + '\n' for event in events)
+			size = f.tell()
+		# the events are written at this point, a failed rotation is retried by the next write
+		if size >= self.max_bytes:
+			try:
+				self.rotate(path)
+			except OSError:
+				logger.exception("failed to rotate %s", path)
+
+	def rotate(self, path):
+		rotated = f"{path}.{time.strftime('%Y%m%d%H%M%S')}"
+		os.rename(path, rotated)
+		with open(rotated, 'rb') as src, gzip.open(f"{rotated}.gz", 'wb') as dst:
+			shutil.copyfileobj(src, dst)
+		os.remove(rotated)
+
+
+class AerospikeBackend:
+	def __init__(self, **kwargs):
+		self.sequence = 0
+
+	def write(self, events):
+		# every flush goes into its own record, so a record never outgrows the write block
+		self.sequence += 1
+		key = (settings.AEROSPIKE_NS, EVENT_SET, f"{int(events[0]['time'])}-{os.getpid()}-{self.sequence}")
+		aerospike_db.put(key, {'events': events})
+
+
+BACKENDS = {
+	'file': FileBackend,
+	'aerospike': AerospikeBackend,
+}
+
+
+# Increment events are appended to an in-memory ring buffer and written in batches by a
+# background thread. Recording never blocks: once the buffer is full the oldest events
+# are overwritten and counted as dropped.
+class EventSink:
+	def __init__(self, backend, capacity, batch_size, flush_interval, **options):
+		self.backend = BACKENDS[backend](**options)
+		self.buffer = collections.deque(maxlen=capacity)
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+		self.lock = threading.Lock()
+		self.flush_lock = threading.Lock()
+		self.wakeup = threading.Event()
+		self.metrics = collections.Counter()
+		self.thread = threading.Thread(target=self.run, name='event-sink', daemon=True)
+		self.thread.start()
+		atexit.register(self.flush)
+
+	def record(self, event):
+		with self.lock:
+			if len(self.buffer) == self.buffer.maxlen:
+				self.metrics['dropped'] += 1
+			self.buffer.append(event)
+			self.metrics['recorded'] += 1
+			if len(self.buffer) >= self.batch_size:
+				self.wakeup.set()
+
+	def run(self):
+		while True:
+			self.wakeup.wait(self.flush_interval)
+			self.wakeup.clear()
+			self.flush()
+
+	def flush(self):
+		with self.flush_lock:
+			with self.lock:
+				events = list(self.buffer)
+				self.buffer.clear()
+			self.write(events)
+
+	def write(self, events):
+		for start in range(0, len(events), self.batch_size):
+			batch = events[start:start + self.batch_size]
+			try:
+				self.backend.write(batch)
+			except Exception:
+				logger.exception("failed to flush %d counter events", len(batch))
+				outcome = 'failed'
+			else:
+				outcome = 'flushed'
+			with self.lock:
+				self.metrics[outcome] += len(batch)
+
+	def get_metrics(self):
+		with self.lock:
+			return {
+				'recorded': self.metrics['recorded'],
+				'dropped': self.metrics['dropped'],
+				'flushed': self.metrics['flushed'],
+				'failed': self.metrics['failed'],
+				'queued': len(self.buffer),
+				'capacity': self.buffer.maxlen,
+			}
+
+
+sink = None
+sink_lock = threading.Lock()
+
+
+def get_sink():
+	global sink
+	if sink is None and settings.EVENT_SINK.get('backend'):
+		with sink_lock:
+			if sink is None:
+				sink = EventSink(**settings.EVENT_SINK)
+	return sink
+
+
+def record_event(platform, element, uid, counter, delta):
+	event_sink = get_sink()
+	if event_sink is not None:
+		event_sink.record({
+			'time': time.time(),
+			'platform': platform,
+			'element': element,
+			'uid': uid,
+			'counter': counter,
+			'delta': delta,
+		})
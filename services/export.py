@@ -0,0 +1,119 @@
+import array
+import csv
+import io
+import json
+import struct
+import sys
+import zlib
+
+SNAPSHOT_MAGIC = b'LCSNAP1\n'
+SNAPSHOT_CHUNK_SIZE = 4096
+
+
+def get_row(bins, counters):
+	return [bins['id']] + [counter.get_total(bins.get(str(counter.id), 0)) for counter in counters]
+
+
+def iter_ndjson(records, counters):
+	slugs = ['id'] + [counter.slug for counter in counters]
+	for _, _, bins in records:
+		yield json.dumps(dict(zip(slugs, get_row(bins, counters)))).encode() + b'\n'
+
+
+def iter_csv(records, counters):
+	buffer = io.StringIO()
+	writer = csv.writer(buffer)
+	writer.writerow(['id'] + [counter.slug for counter in counters])
+	for _, _, bins in records:
+		writer.writerow(get_row(bins, counters))
+		if buffer.tell() >= 64 * 1024:
+			yield buffer.getvalue().encode()
+			buffer.seek(0)
+			buffer.truncate()
+	yield buffer.getvalue().encode()
+
+
+# Snapshot layout: magic, a length prefixed json header describing the counters and
+# then zlib compressed chunks of int64 columns (ids first, then one column per counter).
+# Every chunk is prefixed with its row count and compressed size, a zero row count ends the file.
+def iter_snapshot(records, counters):
+	header = json.dumps({
+		'counters': [{'slug': counter.slug, 'max_value': counter.max_value} for counter in counters],
+	}).encode()
+	yield SNAPSHOT_MAGIC + struct.pack('<I', len(header)) + header
+
+	columns = [array.array('q') for _ in range(len(counters) + 1)]
+	for _, _, bins in records:
+		for column, value in zip(columns, get_row(bins, counters)):
+			column.append(value)
+		if len(columns[0]) >= SNAPSHOT_CHUNK_SIZE:
+			yield pack_chunk(columns)
+	if len(columns[0]):
+		yield pack_chunk(columns)
+	yield struct.pack('<II', 0, 0)
+
+
+def pack_chunk(columns):
+	rows = len(columns[0])
+	if sys.byteorder == 'big':
+		for column in columns:
+			column.byteswap()
+	data = zlib.compress(b''.join(column.tobytes() for column in columns))
+	for column in columns:
+		del column[:]
+	return struct.pack('<II', rows, len(data)) + data
+
+
+def read_exact(stream, size):
+	data = stream.read(size)
+	if len(data) != size:
+		raise ValueError('snapshot is truncated')
+	return data
+
+
+def read_snapshot(stream):
+	if stream.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+		raise ValueError('not a snapshot file')
+	header_size, = struct.unpack('<I', read_exact(stream, 4))
+	header = json.loads(read_exact(stream, header_size))
+	slugs = [counter['slug'] for counter in header['counters']]
+
+	def rows():
+		while True:
+			count, size = struct.unpack('<II', read_exact(stream, 8))
+			if count == 0:
+				return
+			data = zlib.decompress(read_exact(stream, size))
+			columns = []
+			for i in range(len(slugs) + 1):
+				column = array.array('q')
+				column.frombytes(data[i * count * 8:(i + 1) * count * 8])
+				if sys.byteorder == 'big':
+					column.byteswap()
+				columns.append(column)
+			for row in zip(*columns):
+				yield dict(zip(['id'] + slugs, row))
+
+	return header, rows()
+
+
+def read_ndjson(stream):
+	for line in stream:
+		if line.strip():
+			yield json.loads(line)
+
+
+def get_restore_records(rows, counters):
+	bin_names = {counter.slug: str(counter.id) for counter in counters}
+	for row in rows:
+		bins = {bin_name: int(row.get(slug, 0)) for slug, bin_name in bin_names.items()}
+		bins['id'] = int(row['id'])
+		yield bins['id'], bins
+
+
+# format name -> (exporter, content type, file extension)
+FORMATS = {
+	'ndjson': (iter_ndjson, 'application/x-ndjson', 'ndjson'),
+	'csv': (iter_csv, 'text/csv', 'csv'),
+	'snapshot': (iter_snapshot, 'application/octet-stream', 'snap'),
+}
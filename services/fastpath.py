@@ -0,0 +1,106 @@
+import http
+import json
+import urllib.parse
+
+from django.conf import settings
+from django.core import signals
+from django.http.request import split_domain_port, validate_host
+from django.urls import Resolver404, resolve
+from rest_framework import status
+
+from services.actions import increment_counter, increment_record, read_counter
+from services.admission import Rejected, controller as admission_controller
+
+# url name -> {method: action}, every action returns a (payload, status) pair
+ROUTES = {
+	'counter-actions': {'GET': read_counter, 'POST': increment_counter},
+	'record-detail': {'POST': increment_record},
+}
+STATIC_HEADERS = [
+	('Content-Type', 'application/json'),
+	('Vary', 'Accept, Origin'),
+	('X-Frame-Options', 'DENY'),
+	('X-Content-Type-Options', 'nosniff'),
+]
+
+
+# WSGI wrapper that serves the hot counter routes without the middleware chain
+# and DRF machinery. Everything it does not fully understand (other routes,
+# methods, content types or hosts) is handed over to the wrapped Django application,
+# so the behaviour of the API does not depend on which path served the request.
+class FastPathApplication:
+	def __init__(self, application):
+		self.application = application
+
+	def __call__(self, environ, start_response):
+		action, match = self.get_action(environ)
+		if action is None:
+			return self.application(environ, start_response)
+		kwargs = match.kwargs
+		try:
+			acquired = admission_controller.admit(kwargs['platform'], match.url_name)
+		except Rejected as e:
+			return self.respond(environ, start_response, {'detail': e.detail}, e.status_code, e.get_headers())
+
+		signals.request_started.send(sender=self.__class__, environ=environ)
+		try:
+			if environ['REQUEST_METHOD'] == 'GET':
+				query = urllib.parse.parse_qs(environ.get('QUERY_STRING', ''))
+				payload, status_code = action(max_staleness=query.get('max_staleness', [None])[-1], **kwargs)
+			else:
+				try:
+					data = self.get_data(environ)
+				except ValueError:
+					payload, status_code = {'detail': 'JSON parse error'}, status.HTTP_400_BAD_REQUEST
+				else:
+					idempotency_key = environ.get('HTTP_IDEMPOTENCY_KEY')
+					payload, status_code = action(data=data, idempotency_key=idempotency_key, **kwargs)
+		finally:
+			admission_controller.release(acquired)
+			signals.request_finished.send(sender=self.__class__)
+		return self.respond(environ, start_response, payload, status_code)
+
+	def respond(self, environ, start_response, payload, status_code, extra_headers=()):
+		body = b'' if payload is None else json.dumps(payload, separators=(',', ':')).encode()
+		headers = STATIC_HEADERS + list(extra_headers) + [('Content-Length', str(len(body)))]
+		if 'HTTP_ORIGIN' in environ and settings.CORS_ORIGIN_ALLOW_ALL:
+			headers.append(('Access-Control-Allow-Origin', '*'))
+		start_response(self.get_status_line(status_code), headers)
+		return [body]
+
+	def get_action(self, environ):
+		if not settings.FAST_PATH_ENABLED or not self.is_host_allowed(environ):
+			return None, None
+		content_type = environ.get('CONTENT_TYPE', '')
+		if content_type and not content_type.startswith(
+				('application/json', 'application/x-www-form-urlencoded')):
+			return None, None
+		try:
+			match = resolve(environ.get('PATH_INFO', ''))
+		except Resolver404:
+			return None, None
+		action = ROUTES.get(match.url_name, {}).get(environ['REQUEST_METHOD'])
+		return action, match
+
+	def is_host_allowed(self, environ):
+		host = environ.get('HTTP_HOST') or environ.get('SERVER_NAME', '')
+		domain, _ = split_domain_port(host)
+		return bool(domain) and validate_host(domain, settings.ALLOWED_HOSTS)
+
+	def get_data(self, environ):
+		try:
+			length = int(environ.get('CONTENT_LENGTH') or 0)
+		except ValueError:
+			length = 0
+		if not length:
+			return {}
+		body = environ['wsgi.input'].read(length)
+		if environ.get('CONTENT_TYPE', '').startswith('application/json'):
+			return json.loads(body)
+		return {key: values[-1] for key, values in urllib.parse.parse_qs(body.decode()).items()}
+
+	def get_status_line(self, status_code):
+		try:
+			return f"{status_code} {http.HTTPStatus(status_code).phrase}"
+		except ValueError:
+			return f"{status_code} Unknown Status Code"
@@ -0,0 +1,116 @@
+import json
+import random
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from services.aerospike_utils import (add_counter_to_record, check_counter_overflow, copy_record_to,
+									  delete_counter_from_record, list_records, remove_top, scan_set,
+									  write_records)
+from services.models import Platform, Element, Counter
+from services.placement import get_placement
+
+BENCHMARK_SLUG = 'benchmark'
+MAX_VALUE = 1_000_000
+
+
+class Command(BaseCommand):
+	help = ("Times the maintenance scans (rename, counter add/delete, max_value change and listing) "
+			"on generated elements and writes the results as json")
+
+	def add_arguments(self, parser):
+		# required, so the generated records never land next to live data by accident
+		parser.add_argument('--namespace', required=True,
+							help="Aerospike namespace the generated elements are written to")
+		parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000],
+							help="records per generated element")
+		parser.add_argument('--counters', type=int, default=20, help="counters per generated element")
+		parser.add_argument('--output', help="json file the results are written to, stdout by default")
+		parser.add_argument('--no-memory', action='store_true',
+							help="skip tracemalloc, which slows the python side of every operation down")
+
+	def handle(self, *args, **options):
+		self.trace_memory = not options['no_memory']
+		slugs = [f"{BENCHMARK_SLUG}-{size}" for size in options['sizes']]
+		existing = Platform.objects.filter(slug__in=slugs).values_list('slug', flat=True)
+		if existing:
+			raise CommandError(f"platform {', '.join(existing)} already exists, it would be deleted afterwards")
+		results = []
+		for size in options['sizes']:
+			results.extend(self.run(size, options['counters'], options['namespace']))
+
+		report = json.dumps({
+			'time': timezone.now().isoformat(),
+			'settings': {
+				'namespace': options['namespace'],
+				'scan_workers': settings.SCAN_WORKERS,
+				'scan_batch_size': settings.SCAN_BATCH_SIZE,
+				'trace_memory': self.trace_memory,
+			},
+			'results': results,
+		}, indent=2)
+		if options['output']:
+			with open(options['output'], 'w') as f:
+				f.write(report + '\n')
+		else:
+			self.stdout.write(report)
+
+	def run(self, size, counter_count, namespace):
+		slug = f"{BENCHMARK_SLUG}-{size}"
+		platform = Platform.objects.create(name=slug, slug=slug, namespace=namespace)
+		element = Element.objects.create(name=slug, slug=slug, platform=platform)
+		counters = [
+			Counter.objects.create(name=f"c{i}", slug=f"c{i}", max_value=MAX_VALUE, element=element)
+			for i in range(counter_count)
+		]
+		placement = get_placement(element)
+		renamed = placement._replace(set_name=f"{placement.set_name}-renamed")
+		added = Counter(name='added', slug='added', max_value=MAX_VALUE, element=element)
+		results = []
+
+		def measure(operation, func):
+			self.stderr.write(f"{size} records: {operation}")
+			if self.trace_memory:
+				tracemalloc.start()
+			started = time.perf_counter()
+			func()
+			seconds = time.perf_counter() - started
+			peak = tracemalloc.get_traced_memory()[1] if self.trace_memory else None
+			tracemalloc.stop()
+			results.append({
+				'operation': operation,
+				'records': size,
+				'counters': counter_count,
+				'seconds': round(seconds, 3),
+				'records_per_second': round(size / seconds) if seconds else None,
+				'peak_memory_bytes': peak,
+			})
+
+		def records():
+			for record_id in range(size):
+				bins = {str(counter.id): random.randrange(MAX_VALUE // 2) for counter in counters}
+				bins['id'] = record_id
+				yield record_id, bins
+
+		def add_counter():
+			added.save()
+			scan_set(renamed, add_counter_to_record(renamed, added))
+
+		try:
+			measure('populate', lambda: write_records(placement, records()))
+			measure('rename', lambda: scan_set(placement, copy_record_to(renamed)))
+			measure('counter_add', add_counter)
+			measure('counter_delete', lambda: scan_set(renamed, delete_counter_from_record(renamed, added.id)))
+			# the new max_value is above every value, so the scan never stops early
+			measure('max_value_change', lambda: scan_set(renamed, check_counter_overflow(counters[0], MAX_VALUE)))
+			# the calls of the record listing endpoint
+			measure('listing', lambda: list_records(renamed))
+		finally:
+			for target in (placement, renamed):
+				target.client.truncate(target.namespace, target.set_name, 0)
+				remove_top(target)
+			platform.delete()
+		return results
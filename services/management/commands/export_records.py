@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from services.aerospike_utils import iter_records
+from services.export import FORMATS
+from services.models import Element
+from services.placement import get_element, get_placement
+
+
+class Command(BaseCommand):
+	help = "Streams all records of an element into a ndjson, csv or snapshot file"
+
+	def add_arguments(self, parser):
+		parser.add_argument('platform')
+		parser.add_argument('element')
+		parser.add_argument('path')
+		parser.add_argument('--output', choices=list(FORMATS), default='snapshot')
+
+	def handle(self, *args, **options):
+		try:
+			element = get_element(options['platform'], options['element'])
+		except Element.DoesNotExist:
+			raise CommandError("element does not exist")
+
+		exporter = FORMATS[options['output']][0]
+		counters = list(element.counters.order_by('id'))
+		records = iter_records(get_placement(element))
+		with open(options['path'], 'wb') as f:
+			for chunk in exporter(records, counters):
+				f.write(chunk)
+		self.stdout.write(f"exported to {options['path']}")
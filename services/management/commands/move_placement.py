@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from services.models import Platform, Element
+from services.placement import get_element, move_placement
+
+
+class Command(BaseCommand):
+	help = ("Moves a platform, or a single element, to another cluster and namespace. "
+			"Writes of the moved elements are refused until their records are copied")
+
+	def add_arguments(self, parser):
+		parser.add_argument('platform')
+		parser.add_argument('element', nargs='?')
+		parser.add_argument('--cluster', default='', help="name in AEROSPIKE_CLUSTERS, blank inherits")
+		parser.add_argument('--namespace', default='', help="blank inherits")
+
+	def handle(self, *args, **options):
+		if options['cluster'] and options['cluster'] not in settings.AEROSPIKE_CLUSTERS:
+			raise CommandError(f"unknown cluster, one of: {', '.join(settings.AEROSPIKE_CLUSTERS)}")
+		try:
+			if options['element']:
+				obj = get_element(options['platform'], options['element'])
+			else:
+				obj = Platform.objects.get(slug=options['platform'])
+		except (Platform.DoesNotExist, Element.DoesNotExist):
+			raise CommandError("platform or element does not exist")
+
+		moved = move_placement(obj, options['cluster'], options['namespace'])
+		self.stdout.write(f"moved {moved} element sets of {obj}")
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from services.aerospike_utils import remove_aggregate, reset_counters
+from services.models import AggregateLimit, Element, Counter
+from services.placement import get_aggregate_placement, get_placement
+
+
+class Command(BaseCommand):
+	help = ('Resets counters and aggregate limits whose reset period has ended. '
+			'Meant to be run periodically, i.e. from cron')
+
+	def handle(self, *args, **options):
+		now = timezone.now()
+		elements = Element.objects.select_related('platform').prefetch_related('counters')
+		for element in elements:
+			counters = [c for c in element.counters.all() if c.is_reset_due(now)]
+			if not counters:
+				continue
+			placement = get_placement(element)
+			job_id = reset_counters(placement, counters)
+			Counter.objects.filter(id__in=[counter.id for counter in counters]).update(last_reset=now)
+			slugs = ', '.join(counter.slug for counter in counters)
+			self.stdout.write(f"{placement.set_name}: reset {slugs} (job {job_id})")
+
+		# counter resets and record expiry do not lower the usage of aggregates, their own period does
+		for aggregate in AggregateLimit.objects.select_related('platform').exclude(
+				reset_period=AggregateLimit.RESET_NEVER):
+			if not aggregate.is_reset_due(now):
+				continue
+			remove_aggregate(get_aggregate_placement(aggregate), aggregate)
+			AggregateLimit.objects.filter(id=aggregate.id).update(last_reset=now)
+			self.stdout.write(f"{aggregate.platform.slug}: reset aggregate {aggregate.slug}")
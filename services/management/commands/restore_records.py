@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from services.aerospike_utils import write_records
+from services.export import SNAPSHOT_MAGIC, get_restore_records, read_ndjson, read_snapshot
+from services.models import Element
+from services.placement import get_element, get_placement
+
+
+class Command(BaseCommand):
+	help = "Restores records of an element from a snapshot or ndjson export"
+
+	def add_arguments(self, parser):
+		parser.add_argument('platform')
+		parser.add_argument('element')
+		parser.add_argument('path')
+
+	def handle(self, *args, **options):
+		try:
+			element = get_element(options['platform'], options['element'])
+		except Element.DoesNotExist:
+			raise CommandError("element does not exist")
+
+		counters = list(element.counters.all())
+		placement = get_placement(element)
+		with open(options['path'], 'rb') as f:
+			if f.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC:
+				f.seek(0)
+				_, rows = read_snapshot(f)
+			else:
+				f.seek(0)
+				rows = read_ndjson(f)
+			records = get_restore_records(rows, counters)
+			written = write_records(placement, records, ttl=element.record_ttl)
+		self.stdout.write(f"restored {written} records into {placement.set_name}")
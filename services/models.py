@@ -1,9 +1,17 @@
+import datetime
+import time
+
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
 
 class Platform(models.Model):
 	name = models.CharField(max_length=30, unique=True)
 	slug = models.SlugField(max_length=30, unique=True)
+	# name in settings.AEROSPIKE_CLUSTERS and namespace the records are stored in, blank for the defaults
+	cluster = models.CharField(max_length=30, blank=True, default='')
+	namespace = models.CharField(max_length=30, blank=True, default='')
 
 	def __str__(self):
 		return self.slug
@@ -13,16 +21,120 @@ class Element(models.Model):
 	name = models.CharField(max_length=30)
 	slug = models.SlugField(max_length=30)
 	platform = models.ForeignKey(to=Platform, related_name='elements', on_delete=models.CASCADE)
+	# seconds before an untouched record expires, 0 keeps the namespace default-ttl
+	record_ttl = models.PositiveIntegerField(default=0)
+	refresh_ttl_on_touch = models.BooleanField(default=False)
+	# blank cluster and namespace fall back to the platform placement
+	cluster = models.CharField(max_length=30, blank=True, default='')
+	namespace = models.CharField(max_length=30, blank=True, default='')
+	# set while the records are copied to a new placement, writes are refused meanwhile
+	moving = models.BooleanField(default=False)
 
 	def __str__(self):
 		return self.slug
 
 
-class Counter(models.Model):
+# Usage zeroed by the reset_counters command at the start of every period.
+class PeriodicReset(models.Model):
+	RESET_NEVER = 'never'
+	RESET_DAILY = 'daily'
+	RESET_WEEKLY = 'weekly'
+	RESET_MONTHLY = 'monthly'
+	RESET_PERIOD_CHOICES = (
+		(RESET_NEVER, 'Never'),
+		(RESET_DAILY, 'Daily'),
+		(RESET_WEEKLY, 'Weekly'),
+		(RESET_MONTHLY, 'Monthly'),
+	)
+
+	reset_period = models.CharField(
+		max_length=10, choices=RESET_PERIOD_CHOICES, default=RESET_NEVER)
+	last_reset = models.DateTimeField(default=timezone.now)
+
+	class Meta:
+		abstract = True
+
+	def next_reset(self):
+		if self.reset_period == self.RESET_NEVER:
+			return None
+		start = self.last_reset.replace(hour=0, minute=0, second=0, microsecond=0)
+		if self.reset_period == self.RESET_DAILY:
+			return start + datetime.timedelta(days=1)
+		if self.reset_period == self.RESET_WEEKLY:
+			return start + datetime.timedelta(days=7 - start.weekday())
+		if start.month == 12:
+			return start.replace(year=start.year + 1, month=1, day=1)
+		return start.replace(month=start.month + 1, day=1)
+
+	def is_reset_due(self, now=None):
+		next_reset = self.next_reset()
+		return next_reset is not None and (now or timezone.now()) >= next_reset
+
+
+class Counter(PeriodicReset):
+	WINDOW_NONE = 'none'
+	WINDOW_SECOND = 'second'
+	WINDOW_MINUTE = 'minute'
+	WINDOW_HOUR = 'hour'
+	WINDOW_DAY = 'day'
+	WINDOW_CHOICES = (
+		(WINDOW_NONE, 'None'),
+		(WINDOW_SECOND, 'Second'),
+		(WINDOW_MINUTE, 'Minute'),
+		(WINDOW_HOUR, 'Hour'),
+		(WINDOW_DAY, 'Day'),
+	)
+	WINDOW_SECONDS = {WINDOW_SECOND: 1, WINDOW_MINUTE: 60, WINDOW_HOUR: 3600, WINDOW_DAY: 86400}
+
 	name = models.CharField(max_length=30)
 	slug = models.SlugField(max_length=30)
 	element = models.ForeignKey(to=Element, related_name='counters', on_delete=models.CASCADE)
 	max_value = models.IntegerField(verbose_name='Max value')
+	# max_value applies to the last window_size windows instead of the whole lifetime
+	window = models.CharField(max_length=10, choices=WINDOW_CHOICES, default=WINDOW_NONE)
+	window_size = models.PositiveIntegerField(default=1)
+	# milliseconds a total cached by the worker may be served for, 0 always reads Aerospike
+	max_staleness = models.PositiveIntegerField(default=0)
+
+	def __str__(self):
+		return self.name
+
+	def get_window(self):
+		# [bucket width, window length] in seconds or None for lifetime counters
+		if self.window == self.WINDOW_NONE:
+			return None
+		length = self.WINDOW_SECONDS[self.window] * self.window_size
+		return [max(1, length // settings.WINDOW_BUCKETS), length]
+
+	def get_initial_value(self):
+		return {} if self.window != self.WINDOW_NONE else 0
+
+	def get_total(self, value, now=None):
+		window = self.get_window()
+		if not isinstance(value, dict):
+			return value if window is None else 0
+		if window is None:
+			return sum(value.values())
+		oldest = (now or time.time()) - window[1]
+		return sum(count for start, count in value.items() if start + window[0] > oldest)
+
+
+# A cap on the sum of some counters over all records, element wide when element is set
+# and platform wide otherwise. Usage is split over `stripes` records, so concurrent
+# increments of different records do not queue on the same one.
+class AggregateLimit(PeriodicReset):
+	name = models.CharField(max_length=30)
+	slug = models.SlugField(max_length=30)
+	platform = models.ForeignKey(to=Platform, related_name='aggregates', on_delete=models.CASCADE)
+	element = models.ForeignKey(
+		to=Element, related_name='aggregates', null=True, blank=True, on_delete=models.CASCADE)
+	counters = models.ManyToManyField(to=Counter, related_name='aggregates')
+	max_value = models.IntegerField(verbose_name='Max value')
+	stripes = models.PositiveIntegerField(default=8)
 
 	def __str__(self):
 		return self.name
+
+	def get_stripe_limits(self):
+		size, remainder = divmod(self.max_value, self.stripes)
+		return [size + (stripe < remainder) for stripe in range(self.stripes)]
@@ -0,0 +1,105 @@
+import collections
+import threading
+import time
+
+import aerospike
+from django.conf import settings
+
+from services import aerospike_db, config
+from services.aerospike_utils import AGGREGATE_SET, copy_record_to, move_aggregate, move_top, register_udfs, scan_set
+from services.models import Platform, Element
+
+DEFAULT_CLUSTER = 'default'
+
+clients = {DEFAULT_CLUSTER: aerospike_db}
+clients_lock = threading.Lock()
+
+
+def get_client(cluster):
+	if cluster not in clients:
+		with clients_lock:
+			if cluster not in clients:
+				client = aerospike.client(dict(config, **settings.AEROSPIKE_CLUSTERS[cluster])).connect()
+				register_udfs(client)
+				clients[cluster] = client
+	return clients[cluster]
+
+
+# Where the records of an element live: a named client (cluster), a namespace and the set.
+class Placement(collections.namedtuple('Placement', 'cluster namespace set_name')):
+	@property
+	def client(self):
+		return get_client(self.cluster)
+
+	def key(self, record_id):
+		return self.namespace, self.set_name, record_id
+
+
+def get_set_name(platform_slug, element_slug):
+	return f"{platform_slug}/{element_slug}"
+
+
+def get_platform_placement(platform, set_name):
+	return Placement(
+		platform.cluster or DEFAULT_CLUSTER,
+		platform.namespace or settings.AEROSPIKE_NS,
+		set_name,
+	)
+
+
+def get_aggregate_placement(aggregate):
+	return get_platform_placement(aggregate.platform, AGGREGATE_SET)
+
+
+# An element can override the placement of its platform, which overrides the defaults.
+def get_placement(element):
+	platform = element.platform
+	return Placement(
+		element.cluster or platform.cluster or DEFAULT_CLUSTER,
+		element.namespace or platform.namespace or settings.AEROSPIKE_NS,
+		get_set_name(platform.slug, element.slug),
+	)
+
+
+def get_element(platform_slug, element_slug):
+	return Element.objects.select_related('platform').get(platform__slug=platform_slug, slug=element_slug)
+
+
+# Moves the records of an element, or of every element of a platform that follows the platform
+# placement, to a new cluster and namespace. Writes of the moving elements are refused meanwhile
+# while reads keep being served from the old placement until the new one is saved.
+# The stripes of the platform aggregates follow the platform.
+def move_placement(obj, cluster, namespace):
+	aggregates = []
+	if isinstance(obj, Platform):
+		elements = list(obj.elements.all())
+		for element in elements:
+			element.platform = obj
+		aggregates = list(obj.aggregates.all())
+		aggregate_source = get_platform_placement(obj, AGGREGATE_SET)
+	else:
+		elements = [obj]
+	sources = [get_placement(element) for element in elements]
+	obj.cluster, obj.namespace = cluster, namespace
+	moves = [(source, get_placement(element)) for element, source in zip(elements, sources)
+			 if get_placement(element) != source]
+	if aggregates and get_platform_placement(obj, AGGREGATE_SET) == aggregate_source:
+		aggregates = []
+
+	moving = Element.objects.filter(id__in=[element.id for element in elements])
+	moving.update(moving=True)
+	try:
+		if moves:
+			# lets the writes that passed the check before the freeze land
+			time.sleep(settings.PLACEMENT_FREEZE_GRACE)
+		for source, target in moves:
+			scan_set(source, copy_record_to(target))
+			move_top(source, target)
+		for aggregate in aggregates:
+			move_aggregate(aggregate_source, get_platform_placement(obj, AGGREGATE_SET), aggregate)
+		obj.save(update_fields=['cluster', 'namespace'])
+	finally:
+		moving.update(moving=False)
+	for source, _ in moves:
+		source.client.truncate(source.namespace, source.set_name, 0)
+	return len(moves)
@@ -0,0 +1,105 @@
+import collections
+import threading
+import time
+
+from django.conf import settings
+
+from services.placement import get_placement
+
+
+# Entries remember when they were stored, readers decide how old is still fresh enough.
+class LRUCache:
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.entries = collections.OrderedDict()
+
+	def get(self, key):
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is None:
+				return None
+			self.entries.move_to_end(key)
+		value, stored_at = entry
+		return value, (time.monotonic() - stored_at) * 1000
+
+	def put(self, key, value):
+		with self.lock:
+			self.entries[key] = (value, time.monotonic())
+			self.entries.move_to_end(key)
+			while len(self.entries) > settings.READ_CACHE_SIZE:
+				self.entries.popitem(last=False)
+
+	def update(self, key, value):
+		with self.lock:
+			if key in self.entries:
+				self.entries[key] = (value, time.monotonic())
+
+	def __len__(self):
+		return len(self.entries)
+
+
+# (platform, element, counter slug) -> counter, so fresh reads skip the database too
+counters = LRUCache()
+# (set name, record id, counter id) -> counter total
+values = LRUCache()
+metrics = collections.Counter()
+
+
+def get_max_staleness(value):
+	if value is None:
+		return None
+	value = int(value)
+	if not 0 <= value <= settings.READ_CACHE_MAX_STALENESS:
+		raise ValueError()
+	return value
+
+
+# the staleness of a request wins over the default of its counter, 0 always reads Aerospike
+def get_bound(counter, max_staleness):
+	return counter.max_staleness if max_staleness is None else max_staleness
+
+
+def get_counter(platform, element, slug, max_staleness):
+	entry = counters.get((platform, element, slug))
+	if entry is not None:
+		counter, age = entry
+		if age <= get_bound(counter, max_staleness):
+			return counter
+	return None
+
+
+# returns a total fresh enough for the request or None, every read is counted as a hit or a miss
+def get(platform, element, uid, slug, max_staleness):
+	counter = get_counter(platform, element, slug, max_staleness)
+	if counter is not None:
+		entry = values.get((get_placement(counter.element).set_name, uid, counter.id))
+		if entry is not None and entry[1] <= get_bound(counter, max_staleness):
+			metrics['hits'] += 1
+			return entry[0]
+	metrics['misses'] += 1
+	return None
+
+
+def put(platform, element, placement, uid, counter, value):
+	counters.put((platform, element, counter.slug), counter)
+	values.put((placement.set_name, uid, counter.id), value)
+
+
+# changes served by this process refresh the cached totals, the ones of other processes
+# are only seen once the cached total is older than the staleness a reader accepts
+def write_through(placement, uid, counter, value):
+	key = (placement.set_name, uid, counter.id)
+	if counter.max_staleness:
+		values.put(key, value)
+	else:
+		values.update(key, value)
+
+
+def get_metrics():
+	return {
+		'hits': metrics['hits'],
+		'misses': metrics['misses'],
+		'counters': len(counters),
+		'values': len(values),
+		'size': settings.READ_CACHE_SIZE,
+	}
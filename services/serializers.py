@@ -1,21 +1,43 @@
-from django.utils.text import slugify
 from django.conf import settings
+from django.utils.text import slugify
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from rest_framework.reverse import reverse
 
-from services import aerospike_db
-from services.aerospike_utils import check_counter_overflow
-from services.models import Platform, Element, Counter
+from services.actions import ElementMoving
+from services.aerospike_utils import check_counter_overflow, get_aggregate_value, scan_set
+from services.models import Platform, Element, Counter, AggregateLimit
+from services.placement import get_aggregate_placement, get_placement
+
+# these slugs would shadow the element and counter level routes
+RESERVED_COUNTER_SLUGS = ('counters', 'records', 'top', 'reset', 'export', 'stats', 'stream')
+RESERVED_ELEMENT_SLUGS = ('elements', 'aggregates')
+
 
+# placement is chosen on creation, moving existing records is done by the move_placement command
+class PlacementValidationMixin:
+	def validate_cluster(self, value):
+		if value and value not in settings.AEROSPIKE_CLUSTERS:
+			raise ValidationError(f"must be one of: {', '.join(settings.AEROSPIKE_CLUSTERS)}")
+		return self.validate_unchanged('cluster', value)
+
+	def validate_namespace(self, value):
+		return self.validate_unchanged('namespace', value)
+
+	def validate_unchanged(self, field, value):
+		if self.instance is not None and getattr(self.instance, field) != value:
+			raise ValidationError("cannot be changed, use the move_placement command")
+		return value
 
-class PlatformSerializer(serializers.HyperlinkedModelSerializer):
+
+class PlatformSerializer(PlacementValidationMixin, serializers.HyperlinkedModelSerializer):
 	slug = serializers.ReadOnlyField()
 	elements_url = serializers.SerializerMethodField()
+	aggregates_url = serializers.SerializerMethodField()
 
 	class Meta:
 		model = Platform
-		fields = ('name', 'slug', 'url', 'elements_url')
+		fields = ('name', 'slug', 'cluster', 'namespace', 'url', 'elements_url', 'aggregates_url')
 		extra_kwargs = {
 			'url': {'lookup_url_kwarg': 'platform', 'lookup_field': 'slug'},
 		}
@@ -25,6 +47,11 @@ class PlatformSerializer(serializers.HyperlinkedModelSerializer):
 		url = reverse('element-list', kwargs={'platform': obj.slug})
 		return request.build_absolute_uri(url)
 
+	def get_aggregates_url(self, obj):
+		request = self.context.get('request')
+		url = reverse('aggregate-list', kwargs={'platform': obj.slug})
+		return request.build_absolute_uri(url)
+
 	def validate_name(self, value):
 		slug = slugify(value)
 		if self.instance is not None and self.instance.slug == slug:
@@ -38,15 +65,17 @@ class PlatformSerializer(serializers.HyperlinkedModelSerializer):
 		return value
 
 
-class ElementSerializer(serializers.ModelSerializer):
+class ElementSerializer(PlacementValidationMixin, serializers.ModelSerializer):
 	url = serializers.SerializerMethodField()
 	slug = serializers.ReadOnlyField()
+	moving = serializers.ReadOnlyField()
 	counters_url = serializers.SerializerMethodField()
 	records_url = serializers.SerializerMethodField()
 
 	class Meta:
 		model = Element
-		fields = ('name', 'slug', 'url', 'counters_url', 'records_url')
+		fields = ('name', 'slug', 'record_ttl', 'refresh_ttl_on_touch', 'cluster', 'namespace', 'moving',
+				  'url', 'counters_url', 'records_url')
 
 	def get_url(self, obj):
 		request = self.context.get('request')
@@ -69,7 +98,7 @@ class ElementSerializer(serializers.ModelSerializer):
 			return value
 		platform_slug = self.context['view'].kwargs.get('platform')
 
-		if slug == "elements":
+		if slug in RESERVED_ELEMENT_SLUGS:
 			raise ValidationError("cannot add element with reserved name")
 		elif Element.objects.filter(platform__slug=platform_slug, name=value).exists():
 			raise ValidationError("must be unique inside each platform")
@@ -82,10 +111,14 @@ class CounterSerializer(serializers.ModelSerializer):
 	url = serializers.SerializerMethodField()
 	slug = serializers.ReadOnlyField()
 	max_value = serializers.IntegerField(min_value=1)
+	window_size = serializers.IntegerField(min_value=1, required=False)
+	max_staleness = serializers.IntegerField(min_value=0, max_value=settings.READ_CACHE_MAX_STALENESS, required=False)
+	last_reset = serializers.ReadOnlyField()
 
 	class Meta:
 		model = Counter
-		fields = ('id', 'name', 'slug', 'max_value', 'url')
+		fields = ('id', 'name', 'slug', 'max_value', 'window', 'window_size', 'reset_period',
+				  'max_staleness', 'last_reset', 'url')
 
 	def get_url(self, obj):
 		request = self.context.get('request')
@@ -103,7 +136,7 @@ class CounterSerializer(serializers.ModelSerializer):
 		element_slug = self.context['view'].kwargs.get('element')
 		platform_slug = self.context['view'].kwargs.get('platform')
 		element = Element.objects.filter(platform__slug=platform_slug, slug=element_slug).first()
-		if slug == "counters" or slug == "records":
+		if slug in RESERVED_COUNTER_SLUGS:
 			raise ValidationError("cannot add counter with reserved name")
 		elif Counter.objects.filter(element=element, name=value).exists():
 			raise ValidationError("must be unique inside each element")
@@ -114,15 +147,106 @@ class CounterSerializer(serializers.ModelSerializer):
 	def validate_max_value(self, value):
 		if self.instance is None or self.instance.max_value == value:
 			return value
-		element_slug = self.context['view'].kwargs.get('element')
-		platform_slug = self.context['view'].kwargs.get('platform')
-		set_name = f"{platform_slug}/{element_slug}"
-
-		query = aerospike_db.query(settings.AEROSPIKE_NS, set_name)
-		callback_func = check_counter_overflow(self.instance.id, value)
-		query.foreach(callback_func)
+		if self.instance.element.moving:
+			raise ElementMoving()
+		callback_func = check_counter_overflow(self.instance, value)
+		scan_set(get_placement(self.instance.element), callback_func)
 		if callback_func(get_overflow=True):
 			error_message = ('You cannot change it, because it will cause an '
 							 'overflow for counter in records that already exist')
 			raise ValidationError(error_message)
 		return value
+
+	def validate_reset_period(self, value):
+		if self.instance is None or value == Counter.RESET_NEVER:
+			return value
+		if any(aggregate.reset_period != value for aggregate in self.instance.aggregates.all()):
+			raise ValidationError("must match the reset period of the aggregate limits of the counter")
+		return value
+
+
+class PlatformElementField(serializers.SlugRelatedField):
+	def get_queryset(self):
+		return Element.objects.filter(platform__slug=self.context['view'].kwargs.get('platform'))
+
+
+# counters of any element of the platform, written as element/counter
+class CounterPathField(serializers.RelatedField):
+	default_error_messages = {
+		'invalid': 'must be element/counter',
+		'does_not_exist': 'counter {path} does not exist',
+	}
+
+	def get_queryset(self):
+		return Counter.objects.select_related('element').filter(
+			element__platform__slug=self.context['view'].kwargs.get('platform'))
+
+	def to_representation(self, value):
+		return f"{value.element.slug}/{value.slug}"
+
+	def to_internal_value(self, data):
+		try:
+			element_slug, slug = data.split('/')
+		except (AttributeError, ValueError):
+			self.fail('invalid')
+		try:
+			return self.get_queryset().get(element__slug=element_slug, slug=slug)
+		except Counter.DoesNotExist:
+			self.fail('does_not_exist', path=data)
+
+
+class AggregateLimitSerializer(serializers.ModelSerializer):
+	url = serializers.SerializerMethodField()
+	slug = serializers.ReadOnlyField()
+	element = PlatformElementField(slug_field='slug', required=False, allow_null=True)
+	counters = CounterPathField(many=True)
+	max_value = serializers.IntegerField(min_value=1)
+	stripes = serializers.IntegerField(min_value=1, max_value=settings.AGGREGATE_MAX_STRIPES, required=False)
+	value = serializers.SerializerMethodField()
+	last_reset = serializers.ReadOnlyField()
+
+	class Meta:
+		model = AggregateLimit
+		fields = ('name', 'slug', 'element', 'counters', 'max_value', 'stripes', 'reset_period', 'last_reset',
+				  'value', 'url')
+
+	def get_url(self, obj):
+		request = self.context.get('request')
+		url = reverse('aggregate-detail', kwargs={'platform': obj.platform.slug, 'aggregate': obj.slug})
+		return request.build_absolute_uri(url)
+
+	def get_value(self, obj):
+		return get_aggregate_value(get_aggregate_placement(obj), obj)
+
+	def validate_name(self, value):
+		slug = slugify(value)
+		if self.instance is not None and self.instance.slug == slug:
+			return value
+		platform_slug = self.context['view'].kwargs.get('platform')
+		if AggregateLimit.objects.filter(platform__slug=platform_slug, slug=slug).exists():
+			raise ValidationError("must be unique inside each platform")
+		return value
+
+	def validate_stripes(self, value):
+		# the usage is spread over the stripes, changing their number would lose part of it
+		if self.instance is not None and self.instance.stripes != value:
+			raise ValidationError("cannot be changed")
+		return value
+
+	def validate_counters(self, value):
+		if not value:
+			raise ValidationError("at least one counter is required")
+		if any(counter.window != Counter.WINDOW_NONE for counter in value):
+			raise ValidationError("windowed counters cannot be aggregated")
+		return value
+
+	def validate(self, attrs):
+		element = attrs.get('element', getattr(self.instance, 'element', None))
+		counters = attrs.get('counters', self.instance.counters.all() if self.instance is not None else [])
+		if element is not None and any(counter.element_id != element.id for counter in counters):
+			raise ValidationError({'counters': f"must belong to element {element.slug}"})
+		# usage is only lowered when the aggregate resets, counters resetting on their own would drift from it
+		reset_period = attrs.get('reset_period', getattr(self.instance, 'reset_period', AggregateLimit.RESET_NEVER))
+		if any(counter.reset_period not in (Counter.RESET_NEVER, reset_period) for counter in counters):
+			raise ValidationError({'reset_period': "must match the reset period of the counters"})
+		return attrs
@@ -0,0 +1,203 @@
+import asyncio
+import json
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http.request import split_domain_port, validate_host
+from django.urls import Resolver404, resolve
+from rest_framework import status
+
+from services.aerospike_utils import list_records
+from services.models import Element
+from services.placement import get_element, get_placement
+
+STREAM_ROUTE = 'element-stream'
+
+
+# Changes waiting to be sent to one client, record id -> {counter slug: value} or None once the
+# record was deleted. Changes of the same record are merged until the client catches up, so a
+# slow client receives fewer, larger updates instead of making the publishers wait.
+class Subscription:
+	def __init__(self, loop):
+		self.loop = loop
+		self.lock = threading.Lock()
+		self.pending = {}
+		self.notified = False
+		self.closed = False
+		self.event = asyncio.Event()
+
+	def push(self, uid, values):
+		with self.lock:
+			current = self.pending.get(uid)
+			if current is None or values is None:
+				self.pending[uid] = None if values is None else dict(values)
+			else:
+				current.update(values)
+			if self.notified:
+				return
+			self.notified = True
+		self.loop.call_soon_threadsafe(self.event.set)
+
+	def take(self):
+		self.event.clear()
+		with self.lock:
+			pending, self.pending = self.pending, {}
+			self.notified = False
+		return pending
+
+	def close(self):
+		self.closed = True
+		self.event.set()
+
+
+# In-process pub/sub between the increment path and the streams of this process, keyed by set name.
+class Broker:
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.subscriptions = {}
+		self.count = 0
+
+	def subscribe(self, set_name, loop):
+		with self.lock:
+			if self.count >= settings.STREAM_MAX_SUBSCRIBERS:
+				return None
+			subscription = Subscription(loop)
+			self.subscriptions.setdefault(set_name, set()).add(subscription)
+			self.count += 1
+		return subscription
+
+	def unsubscribe(self, set_name, subscription):
+		with self.lock:
+			self.subscriptions[set_name].discard(subscription)
+			self.count -= 1
+			if not self.subscriptions[set_name]:
+				del self.subscriptions[set_name]
+
+	def publish(self, set_name, uid, values):
+		# checked without the lock, so increments of elements nobody watches pay a dict lookup
+		if set_name not in self.subscriptions:
+			return
+		with self.lock:
+			subscriptions = list(self.subscriptions.get(set_name, ()))
+		for subscription in subscriptions:
+			subscription.push(uid, values)
+
+
+broker = Broker()
+
+
+# values is counter -> total, published in the "value/max value" format of the record listing
+def publish_values(placement, uid, values):
+	broker.publish(placement.set_name, uid, {
+		counter.slug: f"{value}/{counter.max_value}" for counter, value in values.items()
+	})
+
+
+def publish_deleted(placement, uid):
+	broker.publish(placement.set_name, uid, None)
+
+
+def get_stream_element(platform, element):
+	try:
+		return get_element(platform, element)
+	finally:
+		close_old_connections()
+
+
+def get_snapshot(placement):
+	try:
+		return list_records(placement)
+	finally:
+		close_old_connections()
+
+
+def format_event(event, data):
+	return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+
+def get_updates(pending):
+	return [{'id': uid, 'deleted': True} if values is None else dict(values, id=uid)
+			for uid, values in sorted(pending.items())]
+
+
+# ASGI wrapper that serves element streams as server-sent events: a snapshot of every record
+# followed by updates of the records changed since, as they are published by this process.
+# Django 3.0 has no async views, so the stream is served here and every other request is
+# handed over to the wrapped Django application.
+class StreamApplication:
+	def __init__(self, application):
+		self.application = application
+
+	async def __call__(self, scope, receive, send):
+		match = self.get_match(scope)
+		if match is None:
+			return await self.application(scope, receive, send)
+		await self.stream(scope, receive, send, match.kwargs)
+
+	def get_match(self, scope):
+		if scope['type'] != 'http' or scope['method'] != 'GET' or not self.is_host_allowed(scope):
+			return None
+		try:
+			match = resolve(scope['path'][len(scope.get('root_path', '')):])
+		except Resolver404:
+			return None
+		return match if match.url_name == STREAM_ROUTE else None
+
+	def is_host_allowed(self, scope):
+		headers = dict(scope.get('headers', ()))
+		host = headers.get(b'host', b'').decode('latin1')
+		domain, _ = split_domain_port(host)
+		return bool(domain) and validate_host(domain, settings.ALLOWED_HOSTS)
+
+	def get_headers(self, scope, content_type):
+		headers = [(b'content-type', content_type), (b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')]
+		if any(name == b'origin' for name, _ in scope.get('headers', ())) and settings.CORS_ORIGIN_ALLOW_ALL:
+			headers.append((b'access-control-allow-origin', b'*'))
+		return headers
+
+	async def respond(self, scope, send, payload, status_code, extra_headers=()):
+		body = json.dumps(payload, separators=(',', ':')).encode()
+		headers = self.get_headers(scope, b'application/json') + list(extra_headers)
+		await send({'type': 'http.response.start', 'status': status_code, 'headers': headers})
+		await send({'type': 'http.response.body', 'body': body})
+
+	async def stream(self, scope, receive, send, kwargs):
+		try:
+			element = await sync_to_async(get_stream_element)(kwargs['platform'], kwargs['element'])
+		except Element.DoesNotExist:
+			return await self.respond(scope, send, {'element': 'Does not exist'}, status.HTTP_400_BAD_REQUEST)
+		placement = get_placement(element)
+		subscription = broker.subscribe(placement.set_name, asyncio.get_event_loop())
+		if subscription is None:
+			message = {'detail': 'too many streams open'}
+			headers = [(b'retry-after', b'1')]
+			return await self.respond(scope, send, message, status.HTTP_503_SERVICE_UNAVAILABLE, headers)
+
+		async def wait_for_disconnect():
+			while (await receive())['type'] != 'http.disconnect':
+				pass
+			subscription.close()
+
+		disconnect = asyncio.ensure_future(wait_for_disconnect())
+		try:
+			headers = self.get_headers(scope, b'text/event-stream')
+			await send({'type': 'http.response.start', 'status': status.HTTP_200_OK, 'headers': headers})
+			# subscribed before the scan, changes made meanwhile are sent right after the snapshot
+			snapshot = await sync_to_async(get_snapshot)(placement)
+			await send({'type': 'http.response.body', 'body': format_event('snapshot', snapshot), 'more_body': True})
+			while not subscription.closed:
+				try:
+					await asyncio.wait_for(subscription.event.wait(), settings.STREAM_KEEPALIVE_INTERVAL)
+				except asyncio.TimeoutError:
+					body = b': keepalive\n\n'
+				else:
+					pending = subscription.take()
+					if subscription.closed or not pending:
+						continue
+					body = format_event('update', get_updates(pending))
+				await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+		finally:
+			broker.unsubscribe(placement.set_name, subscription)
+			disconnect.cancel()
@@ -1,13 +1,34 @@
+import asyncio
+import datetime
+import io
 import json
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.test import TestCase, override_settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.reverse import reverse
 from aerospike import exception
 
-from services import aerospike_db
-from services.models import Platform, Element, Counter
+from services import aerospike_db, read_cache
+from services.admission import (AdmissionController, Limiter, Rejected, controller as admission_controller,
+								get_overrides_key)
+from services.aerospike_utils import remove_aggregate, remove_top, scan_set, get_partition_id, PARTITIONS
+from services.events import EventSink
+from services.export import iter_snapshot, read_snapshot, get_restore_records
+from services.fastpath import FastPathApplication
+from services.models import Platform, Element, Counter, AggregateLimit
+from services.placement import DEFAULT_CLUSTER, Placement, get_aggregate_placement, get_placement, move_placement
+from services.streams import StreamApplication, Subscription, get_updates
+from services.warmup import get_state as get_warm_up_state, state as warm_up_state, warm_up
 from services.views import HTTP_441_NOT_EXIST, HTTP_440_FULL, HTTP_442_ALREADY_EXIST
 
 
@@ -448,3 +469,1365 @@ class TestAerospikeChangeSet(TestCase):
 				aerospike_db.remove((settings.AEROSPIKE_NS, set_name, key))
 			except exception.AerospikeError:
 				pass
+
+
+@override_settings(AEROSPIKE_NS='test', TOP_K_SIZE=2)
+class TestCounterTop(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		name = 'Test Counter Top'
+		slug = 'test-counter-top'
+		cls.platform = Platform.objects.create(name=name, slug=slug)
+		cls.element = Element.objects.create(name=name, slug=slug, platform=cls.platform)
+		cls.counter = Counter.objects.create(
+			name=name, slug=slug, max_value=20, element=cls.element
+		)
+		cls.records_url = reverse('record-list', kwargs={'platform': slug, 'element': slug})
+		cls.top_url = reverse('counter-top', kwargs={
+			'platform': slug, 'element': slug, 'counter': slug
+		})
+
+	def setUp(self) -> None:
+		self.set_name = f"{self.platform.slug}/{self.element.slug}"
+		for uid, value in ((1, 5), (2, 10), (3, 1)):
+			self.client.post(self.records_url, {'value': uid})
+			url = reverse('counter-actions', kwargs={
+				'platform': self.platform.slug,
+				'element': self.element.slug,
+				'uid': uid,
+				'counter': self.counter.slug,
+			})
+			response = self.client.post(url, {'value': value})
+			self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+	def test_get_top(self):
+		response = self.client.get(self.top_url)
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual([(e['id'], e['value']) for e in response.data], [(2, 10), (1, 5)])
+
+	def test_get_top_limited(self):
+		response = self.client.get(self.top_url, {'k': 1})
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(len(response.data), 1)
+
+	def test_top_update_failure_does_not_fail_increment(self):
+		url = reverse('counter-actions', kwargs={
+			'platform': self.platform.slug, 'element': self.element.slug, 'uid': 3, 'counter': self.counter.slug
+		})
+		with mock.patch('services.aerospike_utils.map_operations.map_put', side_effect=exception.TimeoutError()):
+			response = self.client.post(url, {'value': 1})
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(response.data, 2)
+
+	def test_get_top_error_invalid_size(self):
+		response = self.client.get(self.top_url, {'k': 3})
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_create_counter_error_name_reserved(self):
+		url = reverse('counter-list', kwargs={
+			'platform': self.platform.slug, 'element': self.element.slug
+		})
+		response = self.client.post(url, {'name': 'Top', 'max_value': 5})
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def tearDown(self) -> None:
+		for uid in (1, 2, 3):
+			try:
+				aerospike_db.remove((settings.AEROSPIKE_NS, self.set_name, uid))
+			except exception.AerospikeError:
+				pass
+		remove_top(get_placement(self.element))
+
+
+@override_settings(AEROSPIKE_NS='test')
+class TestRecordActions(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		name = 'Test Record Actions'
+		slug = 'test-record-actions'
+		cls.platform = Platform.objects.create(name=name, slug=slug)
+		cls.element = Element.objects.create(name=name, slug=slug, platform=cls.platform)
+		cls.campaigns = Counter.objects.create(
+			name='Campaigns', slug='campaigns', max_value=10, element=cls.element
+		)
+		cls.ads = Counter.objects.create(name='Ads', slug='ads', max_value=5, element=cls.element)
+		cls.records_url = reverse('record-list', kwargs={'platform': slug, 'element': slug})
+
+	def setUp(self) -> None:
+		self.set_name = f"{self.platform.slug}/{self.element.slug}"
+		response = self.client.post(self.records_url, {'value': 7})
+		self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+		self.record_url = reverse('record-detail', kwargs={
+			'platform': self.platform.slug, 'element': self.element.slug, 'uid': 7
+		})
+
+	def post_json(self, data):
+		return self.client.post(self.record_url, json.dumps(data), content_type='application/json')
+
+	def test_increment_many(self):
+		response = self.post_json({'campaigns': 2, 'ads': 3})
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(response.data['campaigns'], 2)
+		self.assertEqual(response.data['ads'], 3)
+
+	def test_increment_many_error_overflow_applies_nothing(self):
+		response = self.post_json({'campaigns': 2, 'ads': 6})
+		self.assertEqual(response.status_code, HTTP_440_FULL)
+
+		response = self.client.get(self.record_url)
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(response.data['campaigns'], '0/10')
+		self.assertEqual(response.data['ads'], '0/5')
+
+	def test_increment_many_error_counter_not_exist(self):
+		response = self.post_json({'campaigns': 1, 'unknown': 1})
+		self.assertEqual(response.status_code, HTTP_441_NOT_EXIST)
+
+	def test_increment_many_error_invalid_value(self):
+		response = self.post_json({'campaigns': -1})
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def tearDown(self) -> None:
+		try:
+			aerospike_db.remove((settings.AEROSPIKE_NS, self.set_name, 7))
+		except exception.AerospikeError:
+			pass
+		remove_top(get_placement(self.element))
+
+
+@override_settings(AEROSPIKE_NS='test')
+class TestCounterReset(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		name = 'Test Counter Reset'
+		slug = 'test-counter-reset'
+		cls.platform = Platform.objects.create(name=name, slug=slug)
+		cls.element = Element.objects.create(name=name, slug=slug, platform=cls.platform)
+		cls.counter = Counter.objects.create(
+			name=name, slug=slug, max_value=20, element=cls.element
+		)
+		cls.records_url = reverse('record-list', kwargs={'platform': slug, 'element': slug})
+		cls.reset_url = reverse('element-reset', kwargs={'platform': slug, 'element': slug})
+
+	def setUp(self) -> None:
+		self.set_name = f"{self.platform.slug}/{self.element.slug}"
+		self.client.post(self.records_url, {'value': 3})
+		self.reverse_kwargs = {
+			'platform': self.platform.slug,
+			'element': self.element.slug,
+			'uid': 3,
+			'counter': self.counter.slug,
+		}
+		self.counter_actions_url = reverse('counter-actions', kwargs=self.reverse_kwargs)
+		self.client.post(self.counter_actions_url, {'value': 10})
+
+	def test_refund(self):
+		url = reverse('counter-refund', kwargs=self.reverse_kwargs)
+		response = self.client.post(url, {'value': 4})
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(response.data, 6)
+
+	def test_refund_never_below_zero(self):
+		url = reverse('counter-refund', kwargs=self.reverse_kwargs)
+		response = self.client.post(url, {'value': 15})
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(response.data, 0)
+
+	def test_refund_event_is_what_was_refunded(self):
+		url = reverse('counter-refund', kwargs=self.reverse_kwargs)
+		with mock.patch('services.views.record_event') as record:
+			self.client.post(url, {'value': 15})
+			self.client.post(url, {'value': 1})
+		record.assert_called_once_with(self.platform.slug, self.element.slug, 3, self.counter.slug, -10)
+
+	def test_refund_error_value_not_a_number(self):
+		url = reverse('counter-refund', kwargs=self.reverse_kwargs)
+		response = self.client.post(url, json.dumps({'value': [1]}), content_type='application/json')
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_refund_error_not_exist(self):
+		self.reverse_kwargs['uid'] = 2147483647
+		response = self.client.post(reverse('counter-refund', kwargs=self.reverse_kwargs), {'value': 1})
+		self.assertEqual(response.status_code, HTTP_441_NOT_EXIST)
+
+	def test_reset(self):
+		response = self.client.post(self.reset_url)
+		self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+		for _ in range(50):
+			status_response = self.client.get(response.data['url'])
+			if status_response.data['completed']:
+				break
+			time.sleep(0.1)
+		self.assertTrue(status_response.data['completed'])
+		self.assertEqual(self.client.get(self.counter_actions_url).data, 0)
+
+	def test_reset_error_counter_not_exist(self):
+		data = {'counters': ['unknown']}
+		response = self.client.post(self.reset_url, json.dumps(data), content_type='application/json')
+		self.assertEqual(response.status_code, HTTP_441_NOT_EXIST)
+
+	def test_next_reset(self):
+		counter = Counter(reset_period=Counter.RESET_MONTHLY,
+						  last_reset=datetime.datetime(2020, 12, 15, 10, tzinfo=datetime.timezone.utc))
+		self.assertEqual(counter.next_reset(),
+						 datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc))
+		self.assertFalse(Counter(last_reset=counter.last_reset).is_reset_due())
+		self.assertTrue(counter.is_reset_due())
+
+	def tearDown(self) -> None:
+		try:
+			aerospike_db.remove((settings.AEROSPIKE_NS, self.set_name, 3))
+		except exception.AerospikeError:
+			pass
+		remove_top(get_placement(self.element))
+
+
+@override_settings(AEROSPIKE_NS='test')
+class TestScanEngine(TestCase):
+	set_name = 'test-scan-engine'
+
+	def setUp(self) -> None:
+		self.placement = Placement(DEFAULT_CLUSTER, settings.AEROSPIKE_NS, self.set_name)
+		for uid in range(50):
+			aerospike_db.put((settings.AEROSPIKE_NS, self.set_name, uid), {'id': uid})
+
+	def test_scan_set_visits_every_record(self):
+		visited = []
+		scan_set(self.placement, lambda record: visited.append(record[2]['id']),
+				 workers=4, batch_size=3)
+		self.assertEqual(sorted(visited), list(range(50)))
+
+	def test_scan_set_stops_early(self):
+		visited = []
+
+		def callback(record):
+			visited.append(record)
+			return False
+
+		scan_set(self.placement, callback, workers=1, batch_size=1)
+		self.assertLess(len(visited), 50)
+
+	def test_scan_set_raises_callback_errors(self):
+		def callback(record):
+			raise ValueError()
+
+		with self.assertRaises(ValueError):
+			scan_set(self.placement, callback, workers=2)
+
+	def test_partition_id(self):
+		self.assertEqual(get_partition_id(bytearray([0xff, 0xff] + [0] * 18)), PARTITIONS - 1)
+		self.assertEqual(get_partition_id(bytearray([0x01, 0x10] + [0] * 18)), 1)
+
+	def tearDown(self) -> None:
+		aerospike_db.truncate(settings.AEROSPIKE_NS, self.set_name, 0)
+
+
+@override_settings(AEROSPIKE_NS='test')
+class TestRecordExport(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		name = 'Test Record Export'
+		slug = 'test-record-export'
+		cls.platform = Platform.objects.create(name=name, slug=slug)
+		cls.element = Element.objects.create(name=name, slug=slug, platform=cls.platform)
+		cls.counter = Counter.objects.create(
+			name=name, slug=slug, max_value=20, element=cls.element
+		)
+		cls.records_url = reverse('record-list', kwargs={'platform': slug, 'element': slug})
+		cls.export_url = reverse('record-export', kwargs={'platform': slug, 'element': slug})
+
+	def setUp(self) -> None:
+		self.set_name = f"{self.platform.slug}/{self.element.slug}"
+		for uid in (1, 2):
+			self.client.post(self.records_url, {'value': uid})
+
+	def test_export_ndjson(self):
+		response = self.client.get(self.export_url)
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		records = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+		self.assertEqual(sorted(record['id'] for record in records), [1, 2])
+		self.assertEqual(records[0][self.counter.slug], 0)
+
+	def test_export_csv(self):
+		response = self.client.get(self.export_url, {'output': 'csv'})
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		lines = b''.join(response.streaming_content).decode().splitlines()
+		self.assertEqual(lines[0], f"id,{self.counter.slug}")
+		self.assertEqual(len(lines), 3)
+
+	def test_export_error_invalid_output(self):
+		response = self.client.get(self.export_url, {'output': 'xml'})
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_snapshot_round_trip(self):
+		records = [(None, None, {'id': uid, str(self.counter.id): uid % 7}) for uid in range(10000)]
+		stream = io.BytesIO(b''.join(iter_snapshot(iter(records), [self.counter])))
+		header, rows = read_snapshot(stream)
+		self.assertEqual(header['counters'][0]['slug'], self.counter.slug)
+		restored = list(get_restore_records(rows, [self.counter]))
+		self.assertEqual(restored, [(bins['id'], bins) for _, _, bins in records])
+
+	def tearDown(self) -> None:
+		aerospike_db.truncate(settings.AEROSPIKE_NS, self.set_name, 0)
+
+
+@override_settings(AEROSPIKE_NS='test')
+class TestCounterBulk(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		name = 'Test Counter Bulk'
+		slug = 'test-counter-bulk'
+		cls.platform = Platform.objects.create(name=name, slug=slug)
+		cls.element = Element.objects.create(name=name, slug=slug, platform=cls.platform)
+		cls.records_url = reverse('record-list', kwargs={'platform': slug, 'element': slug})
+		cls.bulk_url = reverse('counter-bulk', kwargs={'platform': slug, 'element': slug})
+
+	def setUp(self) -> None:
+		self.set_name = f"{self.platform.slug}/{self.element.slug}"
+		self.counter = Counter.objects.create(
+			name='Old', slug='old', max_value=5, element=self.element)
+		self.client.post(self.records_url, {'value': 1})
+
+	def post_json(self, data):
+		return self.client.post(self.bulk_url, json.dumps(data), content_type='application/json')
+
+	def test_bulk(self):
+		data = {
+			'create': [{'name': f'Counter {i}', 'max_value': 10} for i in range(20)],
+			'delete': [self.counter.slug],
+		}
+		response = self.post_json(data)
+		self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+		self.assertEqual(len(response.data['created']), 20)
+		self.assertEqual(response.data['deleted'], [self.counter.slug])
+
+		_, _, bins = aerospike_db.get((settings.AEROSPIKE_NS, self.set_name, 1))
+		self.assertNotIn(str(self.counter.id), bins)
+		for counter in response.data['created']:
+			self.assertEqual(bins[str(counter['id'])], 0)
+
+	def test_bulk_error_duplicate_names(self):
+		response = self.post_json({'create': [{'name': 'Same', 'max_value': 1}] * 2})
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_bulk_error_delete_not_exist(self):
+		response = self.post_json({'delete': ['unknown']})
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_bulk_error_not_an_object(self):
+		response = self.post_json([{'name': 'Listed', 'max_value': 1}])
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def tearDown(self) -> None:
+		aerospike_db.truncate(settings.AEROSPIKE_NS, self.set_name, 0)
+
+
+@override_settings(AEROSPIKE_NS='test')
+class TestFastPath(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		name = 'Test Fast Path'
+		slug = 'test-fast-path'
+		cls.platform = Platform.objects.create(name=name, slug=slug)
+		cls.element = Element.objects.create(name=name, slug=slug, platform=cls.platform)
+		cls.counter = Counter.objects.create(
+			name=name, slug=slug, max_value=20, element=cls.element
+		)
+		cls.records_url = reverse('record-list', kwargs={'platform': slug, 'element': slug})
+		cls.counter_actions_url = reverse('counter-actions', kwargs={
+			'platform': slug, 'element': slug, 'uid': 5, 'counter': slug
+		})
+
+	def setUp(self) -> None:
+		self.set_name = f"{self.platform.slug}/{self.element.slug}"
+		self.client.post(self.records_url, {'value': 5})
+		self.fallback_calls = []
+		self.application = FastPathApplication(self.fallback)
+		self.factory = RequestFactory()
+
+	def fallback(self, environ, start_response):
+		self.fallback_calls.append(environ['PATH_INFO'])
+		start_response('200 OK', [])
+		return [b'']
+
+	def call(self, request):
+		result = {}
+
+		def start_response(status_line, headers):
+			result['status'] = int(status_line.split()[0])
+			result['headers'] = dict(headers)
+
+		body = b''.join(self.application(request.environ, start_response))
+		return result['status'], json.loads(body) if body else None
+
+	def test_increment(self):
+		request = self.factory.post(self.counter_actions_url, json.dumps({'value': 3}),
+									content_type='application/json')
+		self.assertEqual(self.call(request), (status.HTTP_200_OK, 3))
+		self.assertEqual(self.call(self.factory.get(self.counter_actions_url)), (status.HTTP_200_OK, 3))
+		self.assertEqual(self.fallback_calls, [])
+
+	def test_increment_form_data(self):
+		request = self.factory.post(self.counter_actions_url, 'value=4',
+									content_type='application/x-www-form-urlencoded')
+		self.assertEqual(self.call(request), (status.HTTP_200_OK, 4))
+
+	def test_increment_error_overflow(self):
+		request = self.factory.post(self.counter_actions_url, json.dumps({'value': 21}),
+									content_type='application/json')
+		self.assertEqual(self.call(request), (HTTP_440_FULL, None))
+
+	def test_increment_error_invalid_json(self):
+		request = self.factory.post(self.counter_actions_url, '{', content_type='application/json')
+		self.assertEqual(self.call(request)[0], status.HTTP_400_BAD_REQUEST)
+
+	def test_other_routes_fall_back(self):
+		self.call(self.factory.get(self.records_url))
+		self.call(self.factory.post(self.counter_actions_url, {'value': 1}))
+		self.assertEqual(len(self.fallback_calls), 2)
+
+	def tearDown(self) -> None:
+		aerospike_db.truncate(settings.AEROSPIKE_NS, self.set_name, 0)
+
+
+@override_settings(AEROSPIKE_NS='test')
+class TestElementStats(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		name = 'Test Element Stats'
+		slug = 'test-element-stats'
+		cls.platform = Platform.objects.create(name=name, slug=slug)
+		cls.element = Element.objects.create(name=name, slug=slug, platform=cls.platform)
+		cls.counter = Counter.objects.create(
+			name=name, slug=slug, max_value=10, element=cls.element
+		)
+		cls.records_url = reverse('record-list', kwargs={'platform': slug, 'element': slug})
+		cls.stats_url = reverse('element-stats', kwargs={'platform': slug, 'element': slug})
+
+	def setUp(self) -> None:
+		cache.clear()
+		self.set_name = f"{self.platform.slug}/{self.element.slug}"
+		for uid, value in ((1, 10), (2, 5), (3, 0)):
+			self.client.post(self.records_url, {'value': uid})
+			url = reverse('counter-actions', kwargs={
+				'platform': self.platform.slug,
+				'element': self.element.slug,
+				'uid': uid,
+				'counter': self.counter.slug,
+			})
+			self.client.post(url, {'value': value})
+
+	def test_stats(self):
+		response = self.client.get(self.stats_url)
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(response.data['records'], 3)
+		counter_stats = response.data['counters'][self.counter.slug]
+		self.assertEqual(counter_stats['total'], 15)
+		self.assertEqual(counter_stats['average'], 5)
+		self.assertEqual(counter_stats['full'], 1)
+		self.assertEqual(counter_stats['histogram'], [1, 0, 0, 0, 0, 1, 0, 0, 0, 1])
+
+	def test_stats_cached(self):
+		self.client.get(self.stats_url)
+		self.client.post(self.records_url, {'value': 4})
+		response = self.client.get(self.stats_url)
+		self.assertEqual(response.data['records'], 3)
+
+	def test_stats_error_element_not_exist(self):
+		url = reverse('element-stats', kwargs={'platform': self.platform.slug, 'element': 'unknown'})
+		response = self.client.get(url)
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def tearDown(self) -> None:
+		aerospike_db.truncate(settings.AEROSPIKE_NS, self.set_name, 0)
+		remove_top(get_placement(self.element))
+
+
+@override_settings(AEROSPIKE_NS='test')
+class TestRecordTtl(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		name = 'Test Record Ttl'
+		slug = 'test-record-ttl'
+		cls.platform = Platform.objects.create(name=name, slug=slug)
+		cls.element = Element.objects.create(
+			name=name, slug=slug, platform=cls.platform, record_ttl=3600, refresh_ttl_on_touch=True)
+		cls.counter = Counter.objects.create(
+			name=name, slug=slug, max_value=20, element=cls.element
+		)
+		cls.records_url = reverse('record-list', kwargs={'platform': slug, 'element': slug})
+		cls.counter_actions_url = reverse('counter-actions', kwargs={
+			'platform': slug, 'element': slug, 'uid': 1, 'counter': slug
+		})
+
+	def setUp(self) -> None:
+		self.set_name = f"{self.platform.slug}/{self.element.slug}"
+		self.key = (settings.AEROSPIKE_NS, self.set_name, 1)
+		self.client.post(self.records_url, {'value': 1})
+
+	def get_ttl(self):
+		_, meta = aerospike_db.exists(self.key)
+		return meta['ttl']
+
+	def test_create_sets_ttl(self):
+		self.assertLessEqual(self.get_ttl(), 3600)
+
+	def test_increment_refreshes_ttl(self):
+		aerospike_db.touch(self.key, 60)
+		self.client.post(self.counter_actions_url, {'value': 1})
+		self.assertGreater(self.get_ttl(), 60)
+
+	def test_increment_keeps_ttl(self):
+		Element.objects.filter(id=self.element.id).update(refresh_ttl_on_touch=False)
+		aerospike_db.touch(self.key, 60)
+		self.client.post(self.counter_actions_url, {'value': 1})
+		self.assertLessEqual(self.get_ttl(), 60)
+
+	def test_read_refreshes_ttl(self):
+		aerospike_db.touch(self.key, 60)
+		self.client.get(self.counter_actions_url)
+		self.assertGreater(self.get_ttl(), 60)
+
+	def tearDown(self) -> None:
+		aerospike_db.truncate(settings.AEROSPIKE_NS, self.set_name, 0)
+		remove_top(get_placement(self.element))
+
+
+@override_settings(AEROSPIKE_NS='test')
+class TestRecordDelete(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		name = 'Test Record Delete'
+		slug = 'test-record-delete'
+		cls.platform = Platform.objects.create(name=name, slug=slug)
+		cls.element = Element.objects.create(name=name, slug=slug, platform=cls.platform)
+		cls.counter = Counter.objects.create(
+			name=name, slug=slug, max_value=20, element=cls.element
+		)
+		cls.records_url = reverse('record-list', kwargs={'platform': slug, 'element': slug})
+		cls.bulk_delete_url = reverse('record-bulk-delete', kwargs={'platform': slug, 'element': slug})
+
+	def setUp(self) -> None:
+		self.set_name = f"{self.platform.slug}/{self.element.slug}"
+		for uid in range(1, 6):
+			self.client.post(self.records_url, {'value': uid})
+		url = reverse('counter-actions', kwargs={
+			'platform': self.platform.slug,
+			'element': self.element.slug,
+			'uid': 1,
+			'counter': self.counter.slug,
+		})
+		self.client.post(url, {'value': 5})
+
+	def get_record_url(self, uid):
+		return reverse('record-detail', kwargs={
+			'platform': self.platform.slug, 'element': self.element.slug, 'uid': uid
+		})
+
+	def post_json(self, data):
+		return self.client.post(self.bulk_delete_url, json.dumps(data), content_type='application/json')
+
+	def test_delete(self):
+		response = self.client.delete(self.get_record_url(1))
+		self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+		response = self.client.get(self.get_record_url(1))
+		self.assertEqual(response.status_code, HTTP_441_NOT_EXIST)
+
+	def test_delete_removes_record_from_top(self):
+		self.client.delete(self.get_record_url(1))
+		url = reverse('counter-top', kwargs={
+			'platform': self.platform.slug, 'element': self.element.slug, 'counter': self.counter.slug
+		})
+		response = self.client.get(url)
+		self.assertEqual(response.data, [])
+
+	def test_delete_error_not_exist(self):
+		response = self.client.delete(self.get_record_url(2147483647))
+		self.assertEqual(response.status_code, HTTP_441_NOT_EXIST)
+
+	def test_bulk_delete_uids(self):
+		response = self.post_json({'uids': [2, 3, 2147483647]})
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(response.data['deleted'], 2)
+
+	@override_settings(BULK_DELETE_MAX_UIDS=2)
+	def test_bulk_delete_error_uids_not_a_list(self):
+		for uids in ('23', {'2': 3}, [2, 3, 4]):
+			response = self.post_json({'uids': uids})
+			self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+		records = aerospike_db.scan(settings.AEROSPIKE_NS, self.set_name).results()
+		self.assertEqual(len(records), 5)
+
+	def test_bulk_delete_error_not_an_object(self):
+		response = self.post_json([2, 3])
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_bulk_delete_filter(self):
+		data = {'filter': {'counter': self.counter.slug, 'op': 'eq', 'value': 0}}
+		response = self.post_json(data)
+		self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+		for _ in range(50):
+			if self.client.get(response.data['url']).data['completed']:
+				break
+			time.sleep(0.1)
+		records = aerospike_db.scan(settings.AEROSPIKE_NS, self.set_name).results()
+		self.assertEqual([bins['id'] for _, _, bins in records], [1])
+
+	def test_bulk_delete_error_invalid_filter(self):
+		data = {'filter': {'counter': self.counter.slug, 'op': 'like', 'value': 0}}
+		response = self.post_json(data)
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def tearDown(self) -> None:
+		aerospike_db.truncate(settings.AEROSPIKE_NS, self.set_name, 0)
+		remove_top(get_placement(self.element))
+
+
+class TestEventSink(TestCase):
+	def setUp(self) -> None:
+		self.directory = tempfile.mkdtemp()
+		self.path = os.path.join(self.directory, 'events.ndjson')
+		self.active_path = os.path.join(self.directory, f"events.{os.getpid()}.ndjson")
+
+	def create_sink(self, **options):
+		options = {'capacity': 10, 'batch_size': 5, 'flush_interval': 60, 'max_bytes': 1024 ** 2,
+				   'path': self.path, **options}
+		return EventSink('file', **options)
+
+	def test_flush_to_file(self):
+		sink = self.create_sink()
+		for uid in range(3):
+			sink.record({'uid': uid, 'delta': 1})
+		sink.flush()
+		with open(self.active_path) as f:
+			self.assertEqual([json.loads(line)['uid'] for line in f], [0, 1, 2])
+		self.assertEqual(sink.get_metrics()['flushed'], 3)
+
+	def test_full_buffer_drops_oldest(self):
+		sink = self.create_sink(batch_size=100)
+		for uid in range(15):
+			sink.record({'uid': uid})
+		metrics = sink.get_metrics()
+		self.assertEqual(metrics['dropped'], 5)
+		self.assertEqual(metrics['queued'], 10)
+
+	def test_rotate(self):
+		sink = self.create_sink(max_bytes=10)
+		sink.record({'uid': 1})
+		sink.flush()
+		self.assertFalse(os.path.exists(self.active_path))
+		rotated = [name for name in os.listdir(self.directory) if name.endswith('.gz')]
+		self.assertEqual(len(rotated), 1)
+
+	def test_failed_rotation_keeps_batch_flushed(self):
+		sink = self.create_sink(max_bytes=10)
+		sink.record({'uid': 1})
+		with mock.patch('services.events.os.rename', side_effect=OSError()):
+			sink.flush()
+		self.assertEqual(sink.get_metrics()['flushed'], 1)
+		self.assertEqual(sink.get_metrics()['failed'], 0)
+		self.assertTrue(os.path.exists(self.active_path))
+
+	def tearDown(self) -> None:
+		shutil.rmtree(self.directory)
+
+
+@override_settings(AEROSPIKE_NS='test', WINDOW_BUCKETS=2)
+class TestWindowedCounters(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		name = 'Test Windowed Counters'
+		slug = 'test-windowed-counters'
+		cls.platform = Platform.objects.create(name=name, slug=slug)
+		cls.element = Element.objects.create(name=name, slug=slug, platform=cls.platform)
+		cls.counter = Counter.objects.create(
+			name=name, slug=slug, max_value=3, element=cls.element,
+			window=Counter.WINDOW_SECOND, window_size=2
+		)
+		cls.records_url = reverse('record-list', kwargs={'platform': slug, 'element': slug})
+		cls.reverse_kwargs = {'platform': slug, 'element': slug, 'uid': 1, 'counter': slug}
+		cls.counter_actions_url = reverse('counter-actions', kwargs=cls.reverse_kwargs)
+
+	def setUp(self) -> None:
+		self.set_name = f"{self.platform.slug}/{self.element.slug}"
+		self.client.post(self.records_url, {'value': 1})
+
+	def test_increment_within_window(self):
+		response = self.client.post(self.counter_actions_url, {'value': 3})
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		response = self.client.post(self.counter_actions_url, {'value': 1})
+		self.assertEqual(response.status_code, HTTP_440_FULL)
+		self.assertEqual(self.client.get(self.counter_actions_url).data, 3)
+
+	def test_window_expires(self):
+		self.client.post(self.counter_actions_url, {'value': 3})
+		time.sleep(3)
+		self.assertEqual(self.client.get(self.counter_actions_url).data, 0)
+		response = self.client.post(self.counter_actions_url, {'value': 3})
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+		# stale buckets are trimmed by the increment, the bin stays bounded
+		_, _, bins = aerospike_db.get((settings.AEROSPIKE_NS, self.set_name, 1))
+		self.assertLessEqual(len(bins[str(self.counter.id)]), 3)
+
+	def test_refund(self):
+		self.client.post(self.counter_actions_url, {'value': 3})
+		response = self.client.post(reverse('counter-refund', kwargs=self.reverse_kwargs), {'value': 2})
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(response.data, 1)
+
+	def test_delete_matching_uses_window(self):
+		self.client.post(self.counter_actions_url, {'value': 3})
+		time.sleep(3)
+		url = reverse('record-bulk-delete', kwargs={'platform': self.platform.slug, 'element': self.element.slug})
+		data = {'filter': {'counter': self.counter.slug, 'op': 'gte', 'value': 1}}
+		response = self.client.post(url, json.dumps(data), content_type='application/json')
+		for _ in range(50):
+			if self.client.get(response.data['url']).data['completed']:
+				break
+			time.sleep(0.1)
+		_, meta = aerospike_db.exists((settings.AEROSPIKE_NS, self.set_name, 1))
+		self.assertIsNotNone(meta)
+
+	def test_get_total(self):
+		self.assertEqual(self.counter.get_window(), [1, 2])
+		value = {100: 1, 101: 2, 102: 4}
+		self.assertEqual(self.counter.get_total(value, now=103.5), 6)
+		self.assertEqual(Counter(max_value=1).get_total(5), 5)
+
+	def tearDown(self) -> None:
+		aerospike_db.truncate(settings.AEROSPIKE_NS, self.set_name, 0)
+		remove_top(get_placement(self.element))
+
+
+@override_settings(AEROSPIKE_NS='test')
+class TestCounterReservations(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		name = 'Test Counter Reservations'
+		slug = 'test-counter-reservations'
+		cls.platform = Platform.objects.create(name=name, slug=slug)
+		cls.element = Element.objects.create(name=name, slug=slug, platform=cls.platform)
+		cls.counter = Counter.objects.create(name=name, slug=slug, max_value=10, element=cls.element)
+		cls.records_url = reverse('record-list', kwargs={'platform': slug, 'element': slug})
+		cls.reverse_kwargs = {'platform': slug, 'element': slug, 'uid': 1, 'counter': slug}
+		cls.counter_actions_url = reverse('counter-actions', kwargs=cls.reverse_kwargs)
+		cls.reservations_url = reverse('counter-reservation-list', kwargs=cls.reverse_kwargs)
+
+	def setUp(self) -> None:
+		self.set_name = f"{self.platform.slug}/{self.element.slug}"
+		self.client.post(self.records_url, {'value': 1})
+
+	def get_reservation_url(self, reservation_id):
+		kwargs = dict(self.reverse_kwargs, reservation=reservation_id)
+		return reverse('counter-reservation-detail', kwargs=kwargs)
+
+	def test_reservation_holds_quota(self):
+		response = self.client.post(self.reservations_url, {'value': 8})
+		self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+		self.assertEqual(self.client.post(self.reservations_url, {'value': 3}).status_code, HTTP_440_FULL)
+		self.assertEqual(self.client.post(self.counter_actions_url, {'value': 3}).status_code, HTTP_440_FULL)
+		self.assertEqual(self.client.post(self.counter_actions_url, {'value': 2}).status_code, status.HTTP_200_OK)
+		# reserved quota is not usage yet
+		self.assertEqual(self.client.get(self.counter_actions_url).data, 2)
+
+	def test_commit(self):
+		reservation_id = self.client.post(self.reservations_url, {'value': 5}).data['id']
+		response = self.client.post(self.get_reservation_url(reservation_id), {'value': 3})
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(response.data, 3)
+		# a reservation is committed only once and the unused part is given back
+		response = self.client.post(self.get_reservation_url(reservation_id))
+		self.assertEqual(response.status_code, HTTP_441_NOT_EXIST)
+		self.assertEqual(self.client.post(self.counter_actions_url, {'value': 7}).status_code, status.HTTP_200_OK)
+
+	def test_commit_reserved_value(self):
+		reservation_id = self.client.post(self.reservations_url, {'value': 4}).data['id']
+		response = self.client.post(self.get_reservation_url(reservation_id))
+		self.assertEqual(response.data, 4)
+
+	def test_release(self):
+		reservation_id = self.client.post(self.reservations_url, {'value': 10}).data['id']
+		response = self.client.delete(self.get_reservation_url(reservation_id))
+		self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+		response = self.client.delete(self.get_reservation_url(reservation_id))
+		self.assertEqual(response.status_code, HTTP_441_NOT_EXIST)
+		self.assertEqual(self.client.post(self.counter_actions_url, {'value': 10}).status_code, status.HTTP_200_OK)
+
+		_, _, bins = aerospike_db.get((settings.AEROSPIKE_NS, self.set_name, 1))
+		self.assertNotIn(f"r{self.counter.id}", bins)
+
+	def test_reservation_expires(self):
+		response = self.client.post(self.reservations_url, {'value': 10, 'expires_in': 1})
+		time.sleep(2)
+		self.assertEqual(self.client.post(self.counter_actions_url, {'value': 10}).status_code, status.HTTP_200_OK)
+		response = self.client.post(self.get_reservation_url(response.data['id']))
+		self.assertEqual(response.status_code, HTTP_441_NOT_EXIST)
+
+	def test_invalid_reservation(self):
+		response = self.client.post(self.reservations_url, {'value': 1, 'expires_in': 0})
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+		response = self.client.post(self.reservations_url, {'value': -1})
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+		kwargs = dict(self.reverse_kwargs, uid=2)
+		response = self.client.post(reverse('counter-reservation-list', kwargs=kwargs), {'value': 1})
+		self.assertEqual(response.status_code, HTTP_441_NOT_EXIST)
+
+	def tearDown(self) -> None:
+		aerospike_db.truncate(settings.AEROSPIKE_NS, self.set_name, 0)
+		remove_top(get_placement(self.element))
+
+
+@override_settings(AEROSPIKE_NS='test')
+class TestMaintenanceBenchmark(TestCase):
+	def test_benchmark(self):
+		with tempfile.NamedTemporaryFile(suffix='.json') as f:
+			call_command('benchmark_maintenance', sizes=[50], counters=2, namespace='test', output=f.name,
+						 stderr=io.StringIO())
+			report = json.load(f)
+		operations = [result['operation'] for result in report['results']]
+		self.assertEqual(operations, [
+			'populate', 'rename', 'counter_add', 'counter_delete', 'max_value_change', 'listing'])
+		self.assertTrue(all(result['records'] == 50 for result in report['results']))
+		self.assertFalse(Platform.objects.filter(slug='benchmark-50').exists())
+
+	def test_existing_platform_is_kept(self):
+		Platform.objects.create(name='benchmark-50', slug='benchmark-50')
+		with self.assertRaises(CommandError):
+			call_command('benchmark_maintenance', sizes=[50], namespace='test', stderr=io.StringIO())
+		self.assertTrue(Platform.objects.filter(slug='benchmark-50').exists())
+
+
+# elements are moved out of the test namespace into this one, the second namespace of the default
+# Aerospike server configuration
+TARGET_NS = 'bar'
+
+
+@override_settings(AEROSPIKE_NS='test')
+class TestPlacement(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		name = 'Test Placement'
+		slug = 'test-placement'
+		cls.platform = Platform.objects.create(name=name, slug=slug)
+		cls.element = Element.objects.create(name=name, slug=slug, platform=cls.platform)
+		cls.counter = Counter.objects.create(name=name, slug=slug, max_value=10, element=cls.element)
+		cls.records_url = reverse('record-list', kwargs={'platform': slug, 'element': slug})
+		cls.element_url = reverse('element-detail', kwargs={'platform': slug, 'element': slug})
+		cls.counter_actions_url = reverse('counter-actions', kwargs={
+			'platform': slug, 'element': slug, 'uid': 1, 'counter': slug
+		})
+
+	def setUp(self) -> None:
+		self.source = get_placement(self.element)
+		self.client.post(self.records_url, {'value': 1})
+		self.client.post(self.counter_actions_url, {'value': 4})
+
+	def test_get_placement(self):
+		set_name = 'test-placement/test-placement'
+		self.assertEqual(self.source, Placement(DEFAULT_CLUSTER, settings.AEROSPIKE_NS, set_name))
+		self.platform.namespace = TARGET_NS
+		self.assertEqual(get_placement(self.element).namespace, TARGET_NS)
+		self.element.namespace = 'other'
+		self.assertEqual(get_placement(self.element).namespace, 'other')
+
+	def test_placement_validation(self):
+		response = self.client.patch(self.element_url, {'cluster': 'unknown'}, content_type='application/json')
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+		response = self.client.patch(self.element_url, {'namespace': TARGET_NS}, content_type='application/json')
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+	@override_settings(PLACEMENT_FREEZE_GRACE=0)
+	def test_move_element(self):
+		self.assertEqual(move_placement(self.element, '', TARGET_NS), 1)
+		target = get_placement(Element.objects.get(id=self.element.id))
+		self.assertEqual(target.namespace, TARGET_NS)
+		self.assertEqual(self.client.get(self.counter_actions_url).data, 4)
+		self.assertEqual(self.client.post(self.counter_actions_url, {'value': 1}).data, 5)
+		time.sleep(1)
+		_, meta = aerospike_db.exists(self.source.key(1))
+		self.assertIsNone(meta)
+
+	def test_moving_element_refuses_writes(self):
+		Element.objects.filter(id=self.element.id).update(moving=True)
+		response = self.client.post(self.counter_actions_url, {'value': 1})
+		self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+		self.assertEqual(self.client.get(self.counter_actions_url).data, 4)
+
+	def test_moving_element_refuses_maintenance(self):
+		Element.objects.filter(id=self.element.id).update(moving=True)
+		kwargs = {'platform': self.platform.slug, 'element': self.element.slug}
+		counter_url = reverse('counter-detail', kwargs=dict(kwargs, counter=self.counter.slug))
+		responses = [
+			self.client.post(reverse('counter-list', kwargs=kwargs), {'name': 'added', 'max_value': 10}),
+			self.client.post(reverse('counter-bulk', kwargs=kwargs), {}, content_type='application/json'),
+			self.client.post(reverse('element-reset', kwargs=kwargs)),
+			self.client.patch(counter_url, json.dumps({'max_value': 20}), content_type='application/json'),
+			self.client.delete(counter_url),
+			self.client.patch(self.element_url, json.dumps({'name': 'renamed'}), content_type='application/json'),
+		]
+		for response in responses:
+			self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+		self.assertTrue(Counter.objects.filter(id=self.counter.id, max_value=10).exists())
+
+	def tearDown(self) -> None:
+		for namespace in (settings.AEROSPIKE_NS, TARGET_NS):
+			placement = self.source._replace(namespace=namespace)
+			aerospike_db.truncate(placement.namespace, placement.set_name, 0)
+			remove_top(placement)
+
+
+@override_settings(AEROSPIKE_NS='test')
+class TestIdempotencyKeys(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		name = 'Test Idempotency Keys'
+		slug = 'test-idempotency-keys'
+		cls.platform = Platform.objects.create(name=name, slug=slug)
+		cls.element = Element.objects.create(name=name, slug=slug, platform=cls.platform)
+		cls.counter = Counter.objects.create(name=name, slug=slug, max_value=10, element=cls.element)
+		cls.records_url = reverse('record-list', kwargs={'platform': slug, 'element': slug})
+		cls.record_url = reverse('record-detail', kwargs={'platform': slug, 'element': slug, 'uid': 1})
+		cls.counter_actions_url = reverse('counter-actions', kwargs={
+			'platform': slug, 'element': slug, 'uid': 1, 'counter': slug
+		})
+
+	def setUp(self) -> None:
+		self.client.post(self.records_url, {'value': 1})
+
+	def test_retry_is_replayed(self):
+		for _ in range(3):
+			response = self.client.post(self.counter_actions_url, {'value': 4}, HTTP_IDEMPOTENCY_KEY='a')
+			self.assertEqual(response.status_code, status.HTTP_200_OK)
+			self.assertEqual(response.data, 4)
+		response = self.client.post(self.counter_actions_url, {'value': 4}, HTTP_IDEMPOTENCY_KEY='b')
+		self.assertEqual(response.data, 8)
+		self.assertEqual(self.client.get(self.counter_actions_url).data, 8)
+
+	def test_record_retry_is_replayed(self):
+		data = json.dumps({self.counter.slug: 3})
+		for _ in range(2):
+			response = self.client.post(self.record_url, data, content_type='application/json',
+										HTTP_IDEMPOTENCY_KEY='a')
+			self.assertEqual(response.data[self.counter.slug], 3)
+		self.assertEqual(self.client.get(self.counter_actions_url).data, 3)
+
+	def test_key_reused_for_another_increment(self):
+		self.client.post(self.counter_actions_url, {'value': 4}, HTTP_IDEMPOTENCY_KEY='a')
+		response = self.client.post(self.counter_actions_url, {'value': 5}, HTTP_IDEMPOTENCY_KEY='a')
+		self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+		self.assertEqual(self.client.get(self.counter_actions_url).data, 4)
+
+	def test_failed_increment_is_not_remembered(self):
+		response = self.client.post(self.counter_actions_url, {'value': 11}, HTTP_IDEMPOTENCY_KEY='a')
+		self.assertEqual(response.status_code, HTTP_440_FULL)
+		response = self.client.post(self.counter_actions_url, {'value': 1}, HTTP_IDEMPOTENCY_KEY='a')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+	@override_settings(IDEMPOTENCY_MAX_KEYS=2)
+	def test_keys_are_bounded(self):
+		for key in 'abc':
+			self.client.post(self.counter_actions_url, {'value': 1}, HTTP_IDEMPOTENCY_KEY=key)
+		_, _, bins = aerospike_db.get(get_placement(self.element).key(1))
+		self.assertEqual(len(bins['idem']), 2)
+
+	def test_invalid_key(self):
+		response = self.client.post(self.counter_actions_url, {'value': 1}, HTTP_IDEMPOTENCY_KEY='a' * 65)
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def tearDown(self) -> None:
+		placement = get_placement(self.element)
+		aerospike_db.truncate(placement.namespace, placement.set_name, 0)
+		remove_top(placement)
+
+
+@override_settings(AEROSPIKE_NS='test')
+class TestAdmissionControl(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		cls.counter_actions_url = reverse('counter-actions', kwargs={
+			'platform': 'test-admission', 'element': 'element', 'uid': 1, 'counter': 'counter'
+		})
+		cls.admission_url = reverse('admission')
+
+	def test_concurrency_limit(self):
+		limiter = Limiter({'concurrency': 1})
+		limiter.acquire()
+		with self.assertRaises(Rejected) as context:
+			limiter.acquire()
+		self.assertEqual(context.exception.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+		limiter.release()
+		limiter.acquire()
+		self.assertEqual(limiter.get_metrics(), {'admitted': 2, 'overloaded': 1, 'throttled': 0, 'in_flight': 1})
+
+	def test_token_bucket(self):
+		limiter = Limiter({'rate': 1, 'burst': 2})
+		limiter.acquire()
+		limiter.acquire()
+		with self.assertRaises(Rejected) as context:
+			limiter.acquire()
+		self.assertEqual(context.exception.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+		self.assertEqual(context.exception.retry_after, 1)
+
+	def test_runtime_platform_limits(self):
+		overrides = {'platforms': {'test-admission': {'rate': 1, 'burst': 1}}}
+		response = self.client.put(self.admission_url, json.dumps(overrides), content_type='application/json')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(response.data['config']['platforms'], overrides['platforms'])
+
+		self.assertNotEqual(self.client.get(self.counter_actions_url).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+		response = self.client.get(self.counter_actions_url)
+		self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+		self.assertEqual(response['Retry-After'], '1')
+
+		metrics = self.client.get(reverse('metrics')).data['admission']
+		self.assertEqual(metrics['platforms']['test-admission']['throttled'], 1)
+
+	def test_overrides_are_shared(self):
+		overrides = {'global': {'concurrency': 7}}
+		self.client.put(self.admission_url, json.dumps(overrides), content_type='application/json')
+		# a controller of another worker, once its refresh thread read the overrides
+		controller = AdmissionController()
+		controller.refresh()
+		self.assertEqual(controller.get_config()['global'], {'concurrency': 7})
+		self.assertEqual(self.client.get(self.admission_url).data['overrides'], overrides)
+
+	def test_failed_refresh_keeps_overrides(self):
+		controller = AdmissionController()
+		controller.load({'global': {'concurrency': 7}})
+		with mock.patch('services.admission.get_overrides', side_effect=exception.TimeoutError()):
+			controller.refresh()
+		self.assertEqual(controller.config['global'], {'concurrency': 7})
+
+	def test_invalid_overrides(self):
+		overrides = {'routes': {'counter-actions': {'rate': -1}}}
+		response = self.client.put(self.admission_url, json.dumps(overrides), content_type='application/json')
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def tearDown(self) -> None:
+		try:
+			aerospike_db.remove(get_overrides_key())
+		except exception.RecordNotFound:
+			pass
+		admission_controller.load({})
+
+
+class TestWarmUp(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		cls.platform = Platform.objects.create(name='Test Warm Up', slug='test-warm-up')
+		Element.objects.create(name='Test Warm Up', slug='test-warm-up', platform=cls.platform)
+
+	def setUp(self) -> None:
+		self.initial_state = get_warm_up_state()
+		warm_up_state.update(ready=False, started=None, finished=None, error=None, attempts=0, steps={})
+
+	def test_readiness_flips_after_warm_up(self):
+		response = self.client.get(reverse('ready'))
+		self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+		warm_up()
+		response = self.client.get(reverse('ready'))
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(set(response.data['steps']), {'urls', 'database', 'aerospike'})
+
+	@override_settings(WARM_UP_RETRY_DELAY=0)
+	def test_failed_warm_up_is_retried(self):
+		with mock.patch('services.warmup.open_connections', side_effect=[RuntimeError('unreachable'), None]):
+			warm_up()
+		state = get_warm_up_state()
+		self.assertTrue(state['ready'])
+		self.assertEqual(state['attempts'], 2)
+		self.assertIsNone(state['error'])
+
+	def tearDown(self) -> None:
+		warm_up_state.update(self.initial_state)
+
+
+@override_settings(AEROSPIKE_NS='test')
+class TestAggregateLimits(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		name = 'Test Aggregate Limits'
+		slug = 'test-aggregate-limits'
+		cls.platform = Platform.objects.create(name=name, slug=slug)
+		cls.element = Element.objects.create(name=name, slug=slug, platform=cls.platform)
+		cls.other = Element.objects.create(name='Other', slug='other', platform=cls.platform)
+		cls.counter = Counter.objects.create(name=name, slug=slug, max_value=100, element=cls.element)
+		cls.other_counter = Counter.objects.create(name='Other', slug='other', max_value=100, element=cls.other)
+		cls.aggregate = AggregateLimit.objects.create(
+			name='Total', slug='total', platform=cls.platform, max_value=10, stripes=4)
+		cls.aggregate.counters.set([cls.counter, cls.other_counter])
+		cls.list_url = reverse('aggregate-list', kwargs={'platform': slug})
+		cls.detail_url = reverse('aggregate-detail', kwargs={'platform': slug, 'aggregate': 'total'})
+
+	def setUp(self) -> None:
+		for element in (self.element, self.other):
+			for uid in (1, 2):
+				url = reverse('record-list', kwargs={'platform': self.platform.slug, 'element': element.slug})
+				self.client.post(url, {'value': uid})
+
+	def increment(self, counter, uid, value):
+		url = reverse('counter-actions', kwargs={
+			'platform': self.platform.slug, 'element': counter.element.slug, 'uid': uid, 'counter': counter.slug
+		})
+		return self.client.post(url, {'value': value})
+
+	def test_platform_wide_limit(self):
+		self.assertEqual(self.increment(self.counter, 1, 4).status_code, status.HTTP_200_OK)
+		self.assertEqual(self.increment(self.other_counter, 2, 5).status_code, status.HTTP_200_OK)
+		response = self.increment(self.counter, 2, 2)
+		self.assertEqual(response.status_code, HTTP_440_FULL)
+		self.assertIn('aggregate', response.data)
+		self.assertEqual(self.increment(self.counter, 2, 1).status_code, status.HTTP_200_OK)
+		self.assertEqual(self.client.get(self.detail_url).data['value'], 10)
+
+	def test_record_increment_spans_stripes(self):
+		# every stripe holds 10 / 4 at most, the increment takes from several of them
+		url = reverse('record-detail', kwargs={
+			'platform': self.platform.slug, 'element': self.element.slug, 'uid': 1
+		})
+		data = json.dumps({self.counter.slug: 7})
+		response = self.client.post(url, data, content_type='application/json')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(self.client.get(self.detail_url).data['value'], 7)
+
+	def test_failed_increment_gives_back(self):
+		self.assertEqual(self.increment(self.counter, 3, 5).status_code, HTTP_441_NOT_EXIST)
+		self.assertEqual(self.client.get(self.detail_url).data['value'], 0)
+
+	def test_raising_increment_gives_back(self):
+		with mock.patch('services.actions.increment_counters', side_effect=exception.TimeoutError()):
+			with self.assertRaises(exception.TimeoutError):
+				self.increment(self.counter, 1, 5)
+		self.assertEqual(self.client.get(self.detail_url).data['value'], 0)
+
+	def test_replay_skips_aggregates(self):
+		url = reverse('counter-actions', kwargs={
+			'platform': self.platform.slug, 'element': self.element.slug, 'uid': 1, 'counter': self.counter.slug
+		})
+		self.assertEqual(self.client.post(url, {'value': 4}, HTTP_IDEMPOTENCY_KEY='a').status_code, status.HTTP_200_OK)
+		self.increment(self.other_counter, 1, 6)
+		response = self.client.post(url, {'value': 4}, HTTP_IDEMPOTENCY_KEY='a')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(self.client.get(self.detail_url).data['value'], 10)
+
+	def test_record_delete_gives_back(self):
+		self.increment(self.counter, 1, 4)
+		self.increment(self.counter, 2, 3)
+		self.client.delete(reverse('record-detail', kwargs={
+			'platform': self.platform.slug, 'element': self.element.slug, 'uid': 1
+		}))
+		self.assertEqual(self.client.get(self.detail_url).data['value'], 3)
+		url = reverse('record-bulk-delete', kwargs={'platform': self.platform.slug, 'element': self.element.slug})
+		self.client.post(url, json.dumps({'uids': [2]}), content_type='application/json')
+		self.assertEqual(self.client.get(self.detail_url).data['value'], 0)
+
+	def test_periodic_reset(self):
+		AggregateLimit.objects.filter(id=self.aggregate.id).update(
+			reset_period=AggregateLimit.RESET_DAILY, last_reset=timezone.now() - datetime.timedelta(days=2))
+		self.increment(self.counter, 1, 10)
+		call_command('reset_counters', stdout=io.StringIO())
+		self.assertEqual(self.client.get(self.detail_url).data['value'], 0)
+		self.assertFalse(AggregateLimit.objects.get(id=self.aggregate.id).is_reset_due())
+
+	def test_reset_period_must_match_counters(self):
+		Counter.objects.filter(id=self.counter.id).update(reset_period=Counter.RESET_DAILY)
+		data = json.dumps({'reset_period': AggregateLimit.RESET_WEEKLY})
+		response = self.client.patch(self.detail_url, data, content_type='application/json')
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+		data = json.dumps({'reset_period': AggregateLimit.RESET_DAILY})
+		response = self.client.patch(self.detail_url, data, content_type='application/json')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+	def test_refund(self):
+		self.increment(self.counter, 1, 3)
+		url = reverse('counter-refund', kwargs={
+			'platform': self.platform.slug, 'element': self.element.slug, 'uid': 1, 'counter': self.counter.slug
+		})
+		self.client.post(url, {'value': 5})
+		self.assertEqual(self.client.get(self.detail_url).data['value'], 0)
+
+	def test_reservations_are_refused(self):
+		kwargs = {
+			'platform': self.platform.slug, 'element': self.element.slug, 'uid': 1, 'counter': self.counter.slug
+		}
+		response = self.client.post(reverse('counter-reservation-list', kwargs=kwargs), {'value': 1})
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+		url = reverse('counter-reservation-detail', kwargs=dict(kwargs, reservation='abc'))
+		self.assertEqual(self.client.post(url).status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_reset(self):
+		self.increment(self.counter, 1, 10)
+		url = reverse('aggregate-reset', kwargs={'platform': self.platform.slug, 'aggregate': 'total'})
+		self.assertEqual(self.client.post(url).status_code, status.HTTP_204_NO_CONTENT)
+		self.assertEqual(self.increment(self.counter, 2, 10).status_code, status.HTTP_200_OK)
+
+	def test_create_element_wide(self):
+		data = {'name': 'Element', 'element': self.element.slug, 'counters': [f"other/{self.other_counter.slug}"],
+				'max_value': 5}
+		response = self.client.post(self.list_url, json.dumps(data), content_type='application/json')
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+		data['counters'] = [f"{self.element.slug}/{self.counter.slug}"]
+		response = self.client.post(self.list_url, json.dumps(data), content_type='application/json')
+		self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+		self.assertEqual(response.data['value'], 0)
+
+	def test_element_delete_removes_stripes(self):
+		aggregate = AggregateLimit.objects.create(
+			name='Element', slug='element', platform=self.platform, element=self.element, max_value=10, stripes=2)
+		aggregate.counters.set([self.counter])
+		self.increment(self.counter, 1, 4)
+		placement = get_aggregate_placement(aggregate)
+		self.client.delete(reverse('element-detail', kwargs={
+			'platform': self.platform.slug, 'element': self.element.slug
+		}))
+		for stripe in range(aggregate.stripes):
+			_, meta = aerospike_db.exists(placement.key(f"{aggregate.id}:{stripe}"))
+			self.assertIsNone(meta)
+
+	def test_stripes_cannot_change(self):
+		response = self.client.patch(self.detail_url, json.dumps({'stripes': 8}), content_type='application/json')
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def tearDown(self) -> None:
+		for element in (self.element, self.other):
+			placement = get_placement(element)
+			aerospike_db.truncate(placement.namespace, placement.set_name, 0)
+			remove_top(placement)
+		for aggregate in AggregateLimit.objects.select_related('platform'):
+			remove_aggregate(get_aggregate_placement(aggregate), aggregate)
+
+
+# the stream reads the element from another thread, which only sees committed data
+@override_settings(AEROSPIKE_NS='test')
+class TestElementStream(TransactionTestCase):
+	def setUp(self) -> None:
+		name = 'Test Element Stream'
+		slug = 'test-element-stream'
+		self.platform = Platform.objects.create(name=name, slug=slug)
+		self.element = Element.objects.create(name=name, slug=slug, platform=self.platform)
+		self.counter = Counter.objects.create(name=name, slug=slug, max_value=10, element=self.element)
+		self.client.post(reverse('record-list', kwargs={'platform': slug, 'element': slug}), {'value': 1})
+		self.stream_url = reverse('element-stream', kwargs={'platform': slug, 'element': slug})
+		self.counter_actions_url = reverse('counter-actions', kwargs={
+			'platform': slug, 'element': slug, 'uid': 1, 'counter': slug
+		})
+
+	def get_data(self, message):
+		return json.loads(message['body'].split(b'data: ')[1])
+
+	def test_snapshot_then_updates(self):
+		messages = []
+		scope = {'type': 'http', 'method': 'GET', 'path': self.stream_url, 'headers': [(b'host', b'testserver')]}
+
+		async def run():
+			disconnected = asyncio.Event()
+
+			async def receive():
+				await disconnected.wait()
+				return {'type': 'http.disconnect'}
+
+			async def send(message):
+				messages.append(message)
+				body = message.get('body', b'')
+				if body.startswith(b'event: snapshot'):
+					await sync_to_async(self.client.post)(self.counter_actions_url, {'value': 3})
+				elif body.startswith(b'event: update'):
+					disconnected.set()
+
+			await asyncio.wait_for(StreamApplication(None)(scope, receive, send), 5)
+
+		loop = asyncio.new_event_loop()
+		try:
+			loop.run_until_complete(run())
+		finally:
+			loop.close()
+		self.assertEqual(messages[0]['status'], status.HTTP_200_OK)
+		self.assertEqual(self.get_data(messages[1]), [{'id': 1, self.counter.slug: '0/10'}])
+		self.assertEqual(self.get_data(messages[2]), [{'id': 1, self.counter.slug: '3/10'}])
+
+	def test_changes_are_coalesced(self):
+		async def run():
+			subscription = Subscription(asyncio.get_event_loop())
+			subscription.push(1, {'a': '1/10'})
+			subscription.push(1, {'a': '2/10', 'b': '1/10'})
+			subscription.push(2, {'a': '1/10'})
+			subscription.push(2, None)
+			await asyncio.wait_for(subscription.event.wait(), 1)
+			return subscription.take()
+
+		loop = asyncio.new_event_loop()
+		try:
+			pending = loop.run_until_complete(run())
+		finally:
+			loop.close()
+		self.assertEqual(get_updates(pending), [{'id': 1, 'a': '2/10', 'b': '1/10'}, {'id': 2, 'deleted': True}])
+
+	def test_not_served_over_wsgi(self):
+		self.assertEqual(self.client.get(self.stream_url).status_code, status.HTTP_501_NOT_IMPLEMENTED)
+
+	def tearDown(self) -> None:
+		placement = get_placement(self.element)
+		aerospike_db.truncate(placement.namespace, placement.set_name, 0)
+		remove_top(placement)
+
+
+@override_settings(AEROSPIKE_NS='test')
+class TestReadCache(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		name = 'Test Read Cache'
+		slug = 'test-read-cache'
+		cls.platform = Platform.objects.create(name=name, slug=slug)
+		cls.element = Element.objects.create(name=name, slug=slug, platform=cls.platform)
+		cls.counter = Counter.objects.create(
+			name=name, slug=slug, max_value=10, max_staleness=1000, element=cls.element)
+		cls.records_url = reverse('record-list', kwargs={'platform': slug, 'element': slug})
+		cls.counter_actions_url = reverse('counter-actions', kwargs={
+			'platform': slug, 'element': slug, 'uid': 1, 'counter': slug
+		})
+
+	def setUp(self) -> None:
+		read_cache.counters.entries.clear()
+		read_cache.values.entries.clear()
+		self.client.post(self.records_url, {'value': 1})
+		self.key = get_placement(self.element).key(1)
+
+	def test_stale_read_is_served_from_memory(self):
+		self.assertEqual(self.client.get(self.counter_actions_url).data, 0)
+		# changed behind the back of this worker
+		aerospike_db.put(self.key, {str(self.counter.id): 5})
+		hits = read_cache.metrics['hits']
+		self.assertEqual(self.client.get(self.counter_actions_url).data, 0)
+		self.assertEqual(read_cache.metrics['hits'], hits + 1)
+		self.assertEqual(self.client.get(self.counter_actions_url, {'max_staleness': 0}).data, 5)
+
+	def test_increments_write_through(self):
+		self.client.get(self.counter_actions_url)
+		self.client.post(self.counter_actions_url, {'value': 3})
+		aerospike_db.put(self.key, {str(self.counter.id): 5})
+		self.assertEqual(self.client.get(self.counter_actions_url).data, 3)
+
+	def test_opt_in_per_request(self):
+		Counter.objects.filter(id=self.counter.id).update(max_staleness=0)
+		self.client.get(self.counter_actions_url, {'max_staleness': 1000})
+		aerospike_db.put(self.key, {str(self.counter.id): 5})
+		self.assertEqual(self.client.get(self.counter_actions_url, {'max_staleness': 1000}).data, 0)
+		self.assertEqual(self.client.get(self.counter_actions_url).data, 5)
+
+	@override_settings(READ_CACHE_SIZE=2)
+	def test_size_is_bounded(self):
+		placement = get_placement(self.element)
+		for uid in range(3):
+			read_cache.put(self.platform.slug, self.element.slug, placement, uid, self.counter, 0)
+		self.assertEqual(len(read_cache.values), 2)
+		self.assertIsNone(read_cache.values.get((placement.set_name, 0, self.counter.id)))
+
+	def test_invalid_staleness(self):
+		response = self.client.get(self.counter_actions_url, {'max_staleness': -1})
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def tearDown(self) -> None:
+		placement = get_placement(self.element)
+		aerospike_db.truncate(placement.namespace, placement.set_name, 0)
+		remove_top(placement)
@@ -0,0 +1,381 @@
+-- Record UDFs for counter changes that must be checked and applied atomically.
+-- The server holds the record lock for the whole call, so every function here
+-- costs a single round trip and leaves no window between the check and the write.
+--
+-- A counter bin holds either an integer (lifetime counters) or, for counters with a
+-- time window, a map of bucket start -> count. Buckets that left the window are
+-- trimmed by the same call that reads them, so a windowed bin never holds more than
+-- WINDOW_BUCKETS + 1 entries.
+--
+-- Quota reservations of a counter live in the 'r<counter bin>' bin as a map of
+-- reservation id -> [amount, expires at]. They count against the limit until they
+-- are committed, released or expire; expired ones are reclaimed by any call touching them.
+--
+-- Idempotency keys of increments live in the 'idem' bin as a map of key -> [expires at,
+-- deltas, values], so a retried increment replays its original result instead of counting twice.
+--
+-- Stripes of aggregate limits are records of their own holding the usage in the 'value' bin.
+
+local OK = 200
+local FULL = 440
+local NOT_EXIST = 441
+local MISMATCH = 422
+local TTL_NEVER_EXPIRE = -1
+local TTL_DONT_UPDATE = -2
+local IDEMPOTENCY_BIN = 'idem'
+
+local function is_number(value)
+	return type(value) == 'number'
+end
+
+local function sum(value)
+	if is_number(value) then
+		return value
+	end
+	local total = 0
+	for _, count in map.pairs(value) do
+		total = total + count
+	end
+	return total
+end
+
+-- window is a list of {bucket width, window length} in seconds
+local function window_total(buckets, window, now)
+	local width, oldest = window[1], now - window[2]
+	local total = 0
+	local stale = list()
+	for start, count in map.pairs(buckets) do
+		if start + width <= oldest then
+			list.append(stale, start)
+		else
+			total = total + count
+		end
+	end
+	for start in list.iterator(stale) do
+		map.remove(buckets, start)
+	end
+	return total
+end
+
+local function get_buckets(value)
+	if is_number(value) then
+		return map()
+	end
+	return value
+end
+
+-- returns the live total of a counter bin and its new value once delta is added
+local function apply_delta(value, delta, window, now)
+	if window == nil then
+		local total = sum(value)
+		return total, total + delta
+	end
+	local buckets = get_buckets(value)
+	local total = window_total(buckets, window, now)
+	if delta ~= 0 then
+		local start = now - now % window[1]
+		buckets[start] = (buckets[start] or 0) + delta
+	end
+	return total, buckets
+end
+
+local function reservations_bin(bin)
+	return 'r' .. bin
+end
+
+-- returns the live reservations of a counter and their total, expired ones are dropped
+local function get_reservations(rec, bin, now)
+	local reservations = rec[reservations_bin(bin)]
+	if reservations == nil then
+		return map(), 0
+	end
+	local total = 0
+	local expired = list()
+	for id, reservation in map.pairs(reservations) do
+		if reservation[2] <= now then
+			list.append(expired, id)
+		else
+			total = total + reservation[1]
+		end
+	end
+	for id in list.iterator(expired) do
+		map.remove(reservations, id)
+	end
+	return reservations, total
+end
+
+local function set_reservations(rec, bin, reservations)
+	if map.size(reservations) == 0 then
+		rec[reservations_bin(bin)] = nil
+	else
+		rec[reservations_bin(bin)] = reservations
+	end
+end
+
+-- returns the live idempotency keys, expired ones are dropped
+local function get_idempotency_keys(rec, now)
+	local keys = rec[IDEMPOTENCY_BIN]
+	if keys == nil then
+		return map()
+	end
+	local expired = list()
+	for key, entry in map.pairs(keys) do
+		if entry[1] <= now then
+			list.append(expired, key)
+		end
+	end
+	for key in list.iterator(expired) do
+		map.remove(keys, key)
+	end
+	return keys
+end
+
+-- keeps at most max_keys keys, the ones expiring first are dropped
+local function trim_idempotency_keys(keys, max_keys)
+	while map.size(keys) > max_keys do
+		local oldest, oldest_expires
+		for key, entry in map.pairs(keys) do
+			if oldest == nil or entry[1] < oldest_expires then
+				oldest, oldest_expires = key, entry[1]
+			end
+		end
+		map.remove(keys, oldest)
+	end
+end
+
+local function same_deltas(a, b)
+	if map.size(a) ~= map.size(b) then
+		return false
+	end
+	for bin, delta in map.pairs(a) do
+		if b[bin] ~= delta then
+			return false
+		end
+	end
+	return true
+end
+
+-- idempotency is nil or a list of {key, expires at, max keys per record}
+function increment_many(rec, deltas, limits, ttl, windows, now, idempotency)
+	if not aerospike:exists(rec) then
+		return map {status = NOT_EXIST}
+	end
+	local keys
+	if idempotency ~= nil then
+		keys = get_idempotency_keys(rec, now)
+		local entry = keys[idempotency[1]]
+		if entry ~= nil then
+			if not same_deltas(entry[2], deltas) then
+				return map {status = MISMATCH}
+			end
+			return map {status = OK, values = entry[3], replayed = true}
+		end
+	end
+	local updates = map()
+	local values = map()
+	for bin, delta in map.pairs(deltas) do
+		local value = rec[bin]
+		if value == nil then
+			return map {status = NOT_EXIST, bin = bin}
+		end
+		local total, updated = apply_delta(value, delta, windows[bin], now)
+		local _, reserved = get_reservations(rec, bin, now)
+		if total + reserved + delta > limits[bin] then
+			return map {status = FULL, bin = bin}
+		end
+		updates[bin] = updated
+		values[bin] = total + delta
+	end
+	for bin, value in map.pairs(updates) do
+		rec[bin] = value
+	end
+	if keys ~= nil then
+		keys[idempotency[1]] = list {idempotency[2], deltas, values}
+		trim_idempotency_keys(keys, idempotency[3])
+		rec[IDEMPOTENCY_BIN] = keys
+	end
+	record.set_ttl(rec, ttl)
+	aerospike:update(rec)
+	return map {status = OK, values = values}
+end
+
+function refund(rec, bin, delta, ttl, window, now)
+	if not aerospike:exists(rec) or rec[bin] == nil then
+		return map {status = NOT_EXIST}
+	end
+	local value
+	local refunded = delta
+	if window == nil then
+		value = sum(rec[bin]) - delta
+		if value < 0 then
+			refunded = delta + value
+			value = 0
+		end
+		rec[bin] = value
+	else
+		-- the most recent usage is given back first
+		local buckets = get_buckets(rec[bin])
+		window_total(buckets, window, now)
+		local starts = {}
+		for start in map.keys(buckets) do
+			table.insert(starts, start)
+		end
+		table.sort(starts, function(a, b) return a > b end)
+		for _, start in ipairs(starts) do
+			if delta <= 0 then
+				break
+			end
+			local given = math.min(buckets[start], delta)
+			buckets[start] = buckets[start] - given
+			delta = delta - given
+		end
+		refunded = refunded - delta
+		value = sum(buckets)
+		rec[bin] = buckets
+	end
+	record.set_ttl(rec, ttl)
+	aerospike:update(rec)
+	return map {status = OK, value = value, refunded = refunded}
+end
+
+function reserve(rec, bin, amount, limit, ttl, window, now, id, expires_at)
+	if not aerospike:exists(rec) or rec[bin] == nil then
+		return map {status = NOT_EXIST}
+	end
+	local total, updated = apply_delta(rec[bin], 0, window, now)
+	local reservations, reserved = get_reservations(rec, bin, now)
+	if total + reserved + amount > limit then
+		return map {status = FULL}
+	end
+	reservations[id] = list {amount, expires_at}
+	rec[bin] = updated
+	set_reservations(rec, bin, reservations)
+	record.set_ttl(rec, ttl)
+	aerospike:update(rec)
+	return map {status = OK, reserved = reserved + amount}
+end
+
+-- amount is the real usage, nil commits the reserved amount
+function commit(rec, bin, id, amount, limit, ttl, window, now)
+	if not aerospike:exists(rec) or rec[bin] == nil then
+		return map {status = NOT_EXIST}
+	end
+	local reservations, reserved = get_reservations(rec, bin, now)
+	local reservation = reservations[id]
+	if reservation == nil then
+		return map {status = NOT_EXIST}
+	end
+	amount = amount or reservation[1]
+	local total, updated = apply_delta(rec[bin], amount, window, now)
+	if total + reserved - reservation[1] + amount > limit then
+		return map {status = FULL}
+	end
+	map.remove(reservations, id)
+	rec[bin] = updated
+	set_reservations(rec, bin, reservations)
+	record.set_ttl(rec, ttl)
+	aerospike:update(rec)
+	return map {status = OK, value = total + amount, amount = amount}
+end
+
+function release(rec, bin, id, ttl, now)
+	if not aerospike:exists(rec) or rec[bin] == nil then
+		return map {status = NOT_EXIST}
+	end
+	local reservations = get_reservations(rec, bin, now)
+	if reservations[id] == nil then
+		return map {status = NOT_EXIST}
+	end
+	map.remove(reservations, id)
+	set_reservations(rec, bin, reservations)
+	record.set_ttl(rec, ttl)
+	aerospike:update(rec)
+	return map {status = OK}
+end
+
+-- takes as much of amount as fits under limit and returns the part taken
+function take(rec, amount, limit)
+	local exists = aerospike:exists(rec)
+	local value = exists and rec['value'] or 0
+	local taken = math.min(amount, limit - value)
+	if taken <= 0 then
+		return 0
+	end
+	rec['value'] = value + taken
+	if exists then
+		record.set_ttl(rec, TTL_DONT_UPDATE)
+		aerospike:update(rec)
+	else
+		record.set_ttl(rec, TTL_NEVER_EXPIRE)
+		aerospike:create(rec)
+	end
+	return taken
+end
+
+-- gives back at most the current usage and returns the part given back
+function give_back(rec, amount)
+	if not aerospike:exists(rec) or rec['value'] == nil then
+		return 0
+	end
+	local given = math.min(amount, rec['value'])
+	rec['value'] = rec['value'] - given
+	record.set_ttl(rec, TTL_DONT_UPDATE)
+	aerospike:update(rec)
+	return given
+end
+
+-- removes the record and returns the values its bins held, nil when it does not exist
+function remove_returning(rec, bins)
+	if not aerospike:exists(rec) then
+		return nil
+	end
+	local values = map()
+	for bin in list.iterator(bins) do
+		values[bin] = rec[bin]
+	end
+	aerospike:remove(rec)
+	return values
+end
+
+-- applied by a background scan, initial maps every bin to its empty value
+function reset(rec, initial)
+	local changed = false
+	for bin, value in map.pairs(initial) do
+		if rec[bin] ~= nil and rec[bin] ~= 0 then
+			rec[bin] = value
+			changed = true
+		end
+	end
+	if changed then
+		record.set_ttl(rec, TTL_DONT_UPDATE)
+		aerospike:update(rec)
+	end
+end
+
+local COMPARE = {
+	eq = function(a, b) return a == b end,
+	lt = function(a, b) return a < b end,
+	lte = function(a, b) return a <= b end,
+	gt = function(a, b) return a > b end,
+	gte = function(a, b) return a >= b end,
+}
+
+-- applied by a background scan to delete every record whose counter matches the filter,
+-- windowed counters are compared by their total over the current window like element_stats does
+function delete_matching(rec, bin, op, value, window, now)
+	local current = rec[bin]
+	if current == nil then
+		return
+	end
+	local total
+	if window == nil then
+		total = sum(current)
+	elseif is_number(current) then
+		total = 0
+	else
+		total = window_total(current, window, now)
+	end
+	if COMPARE[op](total, value) then
+		aerospike:remove(rec)
+	end
+end
@@ -0,0 +1,77 @@
+-- Stream UDF computing per counter aggregates of an element on the server nodes,
+-- the client only merges one partial result per node.
+
+local BUCKETS = 10
+
+-- window is a list of {bucket width, window length}, buckets outside of it are skipped
+local function get_total(value, window, now)
+	if type(value) == 'number' then
+		if window == nil then
+			return value
+		end
+		return 0
+	end
+	local total = 0
+	for start, count in map.pairs(value) do
+		if window == nil or start + window[1] > now - window[2] then
+			total = total + count
+		end
+	end
+	return total
+end
+
+local function new_counter()
+	local histogram = list()
+	for i = 1, BUCKETS do
+		list.append(histogram, 0)
+	end
+	return map {total = 0, full = 0, histogram = histogram}
+end
+
+local function merge_counter(a, b)
+	a['total'] = a['total'] + b['total']
+	a['full'] = a['full'] + b['full']
+	local histogram = a['histogram']
+	for i = 1, BUCKETS do
+		histogram[i] = histogram[i] + b['histogram'][i]
+	end
+	return a
+end
+
+function element_stats(stream, limits, windows, now)
+	local function add(stats, rec)
+		stats['records'] = stats['records'] + 1
+		for bin, max_value in map.pairs(limits) do
+			local value = rec[bin]
+			if value ~= nil then
+				value = get_total(value, windows[bin], now)
+				local counter = stats['counters'][bin]
+				if counter == nil then
+					counter = new_counter()
+					stats['counters'][bin] = counter
+				end
+				counter['total'] = counter['total'] + value
+				if value >= max_value then
+					counter['full'] = counter['full'] + 1
+				end
+				local bucket = math.min(math.floor(value * BUCKETS / max_value) + 1, BUCKETS)
+				counter['histogram'][bucket] = counter['histogram'][bucket] + 1
+			end
+		end
+		return stats
+	end
+
+	local function merge(a, b)
+		a['records'] = a['records'] + b['records']
+		for bin, counter in map.pairs(b['counters']) do
+			if a['counters'][bin] == nil then
+				a['counters'][bin] = counter
+			else
+				merge_counter(a['counters'][bin], counter)
+			end
+		end
+		return a
+	end
+
+	return stream : aggregate(map {records = 0, counters = map()}, add) : reduce(merge)
+end
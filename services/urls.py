@@ -9,15 +9,45 @@ urlpatterns = [
 	path('<slug:platform>/', PlatformDetailApiView.as_view(), name='platform-detail'),
 
 	path('<slug:platform>/elements/', ElementListCreateApiView.as_view(), name='element-list'),
+	path('<slug:platform>/aggregates/', AggregateListCreateApiView.as_view(), name='aggregate-list'),
+	path('<slug:platform>/aggregates/<slug:aggregate>/',
+		 AggregateDetailApiView.as_view(), name='aggregate-detail'),
+	path('<slug:platform>/aggregates/<slug:aggregate>/reset/',
+		 AggregateResetApiView.as_view(), name='aggregate-reset'),
 	path('<slug:platform>/<slug:element>/', ElementDetailApiView.as_view(), name='element-detail'),
 	path('<slug:platform>/<slug:element>/records/',
 		 RecordListCreateApiView.as_view(), name='record-list'),
+	path('<slug:platform>/<slug:element>/records/delete/',
+		 RecordBulkDeleteApiView.as_view(), name='record-bulk-delete'),
+	path('<slug:platform>/<slug:element>/records/<int:uid>/',
+		 RecordDetailApiView.as_view(), name='record-detail'),
+
+	path('<slug:platform>/<slug:element>/stream/',
+		 ElementStreamApiView.as_view(), name='element-stream'),
+	path('<slug:platform>/<slug:element>/stats/',
+		 ElementStatsApiView.as_view(), name='element-stats'),
+	path('<slug:platform>/<slug:element>/export/',
+		 RecordExportApiView.as_view(), name='record-export'),
+	path('<slug:platform>/<slug:element>/reset/',
+		 ElementResetApiView.as_view(), name='element-reset'),
+	path('<slug:platform>/<slug:element>/jobs/<int:job>/',
+		 ElementJobApiView.as_view(), name='element-job'),
 
 	path('<slug:platform>/<slug:element>/counters/',
 		 CounterListCreateApiView.as_view(), name='counter-list'),
+	path('<slug:platform>/<slug:element>/counters/bulk/',
+		 CounterBulkApiView.as_view(), name='counter-bulk'),
 	path('<slug:platform>/<slug:element>/<slug:counter>/',
 		 CounterDetailApiView.as_view(), name='counter-detail'),
 
+	path('<slug:platform>/<slug:element>/<slug:counter>/top/',
+		 CounterTopApiView.as_view(), name='counter-top'),
 	path('<slug:platform>/<slug:element>/<int:uid>/<slug:counter>/',
-		 CounterActionsApiView.as_view(), name='counter-actions')
+		 CounterActionsApiView.as_view(), name='counter-actions'),
+	path('<slug:platform>/<slug:element>/<int:uid>/<slug:counter>/refund/',
+		 CounterRefundApiView.as_view(), name='counter-refund'),
+	path('<slug:platform>/<slug:element>/<int:uid>/<slug:counter>/reservations/',
+		 CounterReservationListApiView.as_view(), name='counter-reservation-list'),
+	path('<slug:platform>/<slug:element>/<int:uid>/<slug:counter>/reservations/<slug:reservation>/',
+		 CounterReservationDetailApiView.as_view(), name='counter-reservation-detail'),
 ]
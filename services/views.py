@@ -1,6 +1,11 @@
 import logging
+import time
 
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 from django.utils.text import slugify
 from rest_framework import status
 from rest_framework.decorators import api_view
@@ -9,15 +14,21 @@ from rest_framework.response import Response
 from rest_framework.reverse import reverse
 from rest_framework.generics import ListCreateAPIView, RetrieveUpdateDestroyAPIView
 from rest_framework.views import APIView
+import aerospike
 from aerospike import exception
 
+from services.actions import *
+from services import read_cache
+from services.admission import controller as admission_controller, get_overrides
 from services.aerospike_utils import *
-from services.models import Platform, Element, Counter
-from services.serializers import (PlatformSerializer, ElementSerializer, CounterSerializer)
-
-HTTP_440_FULL = 440
-HTTP_441_NOT_EXIST = 441
-HTTP_442_ALREADY_EXIST = 442
+from services.events import get_sink, record_event
+from services.export import FORMATS
+from services.models import Platform, Element, Counter, AggregateLimit
+from services.placement import get_aggregate_placement, get_element, get_placement, get_set_name
+from services.serializers import (PlatformSerializer, ElementSerializer, CounterSerializer,
+								  AggregateLimitSerializer)
+from services.streams import broker as stream_broker, publish_deleted, publish_values
+from services.warmup import get_state as get_warm_up_state
 
 logger = logging.getLogger('django')
 
@@ -29,6 +40,37 @@ def api_root(request, format=None):
 	})
 
 
+@api_view(['GET'])
+def metrics(request, format=None):
+	event_sink = get_sink()
+	return Response({
+		'events': event_sink.get_metrics() if event_sink is not None else None,
+		'admission': admission_controller.get_metrics(),
+		'streams': stream_broker.count,
+		'read_cache': read_cache.get_metrics(),
+	})
+
+
+@api_view(['GET'])
+def readiness(request, format=None):
+	state = get_warm_up_state()
+	status_code = status.HTTP_200_OK if state['ready'] else status.HTTP_503_SERVICE_UNAVAILABLE
+	return Response(state, status=status_code)
+
+
+@api_view(['GET', 'PUT'])
+def admission(request, format=None):
+	if request.method == 'PUT':
+		try:
+			admission_controller.set_overrides(request.data)
+		except ValueError as e:
+			return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+	return Response({
+		'config': admission_controller.get_config(),
+		'overrides': get_overrides(),
+	})
+
+
 class PlatformListCreateApiView(ListCreateAPIView):
 	queryset = Platform.objects.all()
 	serializer_class = PlatformSerializer
@@ -48,25 +90,77 @@ class PlatformDetailApiView(RetrieveUpdateDestroyAPIView):
 		name = serializer.validated_data.get('name', obj.name)
 		new_slug = slugify(name)
 		if new_slug != obj.slug:
-			elements = Element.objects.filter(platform=obj)
+			elements = Element.objects.filter(platform=obj).select_related('platform')
+			if any(element.moving for element in elements):
+				raise ElementMoving()
 			for element in elements:
-				old_set_name = f"{obj.slug}/{element.slug}"
-				new_set_name = f"{new_slug}/{element.slug}"
-				callback_func = update_set_name(new_set_name)
-				aerospike_db.query(settings.AEROSPIKE_NS, old_set_name).foreach(callback_func)
-				aerospike_db.truncate(settings.AEROSPIKE_NS, old_set_name, 0)
+				source = get_placement(element)
+				target = source._replace(set_name=get_set_name(new_slug, element.slug))
+				callback_func = copy_record_to(target)
+				scan_set(source, callback_func)
+				source.client.truncate(source.namespace, source.set_name, 0)
+				move_top(source, target)
 
 		if serializer.validated_data.get('name') != obj.name:
 			serializer.save(slug=new_slug)
 
 	def perform_destroy(self, instance):
-		elements = Element.objects.filter(platform=instance)
+		elements = Element.objects.filter(platform=instance).select_related('platform')
 		for element in elements:
-			set_name = f"{instance.slug}/{element.slug}"
-			aerospike_db.truncate(settings.AEROSPIKE_NS, set_name, 0)
+			placement = get_placement(element)
+			placement.client.truncate(placement.namespace, placement.set_name, 0)
+			remove_top(placement)
+		for aggregate in instance.aggregates.select_related('platform'):
+			remove_aggregate(get_aggregate_placement(aggregate), aggregate)
+		instance.delete()
+
+
+class AggregateListCreateApiView(ListCreateAPIView):
+	serializer_class = AggregateLimitSerializer
+
+	def get_queryset(self):
+		return AggregateLimit.objects.filter(platform__slug=self.kwargs['platform']).select_related(
+			'platform', 'element').prefetch_related('counters__element')
+
+	def perform_create(self, serializer):
+		slug = slugify(serializer.validated_data['name'])
+		try:
+			platform = Platform.objects.get(slug=self.kwargs['platform'])
+		except Platform.DoesNotExist:
+			raise ValidationError({"platform": "Does not exist"})
+		serializer.save(platform=platform, slug=slug)
+
+
+class AggregateDetailApiView(RetrieveUpdateDestroyAPIView):
+	serializer_class = AggregateLimitSerializer
+	lookup_url_kwarg = 'aggregate'
+	lookup_field = 'slug'
+
+	def get_queryset(self):
+		return AggregateLimit.objects.filter(platform__slug=self.kwargs['platform']).select_related(
+			'platform', 'element').prefetch_related('counters__element')
+
+	def perform_update(self, serializer):
+		obj = self.get_object()
+		serializer.save(slug=slugify(serializer.validated_data.get('name', obj.name)))
+
+	def perform_destroy(self, instance):
+		remove_aggregate(get_aggregate_placement(instance), instance)
 		instance.delete()
 
 
+class AggregateResetApiView(APIView):
+	def post(self, request, **kwargs):
+		try:
+			aggregate = AggregateLimit.objects.select_related('platform').get(
+				platform__slug=kwargs['platform'], slug=kwargs['aggregate'])
+		except AggregateLimit.DoesNotExist:
+			return Response(status=HTTP_441_NOT_EXIST)
+		remove_aggregate(get_aggregate_placement(aggregate), aggregate)
+		AggregateLimit.objects.filter(id=aggregate.id).update(last_reset=timezone.now())
+		return Response(status=status.HTTP_204_NO_CONTENT)
+
+
 class ElementListCreateApiView(ListCreateAPIView):
 	serializer_class = ElementSerializer
 
@@ -95,27 +189,96 @@ class ElementDetailApiView(RetrieveUpdateDestroyAPIView):
 		name = serializer.validated_data.get('name', obj.name)
 		new_slug = slugify(name)
 		if new_slug != obj.slug:
-			old_set_name = f"{self.kwargs['platform']}/{obj.slug}"
-			new_set_name = f"{self.kwargs['platform']}/{new_slug}"
-			callback_func = update_set_name(new_set_name)
-			aerospike_db.query(settings.AEROSPIKE_NS, old_set_name).foreach(callback_func)
-			aerospike_db.truncate(settings.AEROSPIKE_NS, old_set_name, 0)
+			if obj.moving:
+				raise ElementMoving()
+			source = get_placement(obj)
+			target = source._replace(set_name=get_set_name(self.kwargs['platform'], new_slug))
+			callback_func = copy_record_to(target)
+			scan_set(source, callback_func)
+			source.client.truncate(source.namespace, source.set_name, 0)
+			move_top(source, target)
 
 		if serializer.validated_data.get('name') != obj.name:
 			serializer.save(slug=new_slug)
 
 	def perform_destroy(self, instance):
-		set_name = f"{instance.platform.slug}/{instance.slug}"
-		aerospike_db.truncate(settings.AEROSPIKE_NS, set_name, 0)
+		placement = get_placement(instance)
+		placement.client.truncate(placement.namespace, placement.set_name, 0)
+		remove_top(placement)
+		for aggregate in instance.aggregates.select_related('platform'):
+			remove_aggregate(get_aggregate_placement(aggregate), aggregate)
 		instance.delete()
 
 
+# Streams are long lived and served by services.streams.StreamApplication under ASGI,
+# a worker thread is never held for one.
+class ElementStreamApiView(APIView):
+	def get(self, request, **kwargs):
+		message = {'detail': 'streams are only served by the ASGI application'}
+		return Response(message, status=status.HTTP_501_NOT_IMPLEMENTED)
+
+
+class ElementStatsApiView(APIView):
+	def get(self, request, **kwargs):
+		cache_key = f"element-stats:{get_set_name(kwargs['platform'], kwargs['element'])}"
+		stats = cache.get(cache_key)
+		if stats is None:
+			try:
+				element = get_element(kwargs['platform'], kwargs['element'])
+			except Element.DoesNotExist:
+				return Response({"element": "Does not exist"}, status=status.HTTP_400_BAD_REQUEST)
+			stats = get_element_stats(get_placement(element), list(element.counters.order_by('id')))
+			cache.set(cache_key, stats, settings.STATS_CACHE_TTL)
+		return Response(stats, status=status.HTTP_200_OK)
+
+
+class ElementResetApiView(APIView):
+	def post(self, request, **kwargs):
+		counters = Counter.objects.select_related('element__platform').filter(
+			element__platform__slug=kwargs['platform'], element__slug=kwargs['element'])
+		if hasattr(request.data, 'getlist'):
+			slugs = request.data.getlist('counters')
+		else:
+			slugs = request.data.get('counters') if isinstance(request.data, dict) else None
+		if slugs:
+			counters = counters.filter(slug__in=slugs)
+			if len(counters) != len(set(slugs)):
+				return Response(status=HTTP_441_NOT_EXIST)
+		counters = list(counters)
+		if not counters:
+			return Response(status=HTTP_441_NOT_EXIST)
+		if counters[0].element.moving:
+			return Response(MOVING_MESSAGE, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+		job_id = reset_counters(get_placement(counters[0].element), counters)
+		Counter.objects.filter(id__in=[c.id for c in counters]).update(last_reset=timezone.now())
+		url = reverse('element-job', request=request, kwargs={**kwargs, 'job': job_id})
+		return Response({'job': job_id, 'url': url}, status=status.HTTP_202_ACCEPTED)
+
+
+class ElementJobApiView(APIView):
+	def get(self, request, **kwargs):
+		try:
+			element = get_element(kwargs['platform'], kwargs['element'])
+			info = get_job_info(get_placement(element), kwargs['job'])
+		except (Element.DoesNotExist, exception.AerospikeError):
+			return Response(status=status.HTTP_404_NOT_FOUND)
+		completed = info['status'] == aerospike.JOB_STATUS_COMPLETED
+		return Response({
+			'job': kwargs['job'],
+			'completed': completed,
+			'progress': info.get('progress_pct'),
+			'records': info.get('records_read'),
+		}, status=status.HTTP_200_OK)
+
+
 class RecordListCreateApiView(APIView):
 	def get(self, request, **kwargs):
-		set_name = f"{kwargs['platform']}/{kwargs['element']}"
-		results = aerospike_db.scan(settings.AEROSPIKE_NS, set_name).results()
-		results = sorted(convert_results(results), key=lambda e: e['id'])
-		return Response(results, status=status.HTTP_200_OK)
+		try:
+			placement = get_placement(get_element(kwargs['platform'], kwargs['element']))
+		except Element.DoesNotExist:
+			return Response({"element": "Does not exist"}, status=status.HTTP_400_BAD_REQUEST)
+		return Response(list_records(placement), status=status.HTTP_200_OK)
 
 	def post(self, request, **kwargs):
 		try:
@@ -123,27 +286,130 @@ class RecordListCreateApiView(APIView):
 		except (KeyError, ValueError):
 			return Response({'value': 'must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
 		try:
-			element = Element.objects.get(
-				platform__slug=self.kwargs['platform'], slug=self.kwargs['element'])
+			element = get_element(kwargs['platform'], kwargs['element'])
 		except Element.DoesNotExist:
 			return Response({"element": "Does not exist"}, status=status.HTTP_400_BAD_REQUEST)
+		if element.moving:
+			return Response(MOVING_MESSAGE, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
-		key = (settings.AEROSPIKE_NS, f"{kwargs['platform']}/{kwargs['element']}", record_id)
-		_, meta = aerospike_db.exists(key)
+		placement = get_placement(element)
+		key = placement.key(record_id)
+		_, meta = placement.client.exists(key)
 		if meta is not None:
 			message = {'value': 'record with this value already exists'}
 			return Response(message, status=HTTP_442_ALREADY_EXIST)
 
 		counters = Counter.objects.filter(element=element)
-		bins = {str(counter.id): 0 for counter in counters}
+		bins = {str(counter.id): counter.get_initial_value() for counter in counters}
 		bins['id'] = record_id
 		response = collections.OrderedDict(id=record_id)
 		for counter in counters:
 			response[counter.slug] = f"0/{counter.max_value}"
-		aerospike_db.put(key, bins)
+		placement.client.put(key, bins, meta={'ttl': element.record_ttl})
+		publish_values(placement, record_id, {counter: 0 for counter in counters})
 		return Response(response, status=status.HTTP_201_CREATED)
 
 
+class RecordExportApiView(APIView):
+	def get(self, request, **kwargs):
+		output = request.query_params.get('output', 'ndjson')
+		if output not in FORMATS:
+			message = {'output': f"must be one of: {', '.join(FORMATS)}"}
+			return Response(message, status=status.HTTP_400_BAD_REQUEST)
+		try:
+			element = get_element(kwargs['platform'], kwargs['element'])
+		except Element.DoesNotExist:
+			return Response({"element": "Does not exist"}, status=status.HTTP_400_BAD_REQUEST)
+
+		exporter, content_type, extension = FORMATS[output]
+		counters = list(element.counters.order_by('id'))
+		records = iter_records(get_placement(element))
+		response = StreamingHttpResponse(exporter(records, counters), content_type=content_type)
+		file_name = f"{kwargs['platform']}-{kwargs['element']}.{extension}"
+		response['Content-Disposition'] = f'attachment; filename="{file_name}"'
+		return response
+
+
+class RecordDetailApiView(APIView):
+	def get(self, request, **kwargs):
+		try:
+			element = get_element(kwargs['platform'], kwargs['element'])
+			# read and touched in a single operation, so a record expiring in between is a plain 441
+			bin_names = ['id'] + [str(counter.id) for counter in element.counters.all()]
+			bins = read_bins(get_placement(element), kwargs['uid'], bin_names, get_touch_ttl(element))
+		except (Element.DoesNotExist, exception.RecordNotFound):
+			return Response(status=HTTP_441_NOT_EXIST)
+		return Response(next(convert_results([(None, None, bins)])), status=status.HTTP_200_OK)
+
+	def post(self, request, **kwargs):
+		payload, status_code = increment_record(
+			data=request.data, idempotency_key=request.headers.get('Idempotency-Key'), **kwargs)
+		return Response(payload, status=status_code)
+
+	def delete(self, request, **kwargs):
+		try:
+			element = get_element(kwargs['platform'], kwargs['element'])
+			if element.moving:
+				return Response(MOVING_MESSAGE, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+			placement = get_placement(element)
+			totals = remove_record(placement, kwargs['uid'], get_aggregated_counters(element))
+		except Element.DoesNotExist:
+			return Response(status=HTTP_441_NOT_EXIST)
+		if totals is None:
+			return Response(status=HTTP_441_NOT_EXIST)
+		give_back_record(element.platform, kwargs['uid'], totals)
+		publish_deleted(placement, kwargs['uid'])
+		return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class RecordBulkDeleteApiView(APIView):
+	def post(self, request, **kwargs):
+		if not isinstance(request.data, dict):
+			return Response(NOT_AN_OBJECT_MESSAGE, status=status.HTTP_400_BAD_REQUEST)
+		try:
+			element = get_element(kwargs['platform'], kwargs['element'])
+		except Element.DoesNotExist:
+			return Response(status=HTTP_441_NOT_EXIST)
+		if element.moving:
+			return Response(MOVING_MESSAGE, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+		placement = get_placement(element)
+
+		if 'uids' in request.data:
+			uids = request.data.getlist('uids') if hasattr(request.data, 'getlist') else request.data['uids']
+			try:
+				# a string or an object would otherwise be iterated character by character or key by key
+				if not isinstance(uids, list) or len(uids) > settings.BULK_DELETE_MAX_UIDS:
+					raise ValueError()
+				record_ids = [int(uid) for uid in uids]
+			except (TypeError, ValueError):
+				message = {'uids': f"must be a list of at most {settings.BULK_DELETE_MAX_UIDS} integers"}
+				return Response(message, status=status.HTTP_400_BAD_REQUEST)
+			deleted = remove_records(
+				placement, record_ids, counters=get_aggregated_counters(element),
+				on_removed=lambda uid, totals: give_back_record(element.platform, uid, totals))
+			for record_id in record_ids:
+				publish_deleted(placement, record_id)
+			return Response({'deleted': deleted}, status=status.HTTP_200_OK)
+
+		record_filter = request.data.get('filter')
+		try:
+			op = record_filter['op']
+			value = int(record_filter['value'])
+			if op not in FILTER_OPERATORS:
+				raise ValueError()
+		except (KeyError, TypeError, ValueError):
+			message = {'filter': f"must contain counter, op ({', '.join(FILTER_OPERATORS)}) and value"}
+			return Response(message, status=status.HTTP_400_BAD_REQUEST)
+		try:
+			counter = get_counter(kwargs['platform'], kwargs['element'], record_filter.get('counter'))
+		except Counter.DoesNotExist:
+			return Response(status=HTTP_441_NOT_EXIST)
+
+		job_id = delete_matching_records(placement, counter, op, value)
+		url = reverse('element-job', request=request, kwargs={**kwargs, 'job': job_id})
+		return Response({'job': job_id, 'url': url}, status=status.HTTP_202_ACCEPTED)
+
+
 class CounterListCreateApiView(ListCreateAPIView):
 	serializer_class = CounterSerializer
 
@@ -155,15 +421,57 @@ class CounterListCreateApiView(ListCreateAPIView):
 	def perform_create(self, serializer):
 		slug = slugify(serializer.validated_data['name'])
 		try:
-			element = Element.objects.get(
-				platform__slug=self.kwargs['platform'], slug=self.kwargs['element'])
+			element = get_element(self.kwargs['platform'], self.kwargs['element'])
 		except Element.DoesNotExist:
 			raise ValidationError({"element": "Does not exist"})
+		if element.moving:
+			raise ElementMoving()
 		serializer.save(element=element, slug=slug)
 
-		callback_func = add_counter_to_record(serializer.data['id'])
-		set_name = f"{self.kwargs['platform']}/{self.kwargs['element']}"
-		aerospike_db.query(settings.AEROSPIKE_NS, set_name).foreach(callback_func)
+		placement = get_placement(element)
+		callback_func = add_counter_to_record(placement, serializer.instance)
+		scan_set(placement, callback_func)
+
+
+class CounterBulkApiView(APIView):
+	def post(self, request, **kwargs):
+		if not isinstance(request.data, dict):
+			return Response(NOT_AN_OBJECT_MESSAGE, status=status.HTTP_400_BAD_REQUEST)
+		try:
+			element = get_element(kwargs['platform'], kwargs['element'])
+		except Element.DoesNotExist:
+			return Response({"element": "Does not exist"}, status=status.HTTP_400_BAD_REQUEST)
+		if element.moving:
+			return Response(MOVING_MESSAGE, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+		context = {'request': request, 'view': self}
+		serializer = CounterSerializer(data=request.data.get('create', []), many=True, context=context)
+		serializer.is_valid(raise_exception=True)
+		slugs = [slugify(data['name']) for data in serializer.validated_data]
+		if len(slugs) != len(set(slugs)):
+			raise ValidationError({'create': 'counter names must be unique'})
+
+		deleted_slugs = request.data.get('delete', [])
+		deleted = list(element.counters.filter(slug__in=deleted_slugs))
+		if len(deleted) != len(set(deleted_slugs)):
+			raise ValidationError({'delete': 'some of the counters do not exist'})
+
+		with transaction.atomic():
+			created = [Counter.objects.create(element=element, slug=slug, **data)
+					   for slug, data in zip(slugs, serializer.validated_data)]
+
+		# every record is rewritten once no matter how many counters were changed
+		placement = get_placement(element)
+		callback_func = apply_counter_changes(placement, created, [counter.id for counter in deleted])
+		scan_set(placement, callback_func)
+		for counter in deleted:
+			remove_top(placement, counter.id)
+		Counter.objects.filter(id__in=[counter.id for counter in deleted]).delete()
+
+		return Response({
+			'created': CounterSerializer(created, many=True, context=context).data,
+			'deleted': [counter.slug for counter in deleted],
+		}, status=status.HTTP_201_CREATED)
 
 
 class CounterDetailApiView(RetrieveUpdateDestroyAPIView):
@@ -181,51 +489,150 @@ class CounterDetailApiView(RetrieveUpdateDestroyAPIView):
 		serializer.save(slug=slug)
 
 	def perform_destroy(self, instance):
-		set_name = f"{self.kwargs['platform']}/{self.kwargs['element']}"
-		query = aerospike_db.query(settings.AEROSPIKE_NS, set_name)
-		callback_func = delete_counter_from_record(instance.id)
-		query.foreach(callback_func)
+		if instance.element.moving:
+			raise ElementMoving()
+		placement = get_placement(instance.element)
+		callback_func = delete_counter_from_record(placement, instance.id)
+		scan_set(placement, callback_func)
+		remove_top(placement, instance.id)
 		instance.delete()
 
 
 class CounterActionsApiView(APIView):
-	def get_record_key(self):
-		set_name = f"{self.kwargs['platform']}/{self.kwargs['element']}"
-		return settings.AEROSPIKE_NS, set_name, self.kwargs['uid']
-
-	def get_counter_with_value(self, key):
-		counter = Counter.objects.get(
-			element__platform__slug=self.kwargs['platform'],
-			element__slug=self.kwargs['element'],
-			slug=self.kwargs['counter']
-		)
-		_, _, bins = aerospike_db.get(key)
-		return counter, bins[str(counter.id)]
+	def get(self, request, **kwargs):
+		payload, status_code = read_counter(max_staleness=request.query_params.get('max_staleness'), **kwargs)
+		return Response(payload, status=status_code)
+
+	def post(self, request, **kwargs):
+		payload, status_code = increment_counter(
+			data=request.data, idempotency_key=request.headers.get('Idempotency-Key'), **kwargs)
+		return Response(payload, status=status_code)
+
 
+class CounterTopApiView(APIView):
 	def get(self, request, **kwargs):
-		key = self.get_record_key()
 		try:
-			_, counter_value = self.get_counter_with_value(key)
-		except (exception.AerospikeError, Counter.DoesNotExist):
+			size = int(request.query_params.get('k', settings.TOP_K_SIZE))
+			if not 0 < size <= settings.TOP_K_SIZE:
+				raise ValueError()
+		except ValueError:
+			message = {'k': f'must be an integer between 1 and {settings.TOP_K_SIZE}'}
+			return Response(message, status=status.HTTP_400_BAD_REQUEST)
+		try:
+			counter = get_counter(kwargs['platform'], kwargs['element'], kwargs['counter'])
+		except Counter.DoesNotExist:
 			return Response(status=HTTP_441_NOT_EXIST)
-		return Response(counter_value, status=status.HTTP_200_OK)
 
+		top = get_top(get_placement(counter.element), counter.id, size)
+		results = [collections.OrderedDict(id=record_id, value=value) for record_id, value in top]
+		return Response(results, status=status.HTTP_200_OK)
+
+
+class CounterRefundApiView(APIView):
 	def post(self, request, **kwargs):
 		try:
-			value = int(request.data['value'])
-			if value < 0:
-				raise ValueError()
-		except (KeyError, ValueError):
+			value = get_positive_value(request.data)
+		except (KeyError, TypeError, ValueError):
 			message = {'value': 'must be a positive integer'}
 			return Response(message, status=status.HTTP_400_BAD_REQUEST)
 
-		key = self.get_record_key()
 		try:
-			counter, counter_value = self.get_counter_with_value(key)
-		except (exception.AerospikeError, Counter.DoesNotExist):
+			counter = get_counter(kwargs['platform'], kwargs['element'], kwargs['counter'])
+		except Counter.DoesNotExist:
 			return Response(status=HTTP_441_NOT_EXIST)
+		if counter.element.moving:
+			return Response(MOVING_MESSAGE, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+		placement = get_placement(counter.element)
 
-		if counter_value + value > counter.max_value:
-			return Response(status=HTTP_440_FULL)
-		aerospike_db.increment(key, str(counter.id), value)
-		return Response(counter_value + value, status=status.HTTP_200_OK)
+		result = refund_counter(placement, kwargs['uid'], counter, value, get_touch_ttl(counter.element))
+		if result['status'] == HTTP_441_NOT_EXIST:
+			return Response(status=HTTP_441_NOT_EXIST)
+		for aggregate in counter.aggregates.all():
+			aggregate.platform = counter.element.platform
+			refund_aggregate(get_aggregate_placement(aggregate), aggregate, kwargs['uid'], result['refunded'])
+		update_top(placement, counter.id, kwargs['uid'], result['value'])
+		if result['refunded']:
+			record_event(kwargs['platform'], kwargs['element'], kwargs['uid'], counter.slug, -result['refunded'])
+		publish_values(placement, kwargs['uid'], {counter: result['value']})
+		read_cache.write_through(placement, kwargs['uid'], counter, result['value'])
+		return Response(result['value'], status=status.HTTP_200_OK)
+
+
+class CounterReservationListApiView(APIView):
+	def post(self, request, **kwargs):
+		try:
+			value = get_positive_value(request.data)
+		except (KeyError, TypeError, ValueError):
+			message = {'value': 'must be a positive integer'}
+			return Response(message, status=status.HTTP_400_BAD_REQUEST)
+		try:
+			expires_in = int(request.data.get('expires_in', settings.RESERVATION_TTL))
+			if not 0 < expires_in <= settings.RESERVATION_MAX_TTL:
+				raise ValueError()
+		except (TypeError, ValueError):
+			message = {'expires_in': f"must be between 1 and {settings.RESERVATION_MAX_TTL} seconds"}
+			return Response(message, status=status.HTTP_400_BAD_REQUEST)
+
+		try:
+			counter = get_counter(kwargs['platform'], kwargs['element'], kwargs['counter'])
+		except Counter.DoesNotExist:
+			return Response(status=HTTP_441_NOT_EXIST)
+		if counter.element.moving:
+			return Response(MOVING_MESSAGE, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+		if counter.aggregates.all():
+			return Response(AGGREGATED_RESERVATION_MESSAGE, status=status.HTTP_400_BAD_REQUEST)
+		placement = get_placement(counter.element)
+
+		expires_at = int(time.time()) + expires_in
+		ttl = get_touch_ttl(counter.element)
+		result = reserve_counter(placement, kwargs['uid'], counter, value, expires_at, ttl)
+		if result['status'] != status.HTTP_200_OK:
+			return Response(status=result['status'])
+		reservation = {'id': result['id'], 'value': value, 'expires_at': expires_at}
+		return Response(reservation, status=status.HTTP_201_CREATED)
+
+
+class CounterReservationDetailApiView(APIView):
+	def post(self, request, **kwargs):
+		value = None
+		if 'value' in request.data:
+			try:
+				value = get_positive_value(request.data)
+			except (TypeError, ValueError):
+				message = {'value': 'must be a positive integer'}
+				return Response(message, status=status.HTTP_400_BAD_REQUEST)
+
+		try:
+			counter = get_counter(kwargs['platform'], kwargs['element'], kwargs['counter'])
+		except Counter.DoesNotExist:
+			return Response(status=HTTP_441_NOT_EXIST)
+		if counter.element.moving:
+			return Response(MOVING_MESSAGE, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+		if counter.aggregates.all():
+			return Response(AGGREGATED_RESERVATION_MESSAGE, status=status.HTTP_400_BAD_REQUEST)
+		placement = get_placement(counter.element)
+
+		ttl = get_touch_ttl(counter.element)
+		result = commit_reservation(placement, kwargs['uid'], counter, kwargs['reservation'], value, ttl)
+		if result['status'] != status.HTTP_200_OK:
+			return Response(status=result['status'])
+		update_top(placement, counter.id, kwargs['uid'], result['value'])
+		record_event(kwargs['platform'], kwargs['element'], kwargs['uid'], counter.slug, result['amount'])
+		publish_values(placement, kwargs['uid'], {counter: result['value']})
+		read_cache.write_through(placement, kwargs['uid'], counter, result['value'])
+		return Response(result['value'], status=status.HTTP_200_OK)
+
+	def delete(self, request, **kwargs):
+		try:
+			counter = get_counter(kwargs['platform'], kwargs['element'], kwargs['counter'])
+		except Counter.DoesNotExist:
+			return Response(status=HTTP_441_NOT_EXIST)
+		if counter.element.moving:
+			return Response(MOVING_MESSAGE, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+		placement = get_placement(counter.element)
+
+		result = release_reservation(
+			placement, kwargs['uid'], counter, kwargs['reservation'], get_touch_ttl(counter.element))
+		if result['status'] != status.HTTP_200_OK:
+			return Response(status=result['status'])
+		return Response(status=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,92 @@
+import concurrent.futures
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.urls import get_resolver
+
+from services.models import Platform, Element, Counter
+from services.placement import get_client, get_placement
+
+logger = logging.getLogger('django')
+
+lock = threading.Lock()
+state = {'ready': False, 'started': None, 'finished': None, 'error': None, 'attempts': 0, 'steps': {}}
+
+
+def load_urls():
+	# imports the views, serializers and the whole DRF stack behind them
+	get_resolver().url_patterns
+
+
+# a probe of the database: it runs the queries of the request paths once, so the connection and
+# the ORM query machinery work, but nothing is kept for the request threads
+def check_database():
+	Platform.objects.count()
+	Counter.objects.select_related('element__platform').first()
+	return list(Element.objects.select_related('platform'))
+
+
+def open_connections(elements):
+	for cluster in settings.AEROSPIKE_CLUSTERS:
+		get_client(cluster)
+	placements = {get_placement(element) for element in elements}
+	namespaces = {(placement.cluster, placement.namespace): placement for placement in placements}
+	# concurrent requests make the client open as many connections to every node
+	with concurrent.futures.ThreadPoolExecutor(max_workers=settings.WARM_UP_CONNECTIONS) as executor:
+		for placement in namespaces.values():
+			key = placement.key(0)
+			list(executor.map(lambda _: placement.client.exists(key), range(settings.WARM_UP_CONNECTIONS)))
+
+
+def timed(name, step, *args):
+	started = time.perf_counter()
+	result = step(*args)
+	state['steps'][name] = round((time.perf_counter() - started) * 1000, 1)
+	return result
+
+
+def run_steps():
+	timed('urls', load_urls)
+	elements = timed('database', check_database)
+	timed('aerospike', open_connections, elements)
+
+
+# Runs once per process from the wsgi/asgi entry points. A failed attempt, e.g. while Aerospike
+# is still unreachable at boot, is retried with backoff and readiness stays false until one succeeds.
+def warm_up(cleanup=None):
+	with lock:
+		if state['started'] is not None:
+			return
+		state['started'] = time.time()
+	delay = settings.WARM_UP_RETRY_DELAY
+	while True:
+		state['attempts'] += 1
+		try:
+			run_steps()
+		except Exception as e:
+			logger.exception("warm up failed, retrying in %s seconds", delay)
+			state['error'] = str(e)
+		else:
+			state.update(ready=True, error=None, finished=time.time())
+			return
+		finally:
+			if cleanup is not None:
+				cleanup()
+		time.sleep(delay)
+		delay = min(delay * 2, settings.WARM_UP_MAX_RETRY_DELAY)
+
+
+def run_warm_up():
+	# the connections of this thread would otherwise stay open for the life of the process
+	warm_up(cleanup=connections.close_all)
+
+
+def start_warm_up():
+	threading.Thread(target=run_warm_up, name='warm-up', daemon=True).start()
+
+
+def get_state():
+	return dict(state, steps=dict(state['steps']))